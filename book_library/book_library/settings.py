@@ -41,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'books.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -48,6 +49,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'books.static_homepage.StaticHomepageMiddleware',
 ]
 
 ROOT_URLCONF = 'book_library.urls'
@@ -82,6 +84,24 @@ DATABASES = {
 }
 
 
+# Cache
+# Файловый кэш общий для веб-процессов и воркера фоновых задач
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.django_cache',
+    }
+}
+
+
+# Tests
+# Тесты используют кэш в памяти процесса вместо файлового (см. books/test_runner.py)
+
+TEST_RUNNER = 'books.test_runner.TestRunner'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -122,3 +142,63 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Background tasks
+# Задержка (в секундах), на которую откладывается пересчет после изменения данных
+
+BOOKS_TASK_DEBOUNCE_SECONDS = 5
+
+# Срок захвата задачи воркером (в секундах): воркер продлевает его, пока задача выполняется,
+# задачу аварийно завершившегося воркера другой воркер забирает после истечения срока
+
+BOOKS_TASK_LOCK_SECONDS = 300
+
+# Change log
+# Записи журнала изменений хранятся не меньше RETENTION секунд (и пока их не прочитали потребители
+# с курсором в базе, обновленным за последние CONSUMER_TTL секунд); задача очистки повторяется
+# каждые PRUNE_INTERVAL секунд. GAP_TIMEOUT - ожидание пропуска в номерах записей для бэкендов,
+# кроме SQLite и PostgreSQL: должно быть больше самой долгой транзакции (см. books/changelog.py)
+
+BOOKS_CHANGELOG_RETENTION_SECONDS = 24 * 60 * 60
+BOOKS_CHANGELOG_CONSUMER_TTL = 7 * 24 * 60 * 60
+BOOKS_CHANGELOG_PRUNE_INTERVAL = 60 * 60
+BOOKS_CHANGELOG_GAP_TIMEOUT = 10 * 60
+
+# Query execution
+# Размер пула потоков для параллельного выполнения независимых запросов
+
+BOOKS_PARALLEL_QUERY_WORKERS = 8
+
+# Analytics
+# Файл снимка каталога для воркеров аналитики (python manage.py dump_snapshot)
+
+BOOKS_ANALYTICS_SNAPSHOT_PATH = BASE_DIR / 'snapshots' / 'catalog.snap'
+
+# Model display
+# Строгий режим: SQL-запрос внутри __str__ модели вызывает StrQueryError (см. books/display.py)
+
+BOOKS_STRICT_STR = False
+
+# Profiling
+# Выборочное профилирование запросов (см. books/profiling.py): заголовок X-Profile
+# учитывается только в режиме отладки, доля случайно профилируемых запросов - SAMPLE_RATE
+
+BOOKS_PROFILE_ALLOW_HEADER = DEBUG
+BOOKS_PROFILE_SAMPLE_RATE = 0.0
+BOOKS_PROFILE_MODE = 'sample'
+BOOKS_PROFILE_INTERVAL = 0.001
+BOOKS_PROFILE_DIR = BASE_DIR / 'profiles'
+
+# Rating counters
+# Количество частей счетчика оценок книги и время кэширования суммы (см. books/rating_counters.py)
+
+BOOKS_RATING_SHARDS = 8
+BOOKS_RATING_CACHE_SECONDS = 5
+
+# Static homepage
+# Режим публикации: главная страница отрисовывается в файлы (+ .gz/.br) после изменения
+# данных и отдается из них (см. books/static_homepage.py и python manage.py publish_homepage)
+
+BOOKS_HOMEPAGE_PUBLISH = False
+BOOKS_HOMEPAGE_PUBLISH_DIR = BASE_DIR / 'published'
@@ -1,9 +1,105 @@
 from django.contrib import admin
-from .models import Author, Book, Publisher, Store, Review
+from django.db.models import QuerySet
+from .fast_delete import cascade_counts, fast_delete
+from .models import (
+    Author, Book, City, Country, Publisher, Store, Review, Task, ChangeLogEntry, BookRecommendation,
+)
+
+
+# Сколько удаляемых объектов перечисляется на странице подтверждения
+DELETE_PREVIEW_SIZE = 20
+
+# Связи, которые __str__ модели выводит по загруженному объекту (см. display.py):
+# без них вместо названия страны или города выводится id
+LABEL_RELATED = {
+    Publisher: ('country',),
+    Store: ('city',),
+}
+
+
+def label_queryset(model):
+    """Объекты модели для вывода в виджетах и фильтрах: с загруженными связями __str__."""
+    return model._default_manager.select_related(*LABEL_RELATED.get(model, ()))
+
+
+class LabelRelatedMixin:
+    """
+    Выпадающие списки и виджеты ManyToMany загружают издательства
+    и магазины вместе со страной и городом одним запросом; так же
+    загружаются объекты страниц изменения и удаления (заголовок, журнал действий).
+    """
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        related = LABEL_RELATED.get(self.model)
+        return queryset.select_related(*related) if related else queryset
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.related_model in LABEL_RELATED and 'queryset' not in kwargs:
+            kwargs['queryset'] = label_queryset(db_field.related_model)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        if db_field.related_model in LABEL_RELATED and 'queryset' not in kwargs:
+            kwargs['queryset'] = label_queryset(db_field.related_model)
+        return super().formfield_for_manytomany(db_field, request, **kwargs)
+
+
+class LabelRelatedListFilter(admin.RelatedFieldListFilter):
+    """Фильтр по связи, варианты которого выводятся с загруженными связями __str__."""
+
+    def field_choices(self, field, request, model_admin):
+        queryset = label_queryset(field.related_model)
+        ordering = self.field_admin_ordering(field, request, model_admin)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        return [(obj.pk, str(obj)) for obj in queryset]
+
+
+class FastDeleteMixin:
+    """
+    Удаление без сбора зависимых объектов в Python (см. fast_delete.py).
+
+    Страница подтверждения (и для одного объекта, и для действия
+    «Удалить выбранные») показывает количество удаляемых строк по моделям
+    вместо списка всех книг и отзывов, а удаление выполняется одним DELETE
+    с каскадом в базе данных.
+    """
+
+    def get_deleted_objects(self, objs, request):
+        if isinstance(objs, QuerySet):
+            queryset = objs
+        else:
+            queryset = self.model._default_manager.filter(pk__in=[obj.pk for obj in objs])
+        counts = cascade_counts(queryset)
+
+        selected = counts.get(self.model, 0)
+        preview = queryset
+        if isinstance(self.list_select_related, (list, tuple)):
+            preview = queryset.select_related(*self.list_select_related)
+        deleted_objects = [str(obj) for obj in preview[:DELETE_PREVIEW_SIZE]]
+        if selected > len(deleted_objects):
+            deleted_objects.append(f'... и еще {selected - len(deleted_objects)}')
+
+        model_count = {model._meta.verbose_name_plural: count for model, count in counts.items()}
+        # Как в стандартной админке: права проверяются только для моделей,
+        # зарегистрированных в админке (служебные счетчики и сводки удаляются вместе с книгой)
+        perms_needed = {
+            model._meta.verbose_name for model in counts
+            if model in self.admin_site._registry
+            and not self.admin_site._registry[model].has_delete_permission(request)
+        }
+        return deleted_objects, model_count, perms_needed, []
+
+    def delete_model(self, request, obj):
+        fast_delete(self.model._default_manager.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        fast_delete(queryset)
 
 
 @admin.register(Author)
-class AuthorAdmin(admin.ModelAdmin):
+class AuthorAdmin(FastDeleteMixin, admin.ModelAdmin):
     """
     Административная панель для модели Author (Автор).
     """
@@ -11,34 +107,55 @@ class AuthorAdmin(admin.ModelAdmin):
     search_fields = ('name', 'bio')
 
 
+@admin.register(Country)
+class CountryAdmin(admin.ModelAdmin):
+    """
+    Административная панель для модели Country (Страна).
+    """
+    list_display = ('name',)
+    search_fields = ('name',)
+
+
+@admin.register(City)
+class CityAdmin(admin.ModelAdmin):
+    """
+    Административная панель для модели City (Город).
+    """
+    list_display = ('name',)
+    search_fields = ('name',)
+
+
 @admin.register(Publisher)
-class PublisherAdmin(admin.ModelAdmin):
+class PublisherAdmin(FastDeleteMixin, LabelRelatedMixin, admin.ModelAdmin):
     """
     Административная панель для модели Publisher (Издательство).
     """
     list_display = ('name', 'country')
-    list_filter = ('country',)  # Фильтр по стране
-    search_fields = ('name', 'country')
+    list_filter = ('country',)  # Фильтр по стране (по id справочника)
+    list_select_related = ('country',)
+    search_fields = ('name', 'country__name')
 
 
 @admin.register(Store)
-class StoreAdmin(admin.ModelAdmin):
+class StoreAdmin(LabelRelatedMixin, admin.ModelAdmin):
     """
     Административная панель для модели Store (Магазин).
     """
     list_display = ('name', 'city')
-    list_filter = ('city',)  # Фильтр по городу
-    search_fields = ('name', 'city')
+    list_filter = ('city',)  # Фильтр по городу (по id справочника)
+    list_select_related = ('city',)
+    search_fields = ('name', 'city__name')
 
 
 @admin.register(Book)
-class BookAdmin(admin.ModelAdmin):
+class BookAdmin(FastDeleteMixin, LabelRelatedMixin, admin.ModelAdmin):
     """
     Административная панель для модели Book (Книга).
     Включает связи с автором, издательством и магазинами.
     """
     list_display = ('title', 'author', 'publisher', 'published_date')
-    list_filter = ('published_date', 'publisher', 'author')
+    list_filter = ('published_date', ('publisher', LabelRelatedListFilter), 'author')
+    list_select_related = ('author', 'publisher__country')  # Издательство выводится со страной
     search_fields = ('title', 'author__name', 'publisher__name')
     filter_horizontal = ('stores',)  # Удобный виджет для ManyToMany поля
     date_hierarchy = 'published_date'  # Навигация по датам
@@ -53,6 +170,7 @@ class ReviewAdmin(admin.ModelAdmin):
     list_filter = ('rating', 'created_date')
     search_fields = ('book__title', 'comment')
     readonly_fields = ('created_date',)  # Дата создания только для чтения
+    list_select_related = ('book',)  # Название книги в __str__ без запроса на строку
     
     def comment_preview(self, obj):
         """
@@ -60,3 +178,44 @@ class ReviewAdmin(admin.ModelAdmin):
         """
         return obj.comment[:50] + '...' if len(obj.comment) > 50 else obj.comment
     comment_preview.short_description = 'Превью комментария'
+
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    """
+    Административная панель для модели Task (Фоновая задача).
+    """
+    list_display = ('name', 'status', 'priority', 'attempts', 'run_after', 'updated_date')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'dedup_key')
+    readonly_fields = ('created_date', 'updated_date', 'last_error')
+
+
+
+@admin.register(ChangeLogEntry)
+class ChangeLogEntryAdmin(admin.ModelAdmin):
+    """
+    Административная панель для модели ChangeLogEntry (Журнал изменений).
+    Записи создаются триггерами базы данных, поэтому доступны только для чтения.
+    """
+    list_display = ('id', 'table_name', 'operation', 'row_id', 'ref_id', 'created_date')
+    list_filter = ('table_name', 'operation')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+
+@admin.register(BookRecommendation)
+class BookRecommendationAdmin(admin.ModelAdmin):
+    """
+    Административная панель для модели BookRecommendation (Рекомендация).
+    Строки пересчитываются командой refresh_recommendations.
+    """
+    list_display = ('book', 'rank', 'recommended', 'score')
+    list_select_related = ('book', 'recommended')
+    raw_id_fields = ('book', 'recommended')
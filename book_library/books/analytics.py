@@ -0,0 +1,301 @@
+"""
+Модуль аналитики по колоночному снимку каталога в памяти.
+
+Книги, отзывы и связи книга-магазин один раз загружаются в массивы NumPy:
+- книги: id, дата публикации (порядковый номер дня), автор, издательство;
+- отзывы: id, id книги, оценка;
+- магазины книг: CSR-матрица смежности (indptr, indices) книга -> магазины;
+- города магазинов и страны издательств: коды в таблице строк strings.
+
+Отчетные запросы (книги по магазинам, магазины с книгами после года X,
+средняя оценка книг) считаются векторными операциями без обращения к базе.
+
+Снимок обновляется инкрементально: get_snapshot() читает журнал изменений
+(changelog.py) после курсора снимка и перечитывает из базы только
+измененные книги, отзывы и магазины.
+"""
+
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .changelog import ChangeLogPruned, iter_changes, latest_cursor
+from .date_ranges import year_start
+from .models import Book, Publisher, Review, Store
+
+
+BookStores = Book.stores.through
+
+# Имя курсора журнала изменений для файла снимка (см. manage.py dump_snapshot)
+SNAPSHOT_FILE_CURSOR = 'analytics_snapshot_file'
+
+# Значение внешнего ключа для книг без издательства
+NO_PUBLISHER = -1
+
+
+def _to_array(values, dtype):
+    return np.fromiter(values, dtype=dtype)
+
+
+class CatalogSnapshot:
+    """
+    Колоночный снимок каталога.
+
+    Строки книг отсортированы по id, поэтому позиция книги по id находится
+    бинарным поиском (np.searchsorted). Связи и отзывы хранят id книг
+    и переводятся в позиции при переиндексации (_reindex).
+    """
+
+    # Массивы снимка (сохраняются в файл, см. snapshot_file.py)
+    COLUMNS = (
+        'book_ids', 'book_published', 'book_author_ids', 'book_publisher_ids',
+        'store_ids', 'store_city_codes', 'publisher_ids', 'publisher_country_codes',
+        'review_ids', 'review_book_ids', 'review_ratings',
+        'link_book_ids', 'link_store_ids',
+        # Производные массивы, см. _reindex()
+        'review_book_pos', 'store_indptr', 'store_indices',
+    )
+
+    def __init__(self):
+        empty = np.empty(0, dtype=np.int64)
+        self.book_ids = empty
+        self.book_published = np.empty(0, dtype=np.int32)
+        self.book_author_ids = empty
+        self.book_publisher_ids = empty
+        self.store_ids = empty
+        self.store_city_codes = np.empty(0, dtype=np.int32)
+        self.publisher_ids = empty
+        self.publisher_country_codes = np.empty(0, dtype=np.int32)
+        self.strings = []
+        self.review_ids = empty
+        self.review_book_ids = empty
+        self.review_ratings = np.empty(0, dtype=np.int8)
+        self.link_book_ids = empty
+        self.link_store_ids = empty
+        # id последней учтенной записи журнала изменений
+        self.cursor = 0
+
+    # Загрузка
+
+    @classmethod
+    def load(cls):
+        """Загружает снимок целиком (шесть запросов)."""
+        snapshot = cls()
+        # Курсор берется до чтения данных: изменения, случившиеся во время
+        # загрузки, будут применены повторно, а перечитывание строк идемпотентно
+        snapshot.cursor = latest_cursor()
+        snapshot._set_books(Book.objects.order_by('id'))
+        snapshot._set_reviews(Review.objects.order_by())
+        snapshot._set_links(BookStores.objects.order_by('book_id', 'store_id'))
+        snapshot._set_stores_and_publishers()
+        snapshot._reindex()
+        return snapshot
+
+    def _intern(self, value):
+        """Код строки в таблице strings (строка добавляется при первом появлении)."""
+        try:
+            return self._string_codes[value]
+        except KeyError:
+            self._string_codes[value] = len(self.strings)
+            self.strings.append(value)
+            return self._string_codes[value]
+
+    def _set_stores_and_publishers(self):
+        self.strings = list(self.strings)
+        self._string_codes = {value: code for code, value in enumerate(self.strings)}
+
+        stores = list(Store.objects.order_by('id').values_list('id', 'city__name'))
+        self.store_ids = _to_array((row[0] for row in stores), np.int64)
+        self.store_city_codes = _to_array((self._intern(row[1]) for row in stores), np.int32)
+
+        publishers = list(Publisher.objects.order_by('id').values_list('id', 'country__name'))
+        self.publisher_ids = _to_array((row[0] for row in publishers), np.int64)
+        self.publisher_country_codes = _to_array((self._intern(row[1]) for row in publishers), np.int32)
+
+    def _set_books(self, queryset):
+        rows = list(queryset.values_list('id', 'published_date', 'author_id', 'publisher_id'))
+        self.book_ids = _to_array((row[0] for row in rows), np.int64)
+        self.book_published = _to_array((row[1].toordinal() for row in rows), np.int32)
+        self.book_author_ids = _to_array((row[2] for row in rows), np.int64)
+        self.book_publisher_ids = _to_array(
+            (NO_PUBLISHER if row[3] is None else row[3] for row in rows), np.int64
+        )
+
+    def _set_reviews(self, queryset):
+        rows = list(queryset.values_list('id', 'book_id', 'rating'))
+        self.review_ids = _to_array((row[0] for row in rows), np.int64)
+        self.review_book_ids = _to_array((row[1] for row in rows), np.int64)
+        self.review_ratings = _to_array((row[2] for row in rows), np.int8)
+
+    def _set_links(self, queryset):
+        rows = list(queryset.values_list('book_id', 'store_id'))
+        self.link_book_ids = _to_array((row[0] for row in rows), np.int64)
+        self.link_store_ids = _to_array((row[1] for row in rows), np.int64)
+
+    def _reindex(self):
+        """Пересчитывает позиции отзывов и CSR-матрицу магазинов после изменений."""
+        self.review_book_pos = np.searchsorted(self.book_ids, self.review_book_ids)
+
+        link_book_pos = np.searchsorted(self.book_ids, self.link_book_ids)
+        order = np.argsort(link_book_pos, kind='stable')
+        self.store_indices = np.searchsorted(self.store_ids, self.link_store_ids[order])
+        counts = np.bincount(link_book_pos, minlength=len(self.book_ids))
+        self.store_indptr = np.zeros(len(self.book_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.store_indptr[1:])
+
+    # Инкрементальное обновление
+
+    def apply_changes(self, book_ids=(), review_ids=(), stores_changed=False):
+        """
+        Перечитывает из базы указанные книги (вместе с их магазинами) и отзывы,
+        а при stores_changed - списки магазинов и издательств.
+        Строки, которых больше нет в базе, удаляются из снимка.
+        """
+        book_ids = np.asarray(sorted(book_ids), dtype=np.int64)
+        review_ids = np.asarray(sorted(review_ids), dtype=np.int64)
+
+        if len(book_ids):
+            fresh = CatalogSnapshot()
+            fresh._set_books(Book.objects.filter(id__in=book_ids.tolist()))
+            fresh._set_links(BookStores.objects.filter(book_id__in=book_ids.tolist()))
+
+            keep = ~np.isin(self.book_ids, book_ids)
+            columns = ('book_ids', 'book_published', 'book_author_ids', 'book_publisher_ids')
+            merged = {
+                name: np.concatenate([getattr(self, name)[keep], getattr(fresh, name)])
+                for name in columns
+            }
+            order = np.argsort(merged['book_ids'], kind='stable')
+            for name in columns:
+                setattr(self, name, merged[name][order])
+
+            keep_links = ~np.isin(self.link_book_ids, book_ids)
+            self.link_book_ids = np.concatenate([self.link_book_ids[keep_links], fresh.link_book_ids])
+            self.link_store_ids = np.concatenate([self.link_store_ids[keep_links], fresh.link_store_ids])
+
+            # Отзывы удаленных книг удаляются каскадом
+            alive = np.isin(self.review_book_ids, self.book_ids)
+            self._filter_reviews(alive)
+
+        if len(review_ids):
+            fresh = CatalogSnapshot()
+            fresh._set_reviews(Review.objects.filter(id__in=review_ids.tolist()).order_by())
+            self._filter_reviews(~np.isin(self.review_ids, review_ids))
+            self.review_ids = np.concatenate([self.review_ids, fresh.review_ids])
+            self.review_book_ids = np.concatenate([self.review_book_ids, fresh.review_book_ids])
+            self.review_ratings = np.concatenate([self.review_ratings, fresh.review_ratings])
+
+        if stores_changed:
+            self._set_stores_and_publishers()
+            alive = np.isin(self.link_store_ids, self.store_ids)
+            self.link_book_ids = self.link_book_ids[alive]
+            self.link_store_ids = self.link_store_ids[alive]
+
+        self._reindex()
+
+    def catch_up(self):
+        """Применяет изменения из журнала после курсора снимка."""
+        book_ids, review_ids, stores_changed = set(), set(), False
+        cursor = self.cursor
+        for batch in iter_changes(cursor):
+            for entry in batch:
+                if entry.table_name in ('books_book', 'books_book_stores'):
+                    book_ids.add(entry.row_id)
+                elif entry.table_name == 'books_review':
+                    review_ids.add(entry.row_id)
+                elif entry.table_name in ('books_store', 'books_publisher', 'books_city', 'books_country'):
+                    stores_changed = True
+            cursor = batch[-1].id
+
+        if book_ids or review_ids or stores_changed:
+            self.apply_changes(book_ids, review_ids, stores_changed)
+        self.cursor = cursor
+
+    def _filter_reviews(self, mask):
+        self.review_ids = self.review_ids[mask]
+        self.review_book_ids = self.review_book_ids[mask]
+        self.review_ratings = self.review_ratings[mask]
+
+    # Отчетные запросы
+
+    def store_cities(self):
+        """Города магазинов в порядке store_ids."""
+        return [self.strings[code] for code in self.store_city_codes.tolist()]
+
+    def books_count_by_store(self):
+        """
+        Количество книг в каждом магазине: [(store_id, количество)]
+        по убыванию количества (аналог queries.books_count_by_store).
+        """
+        counts = np.bincount(self.store_indices, minlength=len(self.store_ids))
+        order = np.argsort(-counts, kind='stable')
+        return list(zip(self.store_ids[order].tolist(), counts[order].tolist()))
+
+    def stores_by_publication_date(self, year):
+        """
+        Магазины с книгами, изданными после year: [(store_id, количество таких книг)]
+        по убыванию количества (аналог queries.stores_by_publication_date).
+        """
+        recent = self.book_published >= year_start(year + 1).toordinal()
+        link_mask = np.repeat(recent, np.diff(self.store_indptr))
+        counts = np.bincount(self.store_indices[link_mask], minlength=len(self.store_ids))
+        found = np.flatnonzero(counts)
+        order = found[np.argsort(-counts[found], kind='stable')]
+        return list(zip(self.store_ids[order].tolist(), counts[order].tolist()))
+
+    def average_rating_per_book(self):
+        """
+        Средняя оценка каждой книги: (book_ids, средние, количество отзывов).
+        У книг без отзывов средняя оценка NaN.
+        """
+        size = len(self.book_ids)
+        counts = np.bincount(self.review_book_pos, minlength=size)
+        sums = np.bincount(self.review_book_pos, weights=self.review_ratings, minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            averages = sums / counts
+        return self.book_ids, averages, counts
+
+    def books_by_average_rating(self, min_rating):
+        """
+        Книги со средней оценкой выше min_rating: [(book_id, средняя оценка)]
+        по убыванию оценки (аналог queries.books_by_average_rating).
+        """
+        book_ids, averages, counts = self.average_rating_per_book()
+        found = np.flatnonzero((counts > 0) & (averages > min_rating))
+        order = found[np.argsort(-averages[found], kind='stable')]
+        return list(zip(book_ids[order].tolist(), averages[order].tolist()))
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def snapshot_path():
+    """Путь к файлу снимка из настроек (см. manage.py dump_snapshot) или None."""
+    return getattr(settings, 'BOOKS_ANALYTICS_SNAPSHOT_PATH', None)
+
+
+def get_snapshot():
+    """
+    Возвращает снимок процесса: при первом обращении отображает в память
+    файл снимка (если он есть) или загружает снимок из базы,
+    далее догоняет журнал изменений (если непрочитанные записи журнала
+    уже удалены - загружает снимок из базы заново).
+    """
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None:
+            path = snapshot_path()
+            if path and os.path.exists(path):
+                from .snapshot_file import read_snapshot
+                _snapshot = read_snapshot(path)
+            else:
+                _snapshot = CatalogSnapshot.load()
+        try:
+            _snapshot.catch_up()
+        except ChangeLogPruned:
+            # Журнал очищен дальше курсора снимка (например, старого файла)
+            _snapshot = CatalogSnapshot.load()
+        return _snapshot
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class BooksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'books'
+
+    def ready(self):
+        # Подключаем обработчики сигналов
+        from . import signals  # noqa: F401
+
+        # Наблюдение за SQL-запросами (профилирование, нагрузочные тесты)
+        from django.db.backends.signals import connection_created
+        from .query_observers import install
+        connection_created.connect(install, dispatch_uid='books_query_observers')
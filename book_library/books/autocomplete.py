@@ -0,0 +1,265 @@
+"""
+Модуль автодополнения названий книг и имен авторов.
+
+Названия и имена нормализуются (casefold, «ё» -> «е», знаки препинания
+заменяются пробелами) и записываются в отсортированный массив ключей.
+Для каждого слова текста добавляется ключ, начинающийся с этого слова,
+поэтому «пот» находит «Гарри Поттер и философский камень». Запрос
+по префиксу - два двоичных поиска (bisect) по массиву, база данных
+не используется.
+
+Подсказки ранжируются по популярности: книги - по количеству отзывов,
+авторы - по количеству отзывов на их книги. Для префиксов из SHORT_PREFIX
+символов диапазон ключей велик, поэтому для них хранятся списки
+подсказок, отсортированные по рангу.
+
+Индекс строится лениво в каждом процессе и далее обновляется
+инкрементально. После изменения книг, авторов и отзывов обработчики
+сигналов меняют версию в общем кэше; увидев новую версию, процесс
+читает журнал изменений (changelog.py) после курсора индекса и заново
+вставляет только подсказки измененных книг и авторов. Пока версия
+не меняется, запрос к индексу не обращается к базе данных.
+"""
+
+import bisect
+import heapq
+import re
+import threading
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db.models import Count
+
+from .changelog import ChangeLogPruned, iter_changes, latest_cursor
+from .models import Author, Book
+
+
+AUTOCOMPLETE_INDEX_VERSION_KEY = 'books:autocomplete_index_version'
+
+# Префиксы такой длины и короче обслуживаются заранее вычисленными списками
+SHORT_PREFIX = 2
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize(text):
+    """Текст для сравнения: 'Ёжик  в тумане!' -> 'ежик в тумане'."""
+    return ' '.join(_NON_WORD.sub(' ', text.casefold().replace('ё', 'е')).split())
+
+
+def word_keys(text):
+    """Ключи текста: нормализованный текст, начиная с каждого слова."""
+    words = normalize(text).split()
+    return [' '.join(words[position:]) for position in range(len(words))]
+
+
+def short_prefixes(keys):
+    """Короткие префиксы ключей (не длиннее SHORT_PREFIX символов)."""
+    return {key[:length] for key in keys for length in range(1, min(SHORT_PREFIX, len(key)) + 1)}
+
+
+def rank(suggestion):
+    """Ключ сортировки подсказок: больше отзывов - раньше, затем по алфавиту."""
+    return (-suggestion['score'], normalize(suggestion['label']), suggestion['type'], suggestion['id'])
+
+
+def _prefix_end(prefix):
+    """Наименьшая строка, которая больше всех строк с префиксом prefix."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class AutocompleteIndex:
+    """
+    Отсортированный массив ключей с подсказками.
+
+    Подсказка определяется парой (тип, id); ее ранг - кортеж rank(),
+    последние два элемента которого - та же пара.
+    """
+
+    def __init__(self, suggestions, version=None):
+        """
+        suggestions - список словарей {'type', 'id', 'label', 'score'};
+        ключи строятся по label.
+        """
+        self.version = version
+        # id последней учтенной записи журнала изменений
+        self.cursor = 0
+        self.suggestions = {}
+        self.ranks = {}
+
+        pairs = []
+        short = defaultdict(list)
+        for suggestion in suggestions:
+            owner = (suggestion['type'], suggestion['id'])
+            self.suggestions[owner] = suggestion
+            self.ranks[owner] = rank(suggestion)
+            keys = word_keys(suggestion['label'])
+            pairs.extend((key, owner) for key in keys)
+            for prefix in short_prefixes(keys):
+                short[prefix].append(self.ranks[owner])
+        pairs.sort()
+        self.keys = [key for key, _ in pairs]
+        self.owners = [owner for _, owner in pairs]
+        self.short_prefixes = {prefix: sorted(ranks) for prefix, ranks in short.items()}
+
+    @classmethod
+    def build(cls, version=None):
+        """Строит индекс двумя запросами: книги и авторы с количеством отзывов."""
+        cursor = latest_cursor()
+        index = cls(load_suggestions(), version)
+        index.cursor = cursor
+        return index
+
+    def add(self, suggestion):
+        """Добавляет подсказку (двоичные вставки в массив ключей и списки коротких префиксов)."""
+        owner = (suggestion['type'], suggestion['id'])
+        self.suggestions[owner] = suggestion
+        self.ranks[owner] = suggestion_rank = rank(suggestion)
+        keys = word_keys(suggestion['label'])
+        for key in keys:
+            position = bisect.bisect_right(self.keys, key)
+            self.keys.insert(position, key)
+            self.owners.insert(position, owner)
+        for prefix in short_prefixes(keys):
+            bisect.insort(self.short_prefixes.setdefault(prefix, []), suggestion_rank)
+
+    def remove(self, kind, object_id):
+        """Удаляет подсказку, если она есть в индексе."""
+        owner = (kind, object_id)
+        suggestion = self.suggestions.pop(owner, None)
+        if suggestion is None:
+            return
+        suggestion_rank = self.ranks.pop(owner)
+        keys = word_keys(suggestion['label'])
+        for key in keys:
+            position = bisect.bisect_left(self.keys, key)
+            while self.owners[position] != owner:
+                position += 1
+            del self.keys[position]
+            del self.owners[position]
+        for prefix in short_prefixes(keys):
+            ranks = self.short_prefixes[prefix]
+            del ranks[bisect.bisect_left(ranks, suggestion_rank)]
+            if not ranks:
+                del self.short_prefixes[prefix]
+
+    def update(self, kind, object_id, suggestion):
+        """Заменяет подсказку; suggestion=None удаляет ее."""
+        if suggestion is not None and self.suggestions.get((kind, object_id)) == suggestion:
+            return
+        self.remove(kind, object_id)
+        if suggestion is not None:
+            self.add(suggestion)
+
+    def catch_up(self):
+        """
+        Применяет изменения из журнала после курсора индекса:
+        перечитывает подсказки измененных книг и авторов.
+        """
+        book_ids, author_ids = set(), set()
+        cursor = self.cursor
+        for batch in iter_changes(cursor):
+            for entry in batch:
+                if entry.table_name == 'books_book':
+                    # ref_id - автор книги: от ее отзывов зависит и его ранг
+                    book_ids.add(entry.row_id)
+                    author_ids.add(entry.ref_id)
+                elif entry.table_name == 'books_review':
+                    book_ids.add(entry.ref_id)
+                elif entry.table_name == 'books_author':
+                    author_ids.add(entry.row_id)
+            cursor = batch[-1].id
+
+        book_ids.discard(None)
+        if book_ids:
+            books = load_suggestions(Book.objects.filter(id__in=book_ids), Author.objects.none())
+            fresh = {suggestion['id']: suggestion for suggestion in books}
+            # Авторы книг, изменившихся без записи в журнале книги (новые отзывы)
+            author_ids.update(Book.objects.filter(id__in=book_ids).values_list('author_id', flat=True))
+            for book_id in book_ids:
+                self.update('book', book_id, fresh.get(book_id))
+
+        author_ids.discard(None)
+        if author_ids:
+            authors = load_suggestions(Book.objects.none(), Author.objects.filter(id__in=author_ids))
+            fresh = {suggestion['id']: suggestion for suggestion in authors}
+            for author_id in author_ids:
+                self.update('author', author_id, fresh.get(author_id))
+        self.cursor = cursor
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """Подсказки, у которых какое-либо слово начинается с query, по убыванию ранга."""
+        prefix = normalize(query)
+        if not prefix or limit <= 0:
+            return []
+
+        if len(prefix) <= SHORT_PREFIX:
+            ranks = self.short_prefixes.get(prefix, [])[:limit]
+        else:
+            start = bisect.bisect_left(self.keys, prefix)
+            end = bisect.bisect_left(self.keys, _prefix_end(prefix), start)
+            ranks = heapq.nsmallest(limit, {self.ranks[owner] for owner in self.owners[start:end]})
+        return [self.suggestions[suggestion_rank[2:]] for suggestion_rank in ranks]
+
+
+def load_suggestions(books=None, authors=None):
+    """Подсказки книг и авторов querysets books и authors (по умолчанию - всех) с количеством отзывов."""
+    books = Book.objects.all() if books is None else books
+    authors = Author.objects.all() if authors is None else authors
+    books = books.annotate(score=Count('reviews')).values_list('id', 'title', 'score')
+    authors = authors.annotate(score=Count('books__reviews')).values_list('id', 'name', 'score')
+    return [
+        {'type': 'book', 'id': book_id, 'label': title, 'score': score}
+        for book_id, title, score in books
+    ] + [
+        {'type': 'author', 'id': author_id, 'label': name, 'score': score}
+        for author_id, name, score in authors
+    ]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def mark_autocomplete_changed():
+    """Сообщает процессам, что подсказки изменились и индексам пора прочитать журнал."""
+    cache.set(AUTOCOMPLETE_INDEX_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+@contextmanager
+def autocomplete_index():
+    """
+    Актуальный индекс процесса: при первом обращении (и если версии
+    нет в кэше) индекс строится, при смене версии догоняет журнал
+    изменений (если непрочитанные записи журнала уже удалены - строится
+    заново). Индекс меняется на месте, поэтому, как и в facets.py,
+    пока блок with выполняется, другие потоки его не меняют и не читают.
+    """
+    global _index
+    version = cache.get(AUTOCOMPLETE_INDEX_VERSION_KEY)
+    rebuild = version is None
+    if rebuild:
+        # Версии нет в кэше (кэш очищен): неизвестно, что успело измениться
+        version = uuid.uuid4().hex
+        cache.add(AUTOCOMPLETE_INDEX_VERSION_KEY, version, None)
+        version = cache.get(AUTOCOMPLETE_INDEX_VERSION_KEY, version)
+
+    with _index_lock:
+        if _index is None or rebuild:
+            _index = AutocompleteIndex.build(version)
+        elif _index.version != version:
+            try:
+                _index.catch_up()
+            except ChangeLogPruned:
+                _index = AutocompleteIndex.build(version)
+            else:
+                # Если журнал прочитан не до конца (незавершенная транзакция
+                # оставила пропуск), версия не запоминается и следующий
+                # запрос продолжит чтение
+                _index.version = version if _index.cursor >= latest_cursor() else None
+        yield _index
@@ -0,0 +1,177 @@
+"""
+Модуль сборки JSON-документа книги одним SQL-запросом.
+
+Документ книги (автор, издательство, магазины, последние отзывы и сводка
+оценок) собирается JSON-функциями базы данных: json_object /
+json_group_array в SQLite и jsonb_build_object / jsonb_agg в PostgreSQL.
+Запрос возвращает готовый текст JSON, который передается в ответ
+без создания объектов моделей и без повторной сериализации в Python.
+
+Структура документа:
+    {"id", "title", "published_date", "description",
+     "author": {"id", "name"},
+     "publisher": {"id", "name", "country"} или null,
+     "stores": [{"id", "name", "city"}, ...]          (по названию),
+     "rating": {"average", "count"},                   (см. rating_counters.py)
+     "reviews": [{"id", "rating", "comment", "created_date"}, ...],
+                                                       (новые первыми)
+     "recommendations": [{"id", "title", "score"}, ...]}
+                                                       (см. recommendations.py)
+
+Полный список отзывов - в ленте /books/<id>/reviews/ (см. pagination.py).
+"""
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .models import Author, Book, BookRatingShard, BookRecommendation, City, Country, Publisher, Review, Store
+
+
+# Сколько последних отзывов включается в документ
+DOCUMENT_REVIEWS = 10
+
+
+def _tables():
+    return {
+        'book': Book._meta.db_table,
+        'author': Author._meta.db_table,
+        'publisher': Publisher._meta.db_table,
+        'country': Country._meta.db_table,
+        'city': City._meta.db_table,
+        'store': Store._meta.db_table,
+        'review': Review._meta.db_table,
+        'rating_shard': BookRatingShard._meta.db_table,
+        'book_stores': Book.stores.through._meta.db_table,
+        'recommendation': BookRecommendation._meta.db_table,
+    }
+
+
+# Результат json_object() внутри подзапроса теряет признак JSON,
+# поэтому значения подзапросов оборачиваются в json()
+SQLITE_DOCUMENT = """
+SELECT json_object(
+    'id', b.id,
+    'title', b.title,
+    'published_date', b.published_date,
+    'description', b.description,
+    'author', json_object('id', a.id, 'name', a.name),
+    'publisher', CASE WHEN p.id IS NULL THEN NULL
+                      ELSE json_object('id', p.id, 'name', p.name, 'country', pc.name) END,
+    'stores', json((
+        SELECT json_group_array(json(item)) FROM (
+            SELECT json_object('id', s.id, 'name', s.name, 'city', sc.name) AS item
+            FROM {book_stores} bs JOIN {store} s ON s.id = bs.store_id
+            JOIN {city} sc ON sc.id = s.city_id
+            WHERE bs.book_id = b.id
+            ORDER BY s.name, s.id
+        )
+    )),
+    'rating', json((
+        SELECT json_object(
+            'average', round(CAST(sum(rs.total) AS REAL) / nullif(sum(rs.count), 0), 2),
+            'count', coalesce(sum(rs.count), 0)
+        )
+        FROM {rating_shard} rs WHERE rs.book_id = b.id
+    )),
+    'reviews', json((
+        SELECT json_group_array(json(item)) FROM (
+            SELECT json_object(
+                'id', r.id, 'rating', r.rating, 'comment', r.comment,
+                'created_date', replace(r.created_date, ' ', 'T') || '+00:00'
+            ) AS item
+            FROM {review} r
+            WHERE r.book_id = b.id
+            ORDER BY r.created_date DESC, r.id DESC
+            LIMIT %s
+        )
+    )),
+    'recommendations', json((
+        SELECT json_group_array(json(item)) FROM (
+            SELECT json_object('id', rb.id, 'title', rb.title, 'score', round(rec.score, 4)) AS item
+            FROM {recommendation} rec JOIN {book} rb ON rb.id = rec.recommended_id
+            WHERE rec.book_id = b.id
+            ORDER BY rec.rank
+        )
+    ))
+)
+FROM {book} b
+JOIN {author} a ON a.id = b.author_id
+LEFT JOIN {publisher} p ON p.id = b.publisher_id
+LEFT JOIN {country} pc ON pc.id = p.country_id
+WHERE b.id = %s
+"""
+
+POSTGRESQL_DOCUMENT = """
+SELECT jsonb_build_object(
+    'id', b.id,
+    'title', b.title,
+    'published_date', b.published_date,
+    'description', b.description,
+    'author', jsonb_build_object('id', a.id, 'name', a.name),
+    'publisher', CASE WHEN p.id IS NULL THEN NULL
+                      ELSE jsonb_build_object('id', p.id, 'name', p.name, 'country', pc.name) END,
+    'stores', (
+        SELECT COALESCE(jsonb_agg(
+            jsonb_build_object('id', s.id, 'name', s.name, 'city', sc.name) ORDER BY s.name, s.id
+        ), '[]'::jsonb)
+        FROM {book_stores} bs JOIN {store} s ON s.id = bs.store_id
+        JOIN {city} sc ON sc.id = s.city_id
+        WHERE bs.book_id = b.id
+    ),
+    'rating', (
+        SELECT jsonb_build_object(
+            'average', round(sum(rs.total)::numeric / nullif(sum(rs.count), 0), 2),
+            'count', coalesce(sum(rs.count), 0)
+        )
+        FROM {rating_shard} rs WHERE rs.book_id = b.id
+    ),
+    'reviews', (
+        SELECT COALESCE(jsonb_agg(
+            jsonb_build_object(
+                'id', r.id, 'rating', r.rating, 'comment', r.comment, 'created_date', r.created_date
+            ) ORDER BY r.created_date DESC, r.id DESC
+        ), '[]'::jsonb)
+        FROM (
+            SELECT * FROM {review}
+            WHERE book_id = b.id
+            ORDER BY created_date DESC, id DESC
+            LIMIT %s
+        ) r
+    ),
+    'recommendations', (
+        SELECT COALESCE(jsonb_agg(
+            jsonb_build_object('id', rb.id, 'title', rb.title, 'score', round(rec.score::numeric, 4))
+            ORDER BY rec.rank
+        ), '[]'::jsonb)
+        FROM {recommendation} rec JOIN {book} rb ON rb.id = rec.recommended_id
+        WHERE rec.book_id = b.id
+    )
+)::text
+FROM {book} b
+JOIN {author} a ON a.id = b.author_id
+LEFT JOIN {publisher} p ON p.id = b.publisher_id
+LEFT JOIN {country} pc ON pc.id = p.country_id
+WHERE b.id = %s
+"""
+
+DOCUMENT_SQL = {
+    'sqlite': SQLITE_DOCUMENT,
+    'postgresql': POSTGRESQL_DOCUMENT,
+}
+
+
+def book_document_sql(vendor):
+    """Текст запроса документа книги для бэкенда базы данных."""
+    try:
+        template = DOCUMENT_SQL[vendor]
+    except KeyError:
+        raise NotImplementedError(f"Бэкенд {vendor} не поддерживается")
+    return template.format(**_tables())
+
+
+def fetch_book_document(book_id, reviews=DOCUMENT_REVIEWS, using=DEFAULT_DB_ALIAS):
+    """Возвращает документ книги как текст JSON или None, если книги нет."""
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute(book_document_sql(connection.vendor), [reviews, book_id])
+        row = cursor.fetchone()
+    return row[0] if row else None
@@ -0,0 +1,222 @@
+"""
+Модуль чтения журнала изменений каталога (change data capture).
+
+Триггеры базы данных записывают каждое добавление, изменение и удаление
+строк Author, Publisher, Store, Book, Review и связей книга-магазин
+в таблицу ChangeLogEntry. Потребители (кэши, индексы, агрегаты) хранят
+курсор - id последней обработанной записи - и читают изменения после него
+пакетами вместо полного пересканирования таблиц:
+
+    cursor = 0
+    for batch in iter_changes(cursor):
+        process(batch)
+        cursor = batch[-1].id
+
+Потребители, курсор которых переживает перезапуск процессов, сохраняют
+его в базе (save_cursor): периодическая задача prune_changelog() удаляет
+только записи старше срока хранения, которые уже прочитали все они.
+Потребитель, отставший дальше удаленных записей, получает ChangeLogPruned
+и перестраивает свое состояние полностью.
+
+Триггеры создают миграции (0004, 0009, 0015, 0016), каждая со своим SQL,
+чтобы изменение этого модуля не меняло уже примененные миграции.
+Колонки записей журнала по таблицам:
+
+    таблица               row_id     ref_id
+    books_book            id         author_id
+    books_review          id         book_id
+    books_book_stores     book_id    store_id
+    остальные             id         NULL
+
+Если изменение строки меняет ref_id, в журнал пишется еще одна запись 'U'
+со старым значением, чтобы потребитель узнал и о прежней связи.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import ChangeLogCursor, ChangeLogEntry
+
+
+# Через сколько секунд пропуск в номерах записей считается откатом транзакции
+# на бэкендах без проверки по активным транзакциям (см. _gap_settled)
+GAP_TIMEOUT = 10 * 60
+
+# Курсор с границей удаленных записей (см. prune_changelog)
+PRUNED = 'pruned'
+
+
+class ChangeLogPruned(Exception):
+    """Записи после курсора потребителя уже удалены: потребитель должен перестроить свое состояние."""
+
+
+def gap_timeout_seconds():
+    return getattr(settings, 'BOOKS_CHANGELOG_GAP_TIMEOUT', GAP_TIMEOUT)
+
+
+def latest_cursor():
+    """Курсор, соответствующий текущему концу журнала."""
+    return ChangeLogEntry.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def get_cursor(name):
+    """Курсор потребителя name, сохраненный в базе, или None."""
+    return ChangeLogCursor.objects.filter(name=name).values_list('cursor', flat=True).first()
+
+
+def save_cursor(name, cursor):
+    """Сохраняет курсор потребителя name: до него записи журнала можно удалять."""
+    ChangeLogCursor.objects.update_or_create(name=name, defaults={'cursor': cursor})
+
+
+def pruned_cursor():
+    """Граница удаленных записей журнала: записи с id не больше нее уже удалены."""
+    return get_cursor(PRUNED) or 0
+
+
+def _oldest_write_transaction(connection):
+    """Время начала самой старой незавершенной пишущей транзакции PostgreSQL (кроме своей) или None."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT min(xact_start) FROM pg_stat_activity '
+            'WHERE backend_xid IS NOT NULL AND pid <> pg_backend_pid()'
+        )
+        return cursor.fetchone()[0]
+
+
+def _gap_settled(entry, timeout):
+    """
+    Может ли еще появиться запись с номером меньше entry.id (перед entry пропуск).
+
+    - SQLite: пишущая транзакция блокирует базу до фиксации, номера фиксируются
+      по порядку, и пропуск может быть только откатом.
+    - PostgreSQL: номер из пропуска выдан транзакции, которая началась раньше,
+      чем entry получила номер и время created_date (clock_timestamp() вычисляется
+      после номера). Пропуск окончателен, если таких транзакций больше нет -
+      независимо от того, сколько длится транзакция.
+    - Остальные бэкенды: пропуск старше timeout секунд считается откатом.
+    """
+    connection = connections[ChangeLogEntry.objects.db]
+    if connection.vendor == 'sqlite':
+        return True
+    if connection.vendor == 'postgresql':
+        oldest = _oldest_write_transaction(connection)
+        return oldest is None or oldest >= entry.created_date
+    return entry.created_date <= timezone.now() - timedelta(seconds=timeout)
+
+
+def read_changes(cursor=0, limit=1000, gap_timeout=None):
+    """
+    Возвращает до limit записей журнала с id больше cursor по возрастанию id.
+
+    Номера выдаются при вставке, а видимыми записи становятся при фиксации
+    транзакции, поэтому в PostgreSQL запись с меньшим номером может появиться
+    позже записи с большим. Чтобы не пропустить ее, чтение останавливается
+    перед первым пропуском в номерах, пока его транзакция может быть
+    не зафиксирована (см. _gap_settled).
+
+    Если записи после cursor уже удалены (prune_changelog), возбуждается ChangeLogPruned.
+    """
+    timeout = gap_timeout_seconds() if gap_timeout is None else gap_timeout
+    entries = list(ChangeLogEntry.objects.filter(id__gt=cursor).order_by('id')[:limit])
+    if entries and entries[0].id != cursor + 1 and cursor < pruned_cursor():
+        raise ChangeLogPruned(f'Записи журнала после {cursor} удалены')
+
+    expected = cursor + 1
+    for position, entry in enumerate(entries):
+        if entry.id != expected and not _gap_settled(entry, timeout):
+            return entries[:position]
+        expected = entry.id + 1
+    return entries
+
+
+def iter_changes(cursor=0, batch_size=1000, gap_timeout=None):
+    """Итерирует по всем доступным изменениям после cursor пакетами."""
+    while True:
+        batch = read_changes(cursor, batch_size, gap_timeout)
+        if not batch:
+            return
+        yield batch
+        cursor = batch[-1].id
+
+
+def prune_changes(before_cursor):
+    """
+    Удаляет записи журнала с id не больше before_cursor
+    (их уже обработали все потребители). Возвращает количество удаленных.
+    """
+    deleted, _ = ChangeLogEntry.objects.filter(id__lte=before_cursor).delete()
+    return deleted
+
+
+def prune_changelog():
+    """
+    Удаляет записи журнала, которые больше не нужны потребителям
+    (выполняется периодической задачей books.prune_changelog):
+    - только записи старше BOOKS_CHANGELOG_RETENTION_SECONDS: индексы в памяти
+      процессов (фасеты, автодополнение, аналитика) читают журнал постоянно,
+      а отставший дольше процесс получает ChangeLogPruned и перестраивается;
+    - не дальше курсоров потребителей, сохраненных в базе (save_cursor):
+      рекомендаций и файла снимка аналитики. Курсор, который не обновлялся
+      BOOKS_CHANGELOG_CONSUMER_TTL секунд, не учитывается;
+    - последняя запись журнала не удаляется, чтобы пустой результат
+      read_changes() всегда означал отсутствие новых изменений.
+    Возвращает количество удаленных записей.
+    """
+    now = timezone.now()
+    retention = getattr(settings, 'BOOKS_CHANGELOG_RETENTION_SECONDS', 24 * 60 * 60)
+    consumer_ttl = getattr(settings, 'BOOKS_CHANGELOG_CONSUMER_TTL', 7 * 24 * 60 * 60)
+
+    before = ChangeLogEntry.objects.filter(
+        created_date__lt=now - timedelta(seconds=retention)
+    ).order_by('-id').values_list('id', flat=True).first()
+    if before is None:
+        return 0
+    before = min(before, latest_cursor() - 1)
+    held = ChangeLogCursor.objects.exclude(name=PRUNED).filter(
+        updated_date__gte=now - timedelta(seconds=consumer_ttl)
+    ).aggregate(cursor=Min('cursor'))['cursor']
+    if held is not None:
+        before = min(before, held)
+    if before <= pruned_cursor():
+        return 0
+
+    with transaction.atomic():
+        # Граница сохраняется вместе с удалением: потребитель с курсором
+        # до нее узнает об удаленных записях (ChangeLogPruned)
+        save_cursor(PRUNED, before)
+        return prune_changes(before)
+
+
+# Триггеры журнала (вызываются из миграций)
+
+def execute_trigger_sql(schema_editor, tables, statements, ref_statements=None):
+    """
+    Выполняет SQL триггеров журнала миграции для таблиц tables
+    ({имя таблицы: (колонка row_id, колонка ref_id или None)}).
+
+    statements и ref_statements - {vendor базы данных: шаблоны SQL};
+    шаблоны ref_statements выполняются только для таблиц с колонкой ref_id.
+    В шаблоны подставляются table, row_column, ref_column ('' без колонки),
+    new_ref и old_ref (NEW.колонка и OLD.колонка ref_id или NULL).
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor not in statements:
+        raise NotImplementedError(f'Триггеры журнала изменений не реализованы для {vendor}')
+    for table, (row_column, ref_column) in tables.items():
+        names = {
+            'table': table,
+            'row_column': row_column,
+            'ref_column': ref_column or '',
+            'new_ref': f'NEW.{ref_column}' if ref_column else 'NULL',
+            'old_ref': f'OLD.{ref_column}' if ref_column else 'NULL',
+        }
+        templates = statements[vendor]
+        if ref_column and ref_statements:
+            templates = (*templates, *ref_statements.get(vendor, ()))
+        for template in templates:
+            schema_editor.execute(template.format(**names))
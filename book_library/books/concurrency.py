@@ -0,0 +1,105 @@
+"""
+Модуль для параллельного выполнения независимых запросов.
+
+Django хранит соединения с базой данных отдельно для каждого потока,
+поэтому запросы, запущенные в пуле потоков, выполняются по разным
+соединениям одновременно. Время ответа становится близким к времени
+самого медленного запроса, а не к сумме всех запросов.
+
+Пример:
+    results = run_in_parallel({
+        'top_books': Book.objects.order_by('-published_date')[:3],
+        'books_count': Book.objects.count,
+    })
+"""
+
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.db.models.query import QuerySet
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_pool_thread = threading.local()
+
+
+def _get_executor():
+    """Лениво создает общий ограниченный пул потоков."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'BOOKS_PARALLEL_QUERY_WORKERS', 8),
+                    thread_name_prefix='books-query',
+                )
+    return _executor
+
+
+def _evaluate(job):
+    """Выполняет задание: QuerySet вычисляется в список, функция вызывается."""
+    if isinstance(job, QuerySet):
+        return list(job)
+    return job()
+
+
+def _evaluate_in_pool(job):
+    """
+    Выполняет задание в потоке пула.
+
+    Перед и после выполнения закрываются устаревшие соединения потока
+    с учетом CONN_MAX_AGE, так что соединения не утекают из пула.
+    """
+    _pool_thread.active = True
+    close_old_connections()
+    try:
+        return _evaluate(job)
+    finally:
+        close_old_connections()
+        _pool_thread.active = False
+
+
+def can_run_in_parallel(using=DEFAULT_DB_ALIAS):
+    """
+    Проверяет, можно ли выполнять запросы в других потоках.
+
+    Нельзя, если:
+    - вызывающий код находится внутри транзакции: другие соединения
+      не увидят ее незафиксированные изменения;
+    - база данных SQLite в памяти: у каждого соединения она своя;
+    - вызов уже происходит из потока пула (защита от взаимной блокировки).
+    """
+    if getattr(_pool_thread, 'active', False):
+        return False
+    connection = connections[using]
+    if connection.in_atomic_block:
+        return False
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        return False
+    return True
+
+
+def run_in_parallel(jobs, using=DEFAULT_DB_ALIAS):
+    """
+    Выполняет независимые запросы параллельно.
+
+    jobs - словарь {имя: QuerySet или функция без аргументов}.
+    Возвращает словарь {имя: результат} в том же порядке ключей.
+    Если параллельное выполнение невозможно (см. can_run_in_parallel),
+    запросы выполняются последовательно в текущем потоке с той же семантикой.
+    Исключение из любого задания пробрасывается вызывающему коду.
+    """
+    if len(jobs) < 2 or not can_run_in_parallel(using):
+        return {name: _evaluate(job) for name, job in jobs.items()}
+
+    executor = _get_executor()
+    # Задания видят контекстные переменные вызывающего кода (например, счетчики запросов)
+    futures = {
+        name: executor.submit(contextvars.copy_context().run, _evaluate_in_pool, job)
+        for name, job in jobs.items()
+    }
+    return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,178 @@
+"""
+Модуль статистики главной страницы.
+
+dashboard_snapshot() собирает всю статистику главной страницы
+за два обращения к базе данных:
+1. Пять COUNT в одном запросе через скалярные подзапросы.
+2. Три рейтинга (книги, авторы, магазины) в одном запросе через UNION ALL.
+
+Снимок пересчитывается фоновой задачей после изменения данных
+и хранится в кэше, поэтому главная страница обычно не выполняет
+этих запросов вовсе.
+"""
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Avg, Count, F, FloatField, Value
+from .concurrency import run_in_parallel
+from .models import Author, Book, Publisher, Store, Review
+
+
+HOMEPAGE_SNAPSHOT_CACHE_KEY = 'books:homepage_snapshot'
+HOMEPAGE_SNAPSHOT_TIMEOUT = 60 * 10  # Страховка на случай, если воркер не запущен
+
+# Модели, количество объектов которых показывается на главной странице
+STATS_MODELS = {
+    'books_count': Book,
+    'authors_count': Author,
+    'publishers_count': Publisher,
+    'stores_count': Store,
+    'reviews_count': Review,
+}
+
+LEADERBOARD_SIZE = 3
+
+# Общий набор колонок для всех частей UNION ALL
+LEADERBOARD_COLUMNS = ('kind', 'key', 'label', 'detail', 'extra', 'score', 'total')
+
+
+def fetch_stats(using=DEFAULT_DB_ALIAS):
+    """
+    Считает количество объектов всех моделей одним запросом:
+    SELECT (SELECT COUNT(*) FROM books_book), (SELECT COUNT(*) FROM books_author), ...
+    """
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    columns = ', '.join(
+        f"(SELECT COUNT(*) FROM {quote_name(model._meta.db_table)}) AS {quote_name(key)}"
+        for key, model in STATS_MODELS.items()
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {columns}")
+        row = cursor.fetchone()
+    return dict(zip(STATS_MODELS, row))
+
+
+def leaderboard_querysets(limit=LEADERBOARD_SIZE):
+    """
+    Запросы рейтингов, приведенные к общему набору колонок LEADERBOARD_COLUMNS.
+    """
+    no_score = Value(None, output_field=FloatField())
+
+    top_books = Book.objects.annotate(
+        kind=Value('book'),
+        key=F('id'),
+        label=F('title'),
+        detail=F('author__name'),
+        extra=F('publisher__name'),
+        score=Avg('reviews__rating'),
+        total=Count('reviews'),
+    ).filter(total__gt=0).order_by('-score')
+
+    top_authors = Author.objects.annotate(
+        kind=Value('author'),
+        key=F('id'),
+        label=F('name'),
+        detail=Value(''),
+        extra=Value(''),
+        score=no_score,
+        total=Count('books'),
+    ).order_by('-total')
+
+    top_stores = Store.objects.annotate(
+        kind=Value('store'),
+        key=F('id'),
+        label=F('name'),
+        detail=F('city__name'),
+        extra=Value(''),
+        score=no_score,
+        total=Count('books'),
+    ).order_by('-total')
+
+    return [
+        queryset.values(*LEADERBOARD_COLUMNS)[:limit]
+        for queryset in (top_books, top_authors, top_stores)
+    ]
+
+
+def fetch_leaderboards(limit=LEADERBOARD_SIZE, using=DEFAULT_DB_ALIAS):
+    """
+    Загружает три рейтинга одним запросом UNION ALL.
+
+    QuerySet.union() на SQLite не поддерживает LIMIT в частях составного
+    запроса, поэтому каждая часть компилируется отдельно и оборачивается
+    в подзапрос. Порядок строк внутри частей после UNION не гарантирован,
+    поэтому строки досортировываются в Python (их не больше 3 * limit).
+    """
+    connection = connections[using]
+    parts, params = [], []
+    for index, queryset in enumerate(leaderboard_querysets(limit)):
+        sql, part_params = queryset.query.get_compiler(using).as_sql()
+        parts.append(f"SELECT * FROM ({sql}) {connection.ops.quote_name(f'part_{index}')}")
+        params.extend(part_params)
+
+    with connection.cursor() as cursor:
+        cursor.execute(' UNION ALL '.join(parts), params)
+        rows = [dict(zip(LEADERBOARD_COLUMNS, row)) for row in cursor.fetchall()]
+
+    leaderboards = {'top_books': [], 'top_authors': [], 'top_stores': []}
+    for row in rows:
+        if row['kind'] == 'book':
+            leaderboards['top_books'].append({
+                'id': row['key'],
+                'title': row['label'],
+                'author': {'name': row['detail']},
+                'publisher': {'name': row['extra']} if row['extra'] is not None else None,
+                'avg_rating': row['score'],
+                'reviews_count': row['total'],
+            })
+        elif row['kind'] == 'author':
+            leaderboards['top_authors'].append({
+                'id': row['key'],
+                'name': row['label'],
+                'books_count': row['total'],
+            })
+        else:
+            leaderboards['top_stores'].append({
+                'id': row['key'],
+                'name': row['label'],
+                'city': row['detail'],
+                'books_count': row['total'],
+            })
+
+    leaderboards['top_books'].sort(key=lambda item: -item['avg_rating'])
+    leaderboards['top_authors'].sort(key=lambda item: -item['books_count'])
+    leaderboards['top_stores'].sort(key=lambda item: -item['books_count'])
+    return leaderboards
+
+
+def dashboard_snapshot(using=DEFAULT_DB_ALIAS):
+    """
+    Возвращает всю статистику главной страницы за два запроса к базе данных:
+    {'stats': {...}, 'top_books': [...], 'top_authors': [...], 'top_stores': [...]}
+
+    Оба запроса независимы и, когда это возможно, выполняются параллельно.
+    Элементы рейтингов - словари с теми же ключами, что и атрибуты моделей
+    в шаблоне (book.author.name, store.books_count и т.д.).
+    """
+    results = run_in_parallel({
+        'stats': lambda: fetch_stats(using),
+        'leaderboards': lambda: fetch_leaderboards(using=using),
+    }, using=using)
+    return {'stats': results['stats'], **results['leaderboards']}
+
+
+def cache_snapshot(snapshot):
+    """Сохраняет снимок статистики в кэш."""
+    cache.set(HOMEPAGE_SNAPSHOT_CACHE_KEY, snapshot, HOMEPAGE_SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+def refresh_snapshot_cache():
+    """Пересчитывает снимок статистики и сохраняет его в кэш."""
+    return cache_snapshot(dashboard_snapshot())
+
+
+def get_cached_snapshot():
+    """Возвращает снимок статистики из кэша или None."""
+    return cache.get(HOMEPAGE_SNAPSHOT_CACHE_KEY)
@@ -0,0 +1,57 @@
+"""
+Модуль фильтров по годам в виде диапазонов дат.
+
+Условие вида ExtractYear('published_date') > 2010 вычисляет функцию
+для каждой строки (на SQLite - функцию Python django_date_extract)
+и не может использовать индекс по столбцу. Фильтры этого модуля
+записывают год как полуоткрытый диапазон значений самого столбца:
+
+    published_after(2010)         -> published_date >= '2011-01-01'
+    published_between(2015, 2020) -> published_date >= '2015-01-01'
+                                     AND published_date < '2021-01-01'
+
+Такие условия используют индекс book_published_idx. Для столбцов
+DateTimeField границы года берутся в текущем часовом поясе
+(timezone.get_current_timezone()) и переводятся в aware datetime,
+поэтому год отзыва совпадает с годом, который видит пользователь.
+"""
+
+from datetime import date, datetime, time
+
+from django.db.models import Q
+from django.utils import timezone
+
+
+def year_start(year, aware=False):
+    """Начало года: date или aware datetime в текущем часовом поясе."""
+    if not aware:
+        return date(year, 1, 1)
+    return timezone.make_aware(datetime.combine(date(year, 1, 1), time.min))
+
+
+def year_range(field, start_year=None, end_year=None, aware=False):
+    """
+    Условие Q «field в годах start_year..end_year включительно».
+    Любую границу можно опустить. aware=True - для DateTimeField.
+    """
+    conditions = {}
+    if start_year is not None:
+        conditions[f'{field}__gte'] = year_start(start_year, aware)
+    if end_year is not None:
+        conditions[f'{field}__lt'] = year_start(end_year + 1, aware)
+    return Q(**conditions)
+
+
+def published_since(day, prefix=''):
+    """Книги, изданные начиная с даты day (prefix - путь к книге, например 'books__')."""
+    return Q(**{f'{prefix}published_date__gte': day})
+
+
+def published_after(year, prefix=''):
+    """Книги, изданные после года year (prefix - путь к книге, например 'books__')."""
+    return published_since(year_start(year + 1), prefix)
+
+
+def published_between(start_year, end_year, prefix=''):
+    """Книги, изданные в годах start_year..end_year включительно."""
+    return year_range(f'{prefix}published_date', start_year, end_year)
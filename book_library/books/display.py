@@ -0,0 +1,89 @@
+"""
+Модуль строкового представления моделей без запросов к базе.
+
+__str__ вызывается в списках администратора, на странице подтверждения
+удаления, в логах и в repr() списков объектов. Если __str__ обращается
+к незагруженной связи (self.book.title), каждый объект выполняет
+отдельный запрос. Поэтому __str__ моделей берет данные связанных
+объектов, только если они уже загружены (select_related, prefetch_related
+или присваивание), а иначе выводит id связи.
+
+Строгий режим (настройка BOOKS_STRICT_STR или контекстный менеджер
+strict_str) превращает любой запрос внутри __str__ в исключение
+StrQueryError, чтобы такие регрессии находились тестами.
+"""
+
+import functools
+import threading
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+
+class StrQueryError(AssertionError):
+    """__str__ модели выполнил SQL-запрос в строгом режиме."""
+
+
+_state = threading.local()
+
+
+def strict_str_enabled():
+    """Включен ли строгий режим в текущем потоке."""
+    return getattr(_state, 'depth', 0) > 0 or getattr(settings, 'BOOKS_STRICT_STR', False)
+
+
+@contextmanager
+def strict_str():
+    """Включает строгий режим для __str__ в текущем потоке."""
+    _state.depth = getattr(_state, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _state.depth -= 1
+
+
+def query_free_str(method):
+    """
+    Декоратор __str__: в строгом режиме запрещает запросы
+    ко всем базам данных на время вызова.
+    """
+    @functools.wraps(method)
+    def wrapper(instance):
+        if not strict_str_enabled():
+            return method(instance)
+
+        def blocker(execute, sql, params, many, context):
+            raise StrQueryError(
+                f"{type(instance).__name__}.__str__ выполнил запрос: {sql}"
+            )
+
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(blocker))
+            return method(instance)
+
+    return wrapper
+
+
+def loaded_related(instance, field_name):
+    """
+    Связанный объект, если он уже загружен, иначе None.
+    Обращение к незагруженной связи не выполняется.
+    """
+    field = instance._meta.get_field(field_name)
+    if field.is_cached(instance):
+        return field.get_cached_value(instance)
+    return None
+
+
+def related_label(instance, field_name, attribute=None):
+    """
+    Подпись связанного объекта: его атрибут attribute (или str), если объект
+    загружен, иначе '#<id>'. Для пустой связи возвращается '-'.
+    """
+    related = loaded_related(instance, field_name)
+    if related is not None:
+        return str(related) if attribute is None else getattr(related, attribute)
+    related_id = getattr(instance, instance._meta.get_field(field_name).attname)
+    return '-' if related_id is None else f'#{related_id}'
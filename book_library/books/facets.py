@@ -0,0 +1,275 @@
+"""
+Модуль фасетного поиска книг.
+
+Для каждого измерения (страна издательства, город магазина, рейтинг,
+год публикации, автор) строится инвертированный индекс:
+значение -> битовая карта книг. Битовая карта - это обычное целое число
+Python, где бит с номером позиции книги установлен, если книга подходит.
+Позиции плотные (0, 1, 2, ...) и не зависят от id книг: позиция
+удаленной книги отдается следующей добавленной, поэтому длина карт
+равна числу книг, а не максимальному id.
+Пересечение фильтров - побитовое И, подсчет фасета - количество единиц,
+поэтому запрос не выполняет GROUP BY по каждому измерению.
+
+Индекс строится лениво в каждом процессе и далее обновляется
+инкрементально: facet_index() читает журнал изменений (changelog.py)
+после курсора индекса и перечитывает из базы значения только
+затронутых книг.
+"""
+
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db.models import Avg
+
+from .changelog import ChangeLogPruned, iter_changes, latest_cursor
+from .models import Author, Book
+
+
+# Измерения фасетов в порядке вывода
+DIMENSIONS = ('country', 'city', 'rating', 'year', 'author')
+
+# Значение рейтинга для книг без отзывов
+NO_RATING = 0
+
+# Таблицы журнала, изменение строки которых меняет значения фасетов книг:
+# имя таблицы -> путь от книги к строке таблицы
+RELATED_TABLES = {
+    'books_publisher': 'publisher',
+    'books_country': 'publisher__country',
+    'books_store': 'stores',
+    'books_city': 'stores__city',
+    'books_review': 'reviews',
+}
+
+# Сколько книг перечитывать одним запросом
+BATCH_SIZE = 500
+
+
+def _popcount(bitmap):
+    return bin(bitmap).count('1')
+
+
+def _bits(bitmap):
+    """Номера установленных битов в порядке возрастания."""
+    digits = bin(bitmap)[:1:-1]  # Младший бит первым
+    return [position for position, digit in enumerate(digits) if digit == '1']
+
+
+def rating_bucket(avg_rating):
+    """Корзина рейтинга: целая часть средней оценки, 0 - нет отзывов."""
+    return NO_RATING if avg_rating is None else int(avg_rating)
+
+
+class FacetIndex:
+    """
+    Инвертированный индекс книг по измерениям фасетов.
+    """
+
+    def __init__(self):
+        self.all_books = 0
+        self.postings = {dimension: defaultdict(int) for dimension in DIMENSIONS}
+        self.author_names = {}
+        # Позиции книг в битовых картах: id -> позиция и позиция -> id
+        self.positions = {}
+        self.book_ids = []
+        # Освободившиеся позиции удаленных книг
+        self.free_positions = []
+        # Значения измерений книги по позиции: {(измерение, значение)}
+        self.book_values = {}
+        # id последней учтенной записи журнала изменений
+        self.cursor = 0
+
+    @classmethod
+    def build(cls):
+        """Строит индекс тремя запросами: книги, связи с магазинами, рейтинги."""
+        index = cls()
+        # Курсор берется до чтения данных: изменения, случившиеся во время
+        # построения, будут применены повторно, а перечитывание книг идемпотентно
+        index.cursor = latest_cursor()
+        for book_id, values in index._load_values(Book.objects.order_by('id')).items():
+            index.set_book(book_id, values)
+        return index
+
+    def _load_values(self, books):
+        """
+        Значения измерений книг queryset books: {id книги: [(измерение, значение)]}.
+        Попутно запоминает имена их авторов.
+        """
+        values = {}
+        rows = books.values_list('id', 'author_id', 'author__name', 'publisher__country__name', 'published_date')
+        for book_id, author_id, author_name, country, published_date in rows:
+            self.author_names[author_id] = author_name
+            values[book_id] = [('author', author_id), ('country', country), ('year', published_date.year)]
+
+        links = Book.stores.through.objects.filter(book__in=books).values_list('book_id', 'store__city__name')
+        for book_id, city in links:
+            values[book_id].append(('city', city))
+
+        ratings = dict(
+            books.filter(reviews__isnull=False).annotate(
+                avg_rating=Avg('reviews__rating')
+            ).order_by().values_list('id', 'avg_rating')
+        )
+        for book_id, items in values.items():
+            items.append(('rating', rating_bucket(ratings.get(book_id))))
+        return values
+
+    def set_book(self, book_id, values):
+        """
+        Заменяет значения измерений книги в индексе.
+        values=None удаляет книгу, ее позиция освобождается.
+        """
+        position = self.positions.get(book_id)
+        if position is not None:
+            bit = 1 << position
+            for dimension, value in self.book_values.pop(position):
+                bitmap = self.postings[dimension][value] & ~bit
+                if bitmap:
+                    self.postings[dimension][value] = bitmap
+                else:
+                    del self.postings[dimension][value]
+            if values is None:
+                self.all_books &= ~bit
+                del self.positions[book_id]
+                self.book_ids[position] = None
+                self.free_positions.append(position)
+                return
+        elif values is None:
+            return
+        else:
+            if self.free_positions:
+                position = self.free_positions.pop()
+                self.book_ids[position] = book_id
+            else:
+                position = len(self.book_ids)
+                self.book_ids.append(book_id)
+            self.positions[book_id] = position
+
+        bit = 1 << position
+        self.all_books |= bit
+        book_values = {(dimension, value) for dimension, value in values if value is not None}
+        for dimension, value in book_values:
+            self.postings[dimension][value] |= bit
+        self.book_values[position] = book_values
+
+    def apply_changes(self, book_ids=(), author_ids=()):
+        """
+        Перечитывает из базы значения указанных книг и имена авторов.
+        Книги и авторы, которых больше нет в базе, удаляются из индекса.
+        """
+        book_ids = sorted(book_ids)
+        for start in range(0, len(book_ids), BATCH_SIZE):
+            batch = book_ids[start:start + BATCH_SIZE]
+            values = self._load_values(Book.objects.filter(id__in=batch))
+            for book_id in batch:
+                self.set_book(book_id, values.get(book_id))
+
+        if author_ids:
+            names = dict(Author.objects.filter(id__in=author_ids).values_list('id', 'name'))
+            for author_id in author_ids:
+                if author_id in names:
+                    self.author_names[author_id] = names[author_id]
+                else:
+                    self.author_names.pop(author_id, None)
+
+    def catch_up(self):
+        """Применяет изменения из журнала после курсора индекса."""
+        book_ids, author_ids = set(), set()
+        related = defaultdict(set)
+        cursor = self.cursor
+        for batch in iter_changes(cursor):
+            for entry in batch:
+                table = entry.table_name
+                if table in ('books_book', 'books_book_stores'):
+                    book_ids.add(entry.row_id)
+                elif table == 'books_review' and entry.ref_id is not None:
+                    # Для отзывов ref_id - книга (см. changelog.py)
+                    book_ids.add(entry.ref_id)
+                elif table == 'books_author':
+                    author_ids.add(entry.row_id)
+                elif table in RELATED_TABLES:
+                    related[table].add(entry.row_id)
+            cursor = batch[-1].id
+
+        for table, row_ids in related.items():
+            book_ids.update(
+                Book.objects.filter(**{f'{RELATED_TABLES[table]}__in': row_ids})
+                .values_list('id', flat=True).distinct()
+            )
+        if book_ids or author_ids:
+            self.apply_changes(book_ids, author_ids)
+        self.cursor = cursor
+
+    def match(self, selected, exclude=None):
+        """
+        Битовая карта книг, подходящих под выбранные значения.
+
+        selected - словарь {измерение: список значений}. Значения одного
+        измерения объединяются по ИЛИ, разные измерения - по И.
+        Измерение exclude не учитывается (для подсчета его собственного фасета).
+        """
+        bitmap = self.all_books
+        for dimension, values in selected.items():
+            if dimension == exclude or not values:
+                continue
+            union = 0
+            for value in values:
+                union |= self.postings[dimension].get(value, 0)
+            bitmap &= union
+        return bitmap
+
+    def facet_counts(self, selected):
+        """
+        Количество книг для каждого значения каждого измерения.
+
+        Фасет измерения считается с учетом фильтров всех остальных
+        измерений, чтобы были видны альтернативы выбранному значению.
+        """
+        counts = {}
+        for dimension in DIMENSIONS:
+            base = self.match(selected, exclude=dimension)
+            counts[dimension] = {}
+            for value, bitmap in self.postings[dimension].items():
+                count = _popcount(bitmap & base)
+                if count:
+                    counts[dimension][value] = count
+        return counts
+
+    def search(self, selected):
+        """Возвращает (id подходящих книг по возрастанию, фасеты)."""
+        book_ids = sorted(self.book_ids[position] for position in _bits(self.match(selected)))
+        return book_ids, self.facet_counts(selected)
+
+    def label(self, dimension, value):
+        """Название значения фасета для вывода."""
+        if dimension == 'author':
+            return self.author_names.get(value, str(value))
+        if dimension == 'rating' and value == NO_RATING:
+            return 'Нет отзывов'
+        return str(value)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+@contextmanager
+def facet_index():
+    """
+    Актуальный индекс процесса: при первом обращении индекс строится,
+    далее догоняет журнал изменений (если непрочитанные записи журнала
+    уже удалены - строится заново). Пока блок with выполняется,
+    другие потоки индекс не меняют.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = FacetIndex.build()
+        else:
+            try:
+                _index.catch_up()
+            except ChangeLogPruned:
+                _index = FacetIndex.build()
+        yield _index
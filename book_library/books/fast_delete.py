@@ -0,0 +1,132 @@
+"""
+Модуль быстрого удаления авторов, издательств и книг.
+
+QuerySet.delete() сначала собирает в Python все зависимые объекты
+(django.db.models.deletion.Collector): книги автора, их отзывы, связи
+с магазинами и рекомендации, - и удаляет их по одному списку id за раз,
+отправляя pre_delete/post_delete для каждого объекта. Для издательства
+со 100 000 книг это сотни тысяч объектов в памяти.
+
+fast_delete() выполняет один DELETE ... WHERE по выбранным строкам,
+а зависимые строки удаляет сама база данных (ON DELETE CASCADE в PostgreSQL,
+триггеры в SQLite; их создают миграции). Журнал изменений
+(changelog.py) получает записи обо всех удаленных строках от триггеров,
+а вместо сигналов для каждого объекта отправляется один сигнал bulk_deleted.
+Удаляемые отзывы вычитаются из сводок каталога (review_rollups.py)
+одним запросом с группировкой до удаления.
+
+cascade_counts() считает, сколько строк будет удалено, запросами COUNT,
+не загружая объекты (для страницы подтверждения в админке).
+"""
+
+from django.db import router, transaction
+from django.db.models import Q
+from django.dispatch import Signal
+
+from .models import Author, Book, BookRatingShard, BookRecommendation, Publisher, Review, ReviewRollup
+from .review_rollups import remove_catalog_reviews
+
+
+BookStores = Book.stores.through
+
+# Сигнал после быстрого удаления.
+# Аргументы: sender - модель удаленных строк, counts - результат cascade_counts().
+bulk_deleted = Signal()
+
+# Путь от книги к удаляемой модели
+BOOK_PATHS = {
+    Author: 'author__in',
+    Publisher: 'publisher__in',
+    Book: 'pk__in',
+}
+
+
+def affected_books(queryset):
+    """Книги, которые будут удалены вместе со строками queryset (QuerySet)."""
+    try:
+        path = BOOK_PATHS[queryset.model]
+    except KeyError:
+        raise TypeError(f'Быстрое удаление не поддерживается для {queryset.model.__name__}')
+    return Book.objects.using(queryset.db).filter(**{path: queryset.values('pk')})
+
+
+def cascade_counts(queryset):
+    """
+    Количество удаляемых строк по моделям: {модель: количество},
+    только модели с ненулевым количеством.
+    """
+    books = affected_books(queryset)
+    book_ids = books.values('pk')
+    querysets = {queryset.model: queryset}
+    if queryset.model is not Book:
+        querysets[Book] = books
+    querysets.update({
+        Review: Review.objects.using(queryset.db).filter(book__in=book_ids),
+        BookRatingShard: BookRatingShard.objects.using(queryset.db).filter(book__in=book_ids),
+        ReviewRollup: ReviewRollup.objects.using(queryset.db).filter(book__in=book_ids),
+        BookStores: BookStores.objects.using(queryset.db).filter(book__in=book_ids),
+        BookRecommendation: BookRecommendation.objects.using(queryset.db).filter(
+            Q(book__in=book_ids) | Q(recommended__in=book_ids)
+        ),
+    })
+    counts = {}
+    for model, related in querysets.items():
+        count = related.order_by().count()
+        if count:
+            counts[model] = count
+    return counts
+
+
+def fast_delete(queryset):
+    """
+    Удаляет строки queryset одним запросом, зависимые строки удаляет база данных.
+    Возвращает cascade_counts() до удаления.
+    """
+    using = queryset._db or router.db_for_write(queryset.model)
+    queryset = queryset.using(using)
+    with transaction.atomic(using=using):
+        counts = cascade_counts(queryset)
+        if counts.get(Review):
+            # Сводки книг удалит база данных, а из сводок каталога отзывы вычитаются здесь
+            books = affected_books(queryset).values('pk')
+            remove_catalog_reviews(Review.objects.using(using).filter(book__in=books))
+        if counts:
+            # _raw_delete - тот же DELETE ... WHERE, которым Collector удаляет
+            # строки без сигналов; объекты в Python не создаются
+            queryset.order_by()._raw_delete(using)
+    if counts:
+        bulk_deleted.send(sender=queryset.model, counts=counts)
+    return counts
+
+
+# Каскады в базе данных (вызываются из миграций). SQL каскадов хранится
+# в самих миграциях: изменение этого модуля не меняет уже примененные миграции
+
+def foreign_key_constraint(schema_editor, table, column):
+    """Имя ограничения внешнего ключа table.column."""
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    for name, constraint in constraints.items():
+        if constraint['foreign_key'] and constraint['columns'] == [column]:
+            return name
+    raise LookupError(f'Не найден внешний ключ {table}.{column}')
+
+
+def execute_cascade_sql(schema_editor, cascades, statements):
+    """
+    Выполняет SQL каскадов миграции для каждой тройки cascades
+    (зависимая таблица, столбец внешнего ключа, родительская таблица).
+    statements - {vendor базы данных: шаблоны SQL}; в шаблоны подставляются
+    table, column и parent, а в PostgreSQL еще и constraint - имя
+    ограничения внешнего ключа.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor not in statements:
+        raise NotImplementedError(f'Каскадное удаление в базе данных не реализовано для {vendor}')
+    for table, column, parent in cascades:
+        names = {'table': table, 'column': column, 'parent': parent}
+        if vendor == 'postgresql':
+            names['constraint'] = foreign_key_constraint(schema_editor, table, column)
+        for template in statements[vendor]:
+            schema_editor.execute(template.format(**names))
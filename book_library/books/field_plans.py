@@ -0,0 +1,120 @@
+"""
+Модуль планирования загрузки объектов по списку выводимых полей.
+
+Вместо ручного подбора select_related/prefetch_related вызывающий код
+перечисляет пути полей, которые он выводит, а план строится по схеме
+моделей:
+
+    plan_queryset(Book, ['title', 'author.name', 'publisher.country',
+                         'stores.name', 'reviews.rating'])
+
+    -> Book.objects
+           .only('title', 'author', 'author__name', 'publisher', 'publisher__country')
+           .select_related('author', 'publisher', 'publisher__country')
+           .prefetch_related(
+               Prefetch('stores', Store.objects.only('name')),
+               Prefetch('reviews', Review.objects.only('rating', 'book')),
+           )
+
+Правила:
+- обычное поле загружается через only(), остальные поля модели
+  откладываются (первичный ключ загружается всегда);
+- прямой ForeignKey и OneToOne - JOIN (select_related);
+- обратный ForeignKey и ManyToMany - отдельный запрос Prefetch с only(),
+  в который для обратного ForeignKey добавляется ключ родителя,
+  иначе Django загрузит его отдельным запросом для каждого объекта;
+- путь, который заканчивается связью, загружает связанный объект целиком
+  (например, для вывода str(publisher.country));
+- пути внутри Prefetch планируются по тем же правилам.
+
+Фильтр и порядок связанных объектов задаются базовыми QuerySet
+в параметре related (ключ - путь связи, как в fields); only(),
+select_related и prefetch_related к ним добавляются планом.
+"""
+
+from django.db.models import Prefetch
+from django.db.models.query import QuerySet
+
+
+def parse_paths(fields):
+    """Дерево путей: ['author.name', 'author.bio'] -> {'author': {'name': {}, 'bio': {}}}."""
+    tree = {}
+    for path in fields:
+        node = tree
+        for name in path.replace('__', '.').split('.'):
+            node = node.setdefault(name, {})
+    return tree
+
+
+def _get_field(model, name):
+    """Поле или связь модели по имени поля или имени атрибута обратной связи."""
+    for field in model._meta.get_fields():
+        if field.name == name:
+            return field
+        if field.auto_created and not field.concrete and field.get_accessor_name() == name:
+            return field
+    raise ValueError(f'У модели {model.__name__} нет поля {name}')
+
+
+def _accessor(field):
+    """Имя атрибута связи в объекте (для обратной связи - related_name или <модель>_set)."""
+    return field.get_accessor_name() if field.auto_created and not field.concrete else field.name
+
+
+def _plan(model, tree, related, path, prefix):
+    """
+    План для дерева полей tree модели model.
+    Возвращает (поля only, пути select_related, объекты Prefetch).
+    """
+    only, joins, prefetches = [], [], []
+    for name, subtree in tree.items():
+        field = _get_field(model, name)
+        if field.is_relation and field.related_model is None:
+            raise ValueError(f'Связь {model.__name__}.{name} не поддерживается')
+
+        if not field.is_relation:
+            if subtree:
+                raise ValueError(f'Поле {model.__name__}.{name} не является связью')
+            only.append(prefix + field.name)
+
+        elif field.many_to_many or field.one_to_many:
+            relation_path = path + (name,)
+            child = related.get('.'.join(relation_path))
+            if child is None:
+                child = field.related_model._default_manager.all()
+            # Ключ родителя, по которому Prefetch раскладывает объекты (только столбец, без JOIN)
+            required = [field.field.name] if field.one_to_many else []
+            child = _apply(child, subtree, related, relation_path, required)
+            prefetches.append(Prefetch(prefix + _accessor(field), queryset=child))
+
+        else:
+            lookup = prefix + field.name
+            only.append(lookup)
+            joins.append(lookup)
+            sub_only, sub_joins, sub_prefetches = _plan(
+                field.related_model, subtree, related, path + (name,), lookup + '__'
+            )
+            only += sub_only
+            joins += sub_joins
+            prefetches += sub_prefetches
+    return only, joins, prefetches
+
+
+def _apply(queryset, tree, related, path=(), required=()):
+    only, joins, prefetches = _plan(queryset.model, tree, related, path, '')
+    if only:
+        queryset = queryset.only(*only, *required)
+    if joins:
+        queryset = queryset.select_related(*joins)
+    if prefetches:
+        queryset = queryset.prefetch_related(*prefetches)
+    return queryset
+
+
+def plan_queryset(source, fields, related=None):
+    """
+    QuerySet модели (или переданного QuerySet) с загрузкой ровно тех полей
+    и связей, которые перечислены в fields (см. описание модуля).
+    """
+    queryset = source if isinstance(source, QuerySet) else source._default_manager.all()
+    return _apply(queryset, parse_paths(fields), related or {})
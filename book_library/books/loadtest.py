@@ -0,0 +1,290 @@
+"""
+Модуль нагрузочного тестирования HTTP-страниц на одной машине.
+
+Приложение запускается в том же процессе под многопоточным WSGI-сервером
+из стандартной библиотеки, а нагрузку создает асинхронный HTTP/1.1-клиент
+(asyncio, соединения keep-alive): concurrency корутин отправляют запросы
+по кругу, пока не будет выполнено заданное количество запросов
+или не истечет время.
+
+Каждый ответ измеряется на стороне клиента (задержка, код ответа),
+а на стороне сервера обертка WSGI считает SQL-запросы, выполненные
+при обработке запроса, включая запросы в потоках run_in_parallel
+(см. query_observers.py).
+
+Запуск: python manage.py load_test (см. management/commands/load_test.py)
+"""
+
+import asyncio
+import math
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.db import transaction
+from django.utils import timezone
+
+from .locations import cities_by_name, countries_by_name
+from .models import Author, Book, Publisher, Review, Store
+from .query_observers import observe_queries
+from .rating_counters import rebuild_rating_counters
+from .review_rollups import rebuild_review_rollups, review_day
+
+
+class QueryCountingApp:
+    """
+    WSGI-обертка, которая записывает количество SQL-запросов
+    каждого HTTP-запроса в список query_counts.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.query_counts = []
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        counter = [0]
+
+        def count(sql, duration):
+            counter[0] += 1
+
+        try:
+            # Тело ответа Django формирует до возврата из обработчика
+            with observe_queries(count):
+                return self.application(environ, start_response)
+        finally:
+            with self._lock:
+                self.query_counts.append(counter[0])
+
+
+class _LoadTestServer(ThreadedWSGIServer):
+    request_queue_size = 128
+
+
+class _QuietHandler(WSGIRequestHandler):
+    """Обработчик runserver (HTTP/1.1 keep-alive) без журнала запросов."""
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(application, host='127.0.0.1', port=0):
+    """
+    Запускает многопоточный WSGI-сервер Django (как у runserver) в фоновом потоке.
+    Возвращает сервер; адрес - server.server_address, остановка - server.shutdown().
+    """
+    server = _LoadTestServer((host, port), _QuietHandler)
+    server.set_app(application)
+    threading.Thread(target=server.serve_forever, name='books-loadtest-server', daemon=True).start()
+    return server
+
+
+def wsgi_application():
+    """WSGI-приложение проекта (без повторной настройки Django)."""
+    return WSGIHandler()
+
+
+# Набор данных
+
+def seed_catalog(books, reviews_per_book=5, authors=50, stores=20, seed=0):
+    """
+    Добавляет в базу синтетический каталог заданного размера
+    пакетными вставками. Возвращает количество созданных книг и отзывов.
+    """
+    rng = random.Random(seed)
+    cities = list(cities_by_name(['Москва', 'Санкт-Петербург', 'Новосибирск', 'Екатеринбург', 'Казань']).values())
+    countries = list(countries_by_name(['Россия', 'США', 'Великобритания', 'Франция']).values())
+    suffix = f'{seed}-{time.time_ns()}'
+
+    with transaction.atomic():
+        author_objects = Author.objects.bulk_create([
+            Author(name=f'Автор {number} ({suffix})', bio='') for number in range(authors)
+        ])
+        publisher_objects = Publisher.objects.bulk_create([
+            Publisher(name=f'Издательство {number} ({suffix})', country=country)
+            for number, country in enumerate(countries)
+        ])
+        store_objects = Store.objects.bulk_create([
+            Store(name=f'Магазин {number} ({suffix})', city=rng.choice(cities))
+            for number in range(stores)
+        ])
+        book_objects = Book.objects.bulk_create([
+            Book(
+                title=f'Книга {number} ({suffix})',
+                author=rng.choice(author_objects),
+                publisher=rng.choice(publisher_objects + [None]),
+                published_date=date(2000, 1, 1) + timedelta(days=rng.randrange(9000)),
+                description='',
+            )
+            for number in range(books)
+        ], batch_size=1000)
+
+        Book.stores.through.objects.bulk_create([
+            Book.stores.through(book_id=book.id, store_id=store.id)
+            for book in book_objects
+            for store in rng.sample(store_objects, min(len(store_objects), rng.randint(1, 4)))
+        ], batch_size=1000)
+        Review.objects.bulk_create([
+            Review(book=book, rating=rng.randint(1, 5), comment='Отзыв нагрузочного теста')
+            for book in book_objects
+            for _ in range(reviews_per_book)
+        ], batch_size=1000)
+        # bulk_create не отправляет сигналы: сводки текущего месяца
+        # и счетчики оценок новых книг пересчитываются
+        if reviews_per_book:
+            rebuild_review_rollups(since=review_day(timezone.now()))
+            book_ids = [book.id for book in book_objects]
+            for start in range(0, len(book_ids), 1000):
+                rebuild_rating_counters(book_ids=book_ids[start:start + 1000])
+
+    return len(book_objects), len(book_objects) * reviews_per_book
+
+
+# Клиент
+
+@dataclass
+class LoadResult:
+    """Результаты прогона: задержки ответов в секундах, коды ответов и сбои соединений."""
+    elapsed: float = 0.0
+    latencies: list = field(default_factory=list)
+    statuses: dict = field(default_factory=dict)
+    failures: int = 0
+
+    @property
+    def requests(self):
+        return len(self.latencies) + self.failures
+
+    @property
+    def errors(self):
+        return self.failures + sum(count for status, count in self.statuses.items() if status >= 400)
+
+    def record(self, latency, status):
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+async def _read_response(reader):
+    """
+    Читает ответ HTTP/1.1 и возвращает (код ответа, закрыл ли сервер соединение).
+    Тело ответа отбрасывается.
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Сервер закрыл соединение')
+    status = int(status_line.split()[1])
+
+    length, chunked, close = None, False, False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'transfer-encoding' and 'chunked' in value:
+            chunked = True
+        elif name == 'connection' and value == 'close':
+            close = True
+
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length is not None:
+        await reader.readexactly(length)
+    else:
+        await reader.read()
+        close = True
+    return status, close
+
+
+async def _worker(host, port, paths, headers, result, deadline, budget):
+    reader = writer = None
+    try:
+        while budget() and time.perf_counter() < deadline:
+            path = random.choice(paths)
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            request = f'GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\n{headers}\r\n'
+            started = time.perf_counter()
+            try:
+                writer.write(request.encode('latin-1'))
+                await writer.drain()
+                status, close = await _read_response(reader)
+            except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+                result.failures += 1
+                writer.close()
+                reader = writer = None
+                continue
+            result.record(time.perf_counter() - started, status)
+            if close:
+                writer.close()
+                reader = writer = None
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def _drive(host, port, paths, concurrency, requests, duration, cookies):
+    result = LoadResult()
+    headers = ''.join(f'Cookie: {name}={value}\r\n' for name, value in cookies.items())
+    remaining = [requests]
+
+    def budget():
+        # Запрос резервируется до отправки, чтобы общее количество было точным
+        if remaining[0] is None:
+            return True
+        remaining[0] -= 1
+        return remaining[0] >= 0
+
+    deadline = time.perf_counter() + (duration or float('inf'))
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        _worker(host, port, paths, headers, result, deadline, budget)
+        for _ in range(concurrency)
+    ])
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def run_load(address, paths, concurrency=10, requests=None, duration=None, cookies=None):
+    """
+    Нагружает сервер по адресу (host, port) запросами GET к paths.
+    Останавливается после requests запросов или duration секунд.
+    """
+    if requests is None and duration is None:
+        raise ValueError('Нужно задать requests или duration')
+    host, port = address
+    return asyncio.run(_drive(host, port, list(paths), concurrency, requests, duration, cookies or {}))
+
+
+def percentile(values, fraction):
+    """Перцентиль отсортированного списка (ближайший ранг)."""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def summarize(result, query_counts):
+    """Сводка прогона: пропускная способность, перцентили, ошибки, запросы к БД."""
+    latencies = sorted(result.latencies)
+    return {
+        'requests': result.requests,
+        'elapsed': result.elapsed,
+        'throughput': result.requests / result.elapsed if result.elapsed else 0.0,
+        'error_rate': result.errors / result.requests if result.requests else 0.0,
+        'statuses': dict(sorted(result.statuses.items())),
+        'latency_ms': {
+            name: percentile(latencies, fraction) * 1000
+            for name, fraction in (('p50', 0.50), ('p90', 0.90), ('p99', 0.99), ('max', 1.0))
+        },
+        'queries_per_request': sum(query_counts) / len(query_counts) if query_counts else 0.0,
+        'max_queries': max(query_counts, default=0),
+    }
@@ -0,0 +1,78 @@
+"""
+Модуль справочников стран и городов.
+
+Страна издательства и город магазина хранятся в таблицах Country и City,
+а Publisher и Store ссылаются на них целочисленными ключами. Фильтры
+этого модуля принимают названия, но сравнивают ключи:
+
+    in_city('Москва')
+        -> city_id IN (SELECT id FROM books_city WHERE name = 'Москва')
+
+Название ищется по уникальному индексу маленького справочника, а отбор
+и группировка строк каталога идут по целочисленному индексу внешнего
+ключа вместо сравнения строк переменной длины.
+"""
+
+from django.db.models import Q
+
+from .models import City, Country
+
+
+def normalize_name(name):
+    """Название без лишних пробелов: ' Санкт-Петербург ' -> 'Санкт-Петербург'."""
+    return ' '.join(name.split())
+
+
+def _names(names):
+    if isinstance(names, str):
+        names = [names]
+    return [normalize_name(name) for name in names]
+
+
+def country_ids(names):
+    """Подзапрос id стран по названию или списку названий."""
+    return Country.objects.filter(name__in=_names(names)).values('id')
+
+
+def city_ids(names):
+    """Подзапрос id городов по названию или списку названий."""
+    return City.objects.filter(name__in=_names(names)).values('id')
+
+
+def in_country(names, prefix=''):
+    """Издательства из стран names (prefix - путь к издательству, например 'publisher__')."""
+    return Q(**{f'{prefix}country__in': country_ids(names)})
+
+
+def in_city(names, prefix=''):
+    """Магазины в городах names (prefix - путь к магазину, например 'stores__')."""
+    return Q(**{f'{prefix}city__in': city_ids(names)})
+
+
+def _get_or_create_all(model, names):
+    names = set(_names(names))
+    existing = {obj.name: obj for obj in model.objects.filter(name__in=names)}
+    model.objects.bulk_create(
+        [model(name=name) for name in sorted(names - set(existing))], ignore_conflicts=True
+    )
+    if len(existing) < len(names):
+        existing = {obj.name: obj for obj in model.objects.filter(name__in=names)}
+    return existing
+
+
+def countries_by_name(names):
+    """Словарь {название: Country}; недостающие страны создаются."""
+    return _get_or_create_all(Country, names)
+
+
+def cities_by_name(names):
+    """Словарь {название: City}; недостающие города создаются."""
+    return _get_or_create_all(City, names)
+
+
+def get_country(name):
+    return countries_by_name([name])[normalize_name(name)]
+
+
+def get_city(name):
+    return cities_by_name([name])[normalize_name(name)]
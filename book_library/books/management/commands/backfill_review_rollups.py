@@ -0,0 +1,32 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from books.review_rollups import rebuild_review_rollups
+
+
+class Command(BaseCommand):
+    """
+    Management команда для пересчета сводок отзывов по дням и месяцам.
+    Запуск: python manage.py backfill_review_rollups [--since 2024-01-01]
+    """
+    help = 'Пересчитывает сводки отзывов по таблице отзывов (все или начиная с месяца даты --since)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since',
+                            help='Дата ГГГГ-ММ-ДД: пересчитать месяцы, начиная с месяца этой даты')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Размер пакета вставки строк сводок')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError(f"Некорректная дата: {options['since']}")
+
+        started = time.perf_counter()
+        created = rebuild_review_rollups(since, options['batch_size'])
+        elapsed = (time.perf_counter() - started) * 1000
+        self.stdout.write(self.style.SUCCESS(f'Создано строк сводок: {created} за {elapsed:.1f} мс'))
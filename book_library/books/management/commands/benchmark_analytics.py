@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from books import queries
+from books.analytics import CatalogSnapshot
+
+
+class Command(BaseCommand):
+    """
+    Management команда для сравнения отчетных запросов SQL и снимка NumPy.
+    Запуск: python manage.py benchmark_analytics --repeat 20
+    """
+    help = 'Сравнивает скорость отчетных запросов через ORM и через снимок в памяти'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Количество повторов каждого запроса')
+        parser.add_argument('--year', type=int, default=2010)
+        parser.add_argument('--min-rating', type=float, default=4.5)
+
+    def measure(self, func, repeat):
+        """Возвращает результат и лучшее время выполнения в миллисекундах."""
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            elapsed = (time.perf_counter() - started) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        year = options['year']
+        min_rating = options['min_rating']
+
+        snapshot, load_ms = self.measure(CatalogSnapshot.load, 1)
+        self.stdout.write(f'Загрузка снимка: {load_ms:.2f} мс '
+                          f'(книг: {len(snapshot.book_ids)}, отзывов: {len(snapshot.review_ids)})')
+
+        cases = [
+            (
+                'Книги по магазинам',
+                lambda: [(s.id, s.books_count) for s in queries.books_count_by_store()],
+                snapshot.books_count_by_store,
+            ),
+            (
+                f'Магазины с книгами после {year}',
+                lambda: [(s.id, s.recent_books_count) for s in queries.stores_by_publication_date(year)],
+                lambda: snapshot.stores_by_publication_date(year),
+            ),
+            (
+                f'Книги со средней оценкой выше {min_rating}',
+                lambda: [(b.id, b.avg_rating) for b in queries.books_by_average_rating(min_rating)],
+                lambda: snapshot.books_by_average_rating(min_rating),
+            ),
+        ]
+
+        self.stdout.write(f"\n{'Запрос':<40} {'SQL, мс':>10} {'NumPy, мс':>10} {'Ускорение':>10}")
+        for title, sql_func, numpy_func in cases:
+            sql_result, sql_ms = self.measure(sql_func, repeat)
+            numpy_result, numpy_ms = self.measure(numpy_func, repeat)
+
+            # Порядок при равных значениях не определен, сравниваем как множества
+            if set(sql_result) != {(key, value) for key, value in numpy_result}:
+                raise CommandError(f'Результаты не совпадают: {title}')
+
+            speedup = sql_ms / numpy_ms if numpy_ms else float('inf')
+            self.stdout.write(f'{title:<40} {sql_ms:>10.2f} {numpy_ms:>10.3f} {speedup:>9.1f}x')
@@ -0,0 +1,95 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count, IntegerField, Value
+from django.db.models.functions import ExtractYear
+from books import loadtest
+from books.date_ranges import published_after, published_between
+from books.models import Book
+from books.query_plans import explain_statement
+
+
+def year_value(year):
+    """
+    Год как выражение. Django сам заменяет year__gt=<число> диапазоном дат,
+    а со значением-выражением (Value, F, подзапрос) условие остается
+    функцией над каждой строкой - так выглядит фильтр без диапазона.
+    """
+    return Value(year, output_field=IntegerField())
+
+
+class Command(BaseCommand):
+    """
+    Management команда для сравнения фильтров по году публикации.
+    Запуск: python manage.py benchmark_date_filters --seed 100000 --year 2010
+    """
+    help = 'Сравнивает фильтр по году через функцию над столбцом и через диапазон дат'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Добавить в базу синтетический каталог из указанного числа книг')
+        parser.add_argument('--year', type=int, default=2010)
+        parser.add_argument('--repeat', type=int, default=10,
+                            help='Количество повторов каждого запроса')
+
+    def measure(self, queryset, repeat):
+        """Возвращает результат и лучшее время выполнения в миллисекундах."""
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = list(queryset.all())
+            elapsed = (time.perf_counter() - started) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best
+
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        return explain_statement(sql, params)
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            books, _ = loadtest.seed_catalog(options['seed'], reviews_per_book=0)
+            self.stdout.write(f'Добавлено книг: {books}')
+
+        year = options['year']
+        repeat = options['repeat']
+        books = Book.objects.order_by().values_list('id', flat=True)
+        by_year = Book.objects.annotate(year=ExtractYear('published_date')).order_by()
+        cases = [
+            (
+                f'Книги после {year}',
+                by_year.filter(year__gt=year_value(year)).values_list('id', flat=True),
+                books.filter(published_after(year)),
+            ),
+            (
+                f'Книги {year}-{year + 5}',
+                by_year.filter(year__gte=year_value(year), year__lte=year_value(year + 5)).values_list('id', flat=True),
+                books.filter(published_between(year, year + 5)),
+            ),
+            (
+                'Количество книг по годам публикации',
+                by_year.filter(year__gt=year_value(year)).values('year').annotate(count=Count('id')).order_by('year'),
+                Book.objects.published_after(year).annotate(
+                    year=ExtractYear('published_date')
+                ).values('year').annotate(count=Count('id')).order_by('year'),
+            ),
+        ]
+
+        self.stdout.write(f'Книг в базе: {Book.objects.count()}, база: {connection.vendor}')
+        self.stdout.write(f"\n{'Запрос':<40} {'Год(), мс':>10} {'Диапазон, мс':>13} {'Ускорение':>10}")
+        for title, function_qs, range_qs in cases:
+            function_result, function_ms = self.measure(function_qs, repeat)
+            range_result, range_ms = self.measure(range_qs, repeat)
+            speedup = function_ms / range_ms if range_ms else float('inf')
+            self.stdout.write(f'{title:<40} {function_ms:>10.2f} {range_ms:>13.2f} {speedup:>9.1f}x')
+            if sorted(map(str, function_result)) != sorted(map(str, range_result)):
+                self.stdout.write(self.style.ERROR('  Результаты различаются!'))
+
+        title, function_qs, range_qs = cases[0]
+        self.stdout.write(f'\nПлан «{title}» с функцией над столбцом:')
+        for line in self.plan(function_qs):
+            self.stdout.write(f'  {line}')
+        self.stdout.write('План с диапазоном дат:')
+        for line in self.plan(range_qs):
+            self.stdout.write(f'  {line}')
@@ -0,0 +1,71 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from books import queries
+
+
+class Command(BaseCommand):
+    """
+    Management команда для сравнения обычных и подготовленных запросов.
+    Запуск: python manage.py benchmark_prepared --repeat 200
+    """
+    help = 'Сравнивает время запросов QuerySet и тех же запросов, подготовленных заранее (prepared.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=200,
+                            help='Количество повторов каждого запроса')
+        parser.add_argument('--country', default='Россия')
+        parser.add_argument('--city', default='Москва')
+        parser.add_argument('--year', type=int, default=2010)
+        parser.add_argument('--min-rating', type=float, default=4.5)
+
+    def measure(self, func, repeat):
+        """Возвращает результат и среднее время выполнения в миллисекундах."""
+        started = time.perf_counter()
+        for _ in range(repeat):
+            result = func()
+        return result, (time.perf_counter() - started) * 1000 / repeat
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        country, city = options['country'], options['city']
+        year, min_rating = options['year'], options['min_rating']
+
+        cases = [
+            (
+                f'Книги издательств из страны {country}',
+                lambda: queries.books_by_country(country),
+                lambda: queries.prepared_books_by_country(country),
+            ),
+            (
+                f'Книги в магазинах города {city}',
+                lambda: queries.books_by_city(city),
+                lambda: queries.prepared_books_by_city(city),
+            ),
+            (
+                f'Книги со средней оценкой выше {min_rating}',
+                lambda: queries.books_by_average_rating(min_rating),
+                lambda: queries.prepared_books_by_average_rating(min_rating),
+            ),
+            (
+                'Книги по магазинам',
+                queries.books_count_by_store,
+                queries.prepared_books_count_by_store,
+            ),
+            (
+                f'Магазины с книгами после {year}',
+                lambda: queries.stores_by_publication_date(year),
+                lambda: queries.prepared_stores_by_publication_date(year),
+            ),
+        ]
+
+        self.stdout.write(f"\n{'Запрос':<45} {'ORM, мс':>10} {'Prepared, мс':>13} {'Ускорение':>10}")
+        for title, orm_func, prepared_func in cases:
+            orm_result, orm_ms = self.measure(lambda: list(orm_func()), repeat)
+            prepared_result, prepared_ms = self.measure(prepared_func, repeat)
+
+            if [obj.pk for obj in orm_result] != [obj.pk for obj in prepared_result]:
+                raise CommandError(f'Результаты не совпадают: {title}')
+
+            speedup = orm_ms / prepared_ms if prepared_ms else float('inf')
+            self.stdout.write(f'{title:<45} {orm_ms:>10.3f} {prepared_ms:>13.3f} {speedup:>9.1f}x')
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from books.rating_counters import compact_rating_counters, rebuild_rating_counters
+
+
+class Command(BaseCommand):
+    """
+    Management команда для обслуживания счетчиков оценок (запуск по расписанию).
+    Запуск: python manage.py compact_rating_counters [--rebuild]
+    """
+    help = 'Сливает части счетчиков оценок книг или пересчитывает их по отзывам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Пересчитать счетчики по таблице отзывов (после массовых изменений)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['rebuild']:
+            result = f'Пересчитано книг: {rebuild_rating_counters()}'
+        else:
+            result = f'Удалено частей: {compact_rating_counters()}'
+        elapsed = (time.perf_counter() - started) * 1000
+        self.stdout.write(self.style.SUCCESS(f'{result} за {elapsed:.1f} мс'))
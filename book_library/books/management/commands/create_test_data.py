@@ -1,7 +1,9 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import date, timedelta
+from books.locations import cities_by_name, countries_by_name
 from books.models import Author, Publisher, Store, Book, Review
+from books.store_assignment import assign_stores
 
 
 class Command(BaseCommand):
@@ -77,10 +79,11 @@ class Command(BaseCommand):
             {'name': 'Bloomsbury', 'country': 'Великобритания'},
         ]
         
+        countries = countries_by_name(data['country'] for data in publishers_data)
         for publisher_data in publishers_data:
             publisher, created = Publisher.objects.get_or_create(
                 name=publisher_data['name'],
-                defaults={'country': publisher_data['country']}
+                defaults={'country': countries[publisher_data['country']]}
             )
             if created:
                 self.stdout.write(f'Создано издательство: {publisher.name}')
@@ -97,10 +100,11 @@ class Command(BaseCommand):
             {'name': 'Академкнига', 'city': 'Екатеринбург'},
         ]
         
+        cities = cities_by_name(data['city'] for data in stores_data)
         for store_data in stores_data:
             store, created = Store.objects.get_or_create(
                 name=store_data['name'],
-                defaults={'city': store_data['city']}
+                defaults={'city': cities[store_data['city']]}
             )
             if created:
                 self.stdout.write(f'Создан магазин: {store.name}')
@@ -158,6 +162,9 @@ class Command(BaseCommand):
             }
         ]
         
+        store_ids = dict(Store.objects.values_list('name', 'id'))
+        assignments = {}
+        
         for book_data in books_data:
             # Получаем связанные объекты
             author = Author.objects.get(name=book_data['author_name'])
@@ -175,12 +182,12 @@ class Command(BaseCommand):
             )
             
             if created:
-                # Добавляем магазины (ManyToMany связь)
-                for store_name in book_data['stores']:
-                    store = Store.objects.get(name=store_name)
-                    book.stores.add(store)
+                # Магазины (ManyToMany связь) назначаем одним пакетом ниже
+                assignments[book] = {store_ids[name] for name in book_data['stores']}
                 
                 self.stdout.write(f'Создана книга: {book.title}')
+        
+        assign_stores(assignments)
 
     def create_reviews(self):
         """Создает тестовые отзывы"""
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+from books.analytics import SNAPSHOT_FILE_CURSOR, CatalogSnapshot, snapshot_path
+from books.changelog import save_cursor
+from books.snapshot_file import write_snapshot
+
+
+class Command(BaseCommand):
+    """
+    Management команда для сохранения снимка каталога в файл.
+    Запуск: python manage.py dump_snapshot [--output путь]
+    """
+    help = 'Сохраняет колоночный снимок каталога в бинарный файл для mmap'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Путь к файлу (по умолчанию BOOKS_ANALYTICS_SNAPSHOT_PATH)')
+
+    def handle(self, *args, **options):
+        path = options['output'] or snapshot_path()
+
+        started = time.perf_counter()
+        snapshot = CatalogSnapshot.load()
+        loaded = time.perf_counter()
+        path = write_snapshot(snapshot, path, metadata={'cursor': snapshot.cursor})
+        # Записи журнала после курсора файла нужны процессам, которые загрузят файл
+        save_cursor(SNAPSHOT_FILE_CURSOR, snapshot.cursor)
+        written = time.perf_counter()
+
+        self.stdout.write(f'Загрузка из базы: {(loaded - started) * 1000:.1f} мс')
+        self.stdout.write(f'Запись файла: {(written - loaded) * 1000:.1f} мс')
+        self.stdout.write(self.style.SUCCESS(
+            f'Снимок сохранен: {path} ({path.stat().st_size} байт, '
+            f'книг: {len(snapshot.book_ids)}, отзывов: {len(snapshot.review_ids)})'
+        ))
@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from books.query_plans import (
+    NAMED_QUERIES, capture_plans, default_snapshot_path,
+    find_regressions, load_snapshot, save_snapshot,
+)
+
+
+class Command(BaseCommand):
+    """
+    Management команда для снятия планов выполнения именованных запросов.
+    Запуск: python manage.py explain_queries [--update] [--analyze]
+    
+    Без --update сравнивает планы со снимком и завершается с ошибкой,
+    если план какого-либо запроса ухудшился.
+    """
+    help = 'Снимает планы выполнения запросов и проверяет их на регрессии'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', metavar='query',
+                            help='Имена запросов (по умолчанию все)')
+        parser.add_argument('--update', action='store_true',
+                            help='Перезаписать снимок текущими планами')
+        parser.add_argument('--analyze', action='store_true',
+                            help='Использовать EXPLAIN ANALYZE (где поддерживается)')
+        parser.add_argument('--snapshot', help='Путь к файлу снимка')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--show', action='store_true',
+                            help='Вывести планы на экран')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        vendor = connections[using].vendor
+        names = options['names']
+        unknown = set(names) - set(NAMED_QUERIES)
+        if unknown:
+            raise CommandError(f"Неизвестные запросы: {', '.join(sorted(unknown))}")
+
+        path = options['snapshot'] or default_snapshot_path(vendor)
+        try:
+            plans = capture_plans(names, options['analyze'], using)
+        except NotImplementedError as exc:
+            raise CommandError(str(exc))
+
+        if options['show']:
+            for name, statements in plans.items():
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                for index, statement in enumerate(statements, start=1):
+                    self.stdout.write(f"  [{index}] {statement['sql'][:100]}")
+                    for line in statement['plan']:
+                        self.stdout.write(f"      {line}")
+
+        snapshot = load_snapshot(path)
+
+        if options['update']:
+            save_snapshot(path, vendor, {**snapshot, **plans})
+            self.stdout.write(self.style.SUCCESS(f'Снимок планов сохранен: {path}'))
+            return
+
+        if not snapshot:
+            raise CommandError(f'Снимок {path} не найден, запустите команду с --update')
+
+        for name in plans:
+            if name not in snapshot:
+                self.stdout.write(self.style.WARNING(f'{name}: нет в снимке, пропущен'))
+
+        regressions = find_regressions(snapshot, plans)
+        if regressions:
+            for message in regressions:
+                self.stdout.write(self.style.ERROR(f'❌ {message}'))
+            raise CommandError(f'Обнаружено регрессий планов: {len(regressions)}')
+
+        self.stdout.write(self.style.SUCCESS(f'✅ Планы {len(plans)} запросов не ухудшились'))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from books.analytics import snapshot_path
+from books.snapshot_file import SnapshotFormatError, read_snapshot
+
+
+class Command(BaseCommand):
+    """
+    Management команда для проверки файла снимка каталога.
+    Запуск: python manage.py load_snapshot [путь]
+    
+    Отображает файл в память так же, как это делают воркеры,
+    и выводит время запуска и содержимое снимка.
+    """
+    help = 'Загружает снимок каталога из файла через mmap и выводит сводку'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='Путь к файлу (по умолчанию BOOKS_ANALYTICS_SNAPSHOT_PATH)')
+
+    def handle(self, *args, **options):
+        path = options['path'] or snapshot_path()
+
+        started = time.perf_counter()
+        try:
+            snapshot = read_snapshot(path)
+        except (OSError, SnapshotFormatError) as exc:
+            raise CommandError(f'Не удалось загрузить снимок {path}: {exc}')
+        elapsed = (time.perf_counter() - started) * 1000
+
+        self.stdout.write(self.style.SUCCESS(f'Снимок загружен за {elapsed:.2f} мс: {path}'))
+        self.stdout.write(f"Создан: {snapshot.file_header['created']}")
+        self.stdout.write(f'Курсор журнала изменений: {snapshot.cursor}')
+        self.stdout.write(f'Книг: {len(snapshot.book_ids)}')
+        self.stdout.write(f'Отзывов: {len(snapshot.review_ids)}')
+        self.stdout.write(f'Магазинов: {len(snapshot.store_ids)}')
+        self.stdout.write(f'Связей книга-магазин: {len(snapshot.link_book_ids)}')
+        self.stdout.write(f'Строк в таблице: {len(snapshot.strings)}')
@@ -0,0 +1,93 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from books import loadtest
+from books.dashboard import refresh_snapshot_cache
+
+
+ADMIN_PATHS = ['/admin/books/book/', '/admin/books/review/']
+ADMIN_USERNAME = 'loadtest'
+
+
+class Command(BaseCommand):
+    """
+    Management команда для нагрузочного тестирования страниц.
+    Запуск: python manage.py load_test --books 5000 --concurrency 20 --requests 2000
+    """
+    help = 'Запускает приложение под локальным WSGI-сервером и измеряет его под нагрузкой'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=0,
+                            help='Добавить в базу синтетический каталог из указанного числа книг')
+        parser.add_argument('--reviews-per-book', type=int, default=5)
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Путь для запросов (можно повторять), по умолчанию /')
+        parser.add_argument('--admin', action='store_true',
+                            help='Нагружать также списки администратора (от имени суперпользователя)')
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help='Количество одновременных клиентов')
+        parser.add_argument('--requests', type=int, default=None,
+                            help='Общее количество запросов')
+        parser.add_argument('--duration', type=float, default=None,
+                            help='Длительность прогона в секундах')
+        parser.add_argument('--warmup', type=int, default=20,
+                            help='Запросов прогрева, не попадающих в результаты')
+
+    def admin_cookies(self):
+        """Сессия суперпользователя для страниц администратора."""
+        user = User.objects.filter(username=ADMIN_USERNAME).first()
+        if user is None:
+            user = User.objects.create_superuser(ADMIN_USERNAME, '', None)
+        client = Client()
+        client.force_login(user)
+        return {name: morsel.value for name, morsel in client.cookies.items()}
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency должно быть положительным')
+        requests, duration = options['requests'], options['duration']
+        if requests is None and duration is None:
+            requests = 500
+
+        if options['books']:
+            books, reviews = loadtest.seed_catalog(options['books'], options['reviews_per_book'])
+            # Массовые вставки не отправляют сигналов: кэши обновляем сами
+            refresh_snapshot_cache()
+            self.stdout.write(f'Добавлено книг: {books}, отзывов: {reviews}')
+
+        paths = options['paths'] or ['/']
+        cookies = {}
+        if options['admin']:
+            paths += ADMIN_PATHS
+            cookies = self.admin_cookies()
+
+        app = loadtest.QueryCountingApp(loadtest.wsgi_application())
+        server = loadtest.start_server(app)
+        address = server.server_address[:2]
+        self.stdout.write(f"Сервер: http://{address[0]}:{address[1]}, пути: {', '.join(paths)}")
+        try:
+            if options['warmup']:
+                loadtest.run_load(address, paths, options['concurrency'], requests=options['warmup'],
+                                  cookies=cookies)
+                app.query_counts.clear()
+            result = loadtest.run_load(address, paths, options['concurrency'], requests=requests,
+                                       duration=duration, cookies=cookies)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        summary = loadtest.summarize(result, app.query_counts)
+        latency = summary['latency_ms']
+        self.stdout.write(f"\nЗапросов: {summary['requests']} за {summary['elapsed']:.2f} с "
+                          f"(клиентов: {options['concurrency']})")
+        self.stdout.write(f"Пропускная способность: {summary['throughput']:.1f} запросов/с")
+        self.stdout.write(
+            f"Задержка, мс: p50 {latency['p50']:.1f}, p90 {latency['p90']:.1f}, "
+            f"p99 {latency['p99']:.1f}, max {latency['max']:.1f}"
+        )
+        self.stdout.write(f"Коды ответов: {summary['statuses']}")
+        self.stdout.write(f"Доля ошибок: {summary['error_rate']:.2%}")
+        self.stdout.write(f"SQL-запросов на запрос: {summary['queries_per_request']:.1f} "
+                          f"(максимум {summary['max_queries']})")
+        if summary['error_rate']:
+            self.stdout.write(self.style.WARNING('Часть запросов завершилась ошибкой'))
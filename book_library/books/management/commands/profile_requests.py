@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from books.profiling import MODES, force_profiling
+
+
+class Command(BaseCommand):
+    """
+    Management команда для профилирования страниц без запуска сервера.
+    Запуск: python manage.py profile_requests --path / --repeat 5 --mode sample
+    """
+    help = 'Профилирует запросы к страницам и записывает flame graph (свернутые стеки)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Путь страницы (можно повторять), по умолчанию /')
+        parser.add_argument('--repeat', type=int, default=1,
+                            help='Сколько раз профилировать каждый путь')
+        parser.add_argument('--mode', choices=MODES, default=None,
+                            help='Профилировщик: sample (сэмплирующий) или cprofile')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat должно быть положительным')
+
+        client = Client(HTTP_HOST='localhost')
+        with force_profiling(options['mode']):
+            for path in options['paths'] or ['/']:
+                for _ in range(options['repeat']):
+                    response = client.get(path)
+                    summary = response.wsgi_request.profile_summary
+                    phases = ', '.join(
+                        f'{phase} {value:.1f}' for phase, value in summary['phases_ms'].items()
+                    )
+                    self.stdout.write(
+                        f"{path} [{response.status_code}] {summary['total_ms']:.1f} мс, "
+                        f"SQL-запросов: {summary['queries']} ({phases})"
+                    )
+                    self.stdout.write(f"  {summary['files']['collapsed']}")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from books.dashboard import refresh_snapshot_cache
+from books.static_homepage import publish_homepage
+
+
+class Command(BaseCommand):
+    """
+    Management команда для публикации главной страницы статическими файлами.
+    Запуск: python manage.py publish_homepage
+    """
+    help = 'Отрисовывает главную страницу в index.html и сжатые варианты (.gz, .br)'
+
+    def handle(self, *args, **options):
+        refresh_snapshot_cache()
+        for encoding, path in publish_homepage().items():
+            self.stdout.write(f'{encoding}: {path} ({path.stat().st_size} байт)')
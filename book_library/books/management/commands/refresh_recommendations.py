@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+from books.recommendations import TOP_K, rebuild_recommendations, refresh_recommendations
+
+
+class Command(BaseCommand):
+    """
+    Management команда для пересчета рекомендаций «есть в тех же магазинах».
+    Запуск: python manage.py refresh_recommendations [--full]
+    """
+    help = 'Пересчитывает рекомендации книг по разреженной матрице книга x магазин'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Пересчитать все книги, а не только затронутые изменениями')
+        parser.add_argument('--top', type=int, default=TOP_K,
+                            help='Количество рекомендаций на книгу')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['full']:
+            count = rebuild_recommendations(options['top'])
+        else:
+            count = refresh_recommendations(options['top'])
+        elapsed = (time.perf_counter() - started) * 1000
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано книг: {count} за {elapsed:.1f} мс'))
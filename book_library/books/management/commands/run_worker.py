@@ -0,0 +1,42 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from books.tasks import run_worker
+
+
+class Command(BaseCommand):
+    """
+    Management команда для запуска воркера фоновых задач.
+    Запуск: python manage.py run_worker --concurrency 4
+    """
+    help = 'Запускает воркер фоновых задач'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Количество потоков для выполнения задач')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Интервал опроса очереди в секундах')
+        parser.add_argument('--burst', action='store_true',
+                            help='Выполнить готовые задачи и завершиться')
+
+    def handle(self, *args, **options):
+        stop_event = threading.Event()
+
+        def stop(signum, frame):
+            self.stdout.write('Получен сигнал остановки, завершаем текущие задачи...')
+            stop_event.set()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Воркер запущен (потоков: {options['concurrency']})"
+        ))
+        processed = run_worker(
+            concurrency=options['concurrency'],
+            poll_interval=options['poll_interval'],
+            burst=options['burst'],
+            stop_event=stop_event,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Выполнено задач: {processed}'))
@@ -0,0 +1,109 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:54
+
+from django.db import migrations, models
+
+
+from books.changelog import execute_trigger_sql
+
+
+# Таблицы каталога, изменения которых пишутся в журнал:
+# имя таблицы -> (колонка row_id, колонка ref_id)
+TABLES = {
+    'books_author': ('id', None),
+    'books_publisher': ('id', None),
+    'books_store': ('id', None),
+    'books_book': ('id', None),
+    'books_review': ('id', None),
+    'books_book_stores': ('book_id', 'store_id'),
+}
+
+# SQL триггеров на момент этой миграции
+POSTGRESQL_FUNCTION = """
+CREATE OR REPLACE FUNCTION books_changelog_capture() RETURNS trigger AS $$
+DECLARE
+    data jsonb;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        data := to_jsonb(OLD);
+    ELSE
+        data := to_jsonb(NEW);
+    END IF;
+    INSERT INTO books_changelogentry (table_name, operation, row_id, ref_id, created_date)
+    VALUES (
+        TG_TABLE_NAME,
+        left(TG_OP, 1),
+        (data ->> TG_ARGV[0])::bigint,
+        (data ->> NULLIF(TG_ARGV[1], ''))::bigint,
+        clock_timestamp()
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+INSTALL_SQL = {
+    'sqlite': (
+        'CREATE TRIGGER {table}_changelog_insert AFTER INSERT ON {table} BEGIN '
+        'INSERT INTO books_changelogentry (table_name, operation, row_id, ref_id, created_date) '
+        "VALUES ('{table}', 'I', NEW.{row_column}, {new_ref}, strftime('%Y-%m-%d %H:%M:%f', 'now')); END",
+        'CREATE TRIGGER {table}_changelog_update AFTER UPDATE ON {table} BEGIN '
+        'INSERT INTO books_changelogentry (table_name, operation, row_id, ref_id, created_date) '
+        "VALUES ('{table}', 'U', NEW.{row_column}, {new_ref}, strftime('%Y-%m-%d %H:%M:%f', 'now')); END",
+        'CREATE TRIGGER {table}_changelog_delete AFTER DELETE ON {table} BEGIN '
+        'INSERT INTO books_changelogentry (table_name, operation, row_id, ref_id, created_date) '
+        "VALUES ('{table}', 'D', OLD.{row_column}, {old_ref}, strftime('%Y-%m-%d %H:%M:%f', 'now')); END",
+    ),
+    'postgresql': (
+        'CREATE TRIGGER {table}_changelog AFTER INSERT OR UPDATE OR DELETE ON {table} '
+        "FOR EACH ROW EXECUTE FUNCTION books_changelog_capture('{row_column}', '{ref_column}')",
+    ),
+}
+
+REMOVE_SQL = {
+    'sqlite': (
+        'DROP TRIGGER IF EXISTS {table}_changelog_insert',
+        'DROP TRIGGER IF EXISTS {table}_changelog_update',
+        'DROP TRIGGER IF EXISTS {table}_changelog_delete',
+    ),
+    'postgresql': ('DROP TRIGGER IF EXISTS {table}_changelog ON {table}',),
+}
+
+
+def install_triggers(apps, schema_editor):
+    """Создает триггеры, записывающие изменения таблиц каталога в журнал."""
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(POSTGRESQL_FUNCTION)
+    execute_trigger_sql(schema_editor, TABLES, INSTALL_SQL)
+
+
+def remove_triggers(apps, schema_editor):
+    execute_trigger_sql(schema_editor, TABLES, REMOVE_SQL)
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP FUNCTION IF EXISTS books_changelog_capture()')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_task'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLogEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('table_name', models.CharField(max_length=100, verbose_name='Таблица')),
+                ('operation', models.CharField(choices=[('I', 'Добавление'), ('U', 'Изменение'), ('D', 'Удаление')], max_length=1, verbose_name='Операция')),
+                ('row_id', models.BigIntegerField(verbose_name='ID строки')),
+                ('ref_id', models.BigIntegerField(blank=True, null=True, verbose_name='ID связанной строки')),
+                ('created_date', models.DateTimeField(verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'Запись журнала изменений',
+                'verbose_name_plural': 'Журнал изменений',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.RunPython(install_triggers, remove_triggers),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_changelogentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['book', 'created_date', 'id'], name='review_book_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,189 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from books.changelog import execute_trigger_sql
+
+# Таблицы, которые SQLite пересоздает при изменении столбцов (триггеры удаляются вместе с ними):
+# имя таблицы -> (колонка row_id, колонка ref_id)
+REBUILT_TABLES = {
+    'books_publisher': ('id', None),
+    'books_store': ('id', None),
+}
+
+# Новые справочники, изменения которых тоже пишутся в журнал
+LOOKUP_TABLES = {
+    'books_country': ('id', None),
+    'books_city': ('id', None),
+}
+
+# SQL триггеров на момент этой миграции (функция PostgreSQL создана в 0004_changelogentry)
+INSTALL_SQL = {
+    'sqlite': (
+        'CREATE TRIGGER {table}_changelog_insert AFTER INSERT ON {table} BEGIN '
+        'INSERT INTO books_changelogentry (table_name, operation, row_id, ref_id, created_date) '
+        "VALUES ('{table}', 'I', NEW.{row_column}, {new_ref}, strftime('%Y-%m-%d %H:%M:%f', 'now')); END",
+        'CREATE TRIGGER {table}_changelog_update AFTER UPDATE ON {table} BEGIN '
+        'INSERT INTO books_changelogentry (table_name, operation, row_id, ref_id, created_date) '
+        "VALUES ('{table}', 'U', NEW.{row_column}, {new_ref}, strftime('%Y-%m-%d %H:%M:%f', 'now')); END",
+        'CREATE TRIGGER {table}_changelog_delete AFTER DELETE ON {table} BEGIN '
+        'INSERT INTO books_changelogentry (table_name, operation, row_id, ref_id, created_date) '
+        "VALUES ('{table}', 'D', OLD.{row_column}, {old_ref}, strftime('%Y-%m-%d %H:%M:%f', 'now')); END",
+    ),
+    'postgresql': (
+        'CREATE TRIGGER {table}_changelog AFTER INSERT OR UPDATE OR DELETE ON {table} '
+        "FOR EACH ROW EXECUTE FUNCTION books_changelog_capture('{row_column}', '{ref_column}')",
+    ),
+}
+
+REMOVE_SQL = {
+    'sqlite': (
+        'DROP TRIGGER IF EXISTS {table}_changelog_insert',
+        'DROP TRIGGER IF EXISTS {table}_changelog_update',
+        'DROP TRIGGER IF EXISTS {table}_changelog_delete',
+    ),
+    'postgresql': ('DROP TRIGGER IF EXISTS {table}_changelog ON {table}',),
+}
+
+
+def normalize_name(name):
+    return ' '.join(name.split())
+
+
+def fill_lookups(apps, schema_editor):
+    """Переносит названия стран и городов в справочники без повторов."""
+    Country = apps.get_model('books', 'Country')
+    City = apps.get_model('books', 'City')
+    Publisher = apps.get_model('books', 'Publisher')
+    Store = apps.get_model('books', 'Store')
+
+    for lookup, model, name_field, key_field in (
+        (Country, Publisher, 'country_name', 'country'),
+        (City, Store, 'city_name', 'city'),
+    ):
+        names = {}
+        for value in model.objects.values_list(name_field, flat=True).distinct():
+            names.setdefault(normalize_name(value), []).append(value)
+        lookup.objects.bulk_create([lookup(name=name) for name in sorted(names)])
+        ids = dict(lookup.objects.values_list('name', 'id'))
+        # Один UPDATE на каждое исходное написание, а не на каждую строку
+        for name, values in names.items():
+            model.objects.filter(**{f'{name_field}__in': values}).update(**{f'{key_field}_id': ids[name]})
+
+
+def restore_names(apps, schema_editor):
+    Publisher = apps.get_model('books', 'Publisher')
+    Store = apps.get_model('books', 'Store')
+    Country = apps.get_model('books', 'Country')
+    City = apps.get_model('books', 'City')
+    for country_id, name in Country.objects.values_list('id', 'name'):
+        Publisher.objects.filter(country_id=country_id).update(country_name=name)
+    for city_id, name in City.objects.values_list('id', 'name'):
+        Store.objects.filter(city_id=city_id).update(city_name=name)
+
+
+def reinstall_rebuilt_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        execute_trigger_sql(schema_editor, REBUILT_TABLES, REMOVE_SQL)
+        execute_trigger_sql(schema_editor, REBUILT_TABLES, INSTALL_SQL)
+
+
+def install_lookup_triggers(apps, schema_editor):
+    reinstall_rebuilt_triggers(apps, schema_editor)
+    execute_trigger_sql(schema_editor, LOOKUP_TABLES, INSTALL_SQL)
+
+
+def remove_lookup_triggers(apps, schema_editor):
+    execute_trigger_sql(schema_editor, LOOKUP_TABLES, REMOVE_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0008_bookrecommendation'),
+    ]
+
+    operations = [
+        # При откате выполняется последней и восстанавливает триггеры пересозданных таблиц
+        migrations.RunPython(migrations.RunPython.noop, reinstall_rebuilt_triggers),
+        migrations.CreateModel(
+            name='City',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Название')),
+            ],
+            options={
+                'verbose_name': 'Город',
+                'verbose_name_plural': 'Города',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Country',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Название')),
+            ],
+            options={
+                'verbose_name': 'Страна',
+                'verbose_name_plural': 'Страны',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='store',
+            name='store_city_idx',
+        ),
+        migrations.RenameField(
+            model_name='publisher',
+            old_name='country',
+            new_name='country_name',
+        ),
+        migrations.RenameField(
+            model_name='store',
+            old_name='city',
+            new_name='city_name',
+        ),
+        migrations.AddField(
+            model_name='publisher',
+            name='country',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='publishers', to='books.country', verbose_name='Страна'),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='city',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='stores', to='books.city', verbose_name='Город'),
+        ),
+        # Старые столбцы допускают NULL, чтобы при откате их можно было вернуть до заполнения
+        migrations.AlterField(
+            model_name='publisher',
+            name='country_name',
+            field=models.CharField(max_length=100, null=True, verbose_name='Страна'),
+        ),
+        migrations.AlterField(
+            model_name='store',
+            name='city_name',
+            field=models.CharField(max_length=100, null=True, verbose_name='Город'),
+        ),
+        migrations.RunPython(fill_lookups, restore_names),
+        migrations.RemoveField(
+            model_name='publisher',
+            name='country_name',
+        ),
+        migrations.RemoveField(
+            model_name='store',
+            name='city_name',
+        ),
+        migrations.AlterField(
+            model_name='publisher',
+            name='country',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='publishers', to='books.country', verbose_name='Страна'),
+        ),
+        migrations.AlterField(
+            model_name='store',
+            name='city',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='stores', to='books.city', verbose_name='Город'),
+        ),
+        migrations.RunPython(install_lookup_triggers, remove_lookup_triggers),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:05
+
+from django.db import migrations
+
+from books.fast_delete import execute_cascade_sql
+
+
+# Каскадные связи: (зависимая таблица, столбец внешнего ключа, родительская таблица)
+CASCADES = (
+    ('books_book', 'author_id', 'books_author'),
+    ('books_book', 'publisher_id', 'books_publisher'),
+    ('books_review', 'book_id', 'books_book'),
+    ('books_book_stores', 'book_id', 'books_book'),
+    ('books_book_stores', 'store_id', 'books_store'),
+    ('books_bookrecommendation', 'book_id', 'books_book'),
+    ('books_bookrecommendation', 'recommended_id', 'books_book'),
+)
+
+# SQL каскадов на момент этой миграции. В SQLite ограничения внешних ключей
+# нельзя изменить без пересоздания таблиц, поэтому каскад реализован триггерами
+# BEFORE DELETE: триггер родителя удаляет строки зависимой таблицы,
+# а ее собственные триггеры - строки следующего уровня
+INSTALL_SQL = {
+    'sqlite': (
+        'CREATE TRIGGER {table}_{column}_cascade BEFORE DELETE ON {parent} '
+        'BEGIN DELETE FROM {table} WHERE {column} = OLD.id; END',
+    ),
+    'postgresql': (
+        'ALTER TABLE {table} DROP CONSTRAINT {constraint}',
+        'ALTER TABLE {table} ADD CONSTRAINT {constraint} FOREIGN KEY ({column}) '
+        'REFERENCES {parent} (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED',
+    ),
+}
+
+REMOVE_SQL = {
+    'sqlite': ('DROP TRIGGER IF EXISTS {table}_{column}_cascade',),
+    'postgresql': (
+        'ALTER TABLE {table} DROP CONSTRAINT {constraint}',
+        'ALTER TABLE {table} ADD CONSTRAINT {constraint} FOREIGN KEY ({column}) '
+        'REFERENCES {parent} (id) DEFERRABLE INITIALLY DEFERRED',
+    ),
+}
+
+
+def install_cascades(apps, schema_editor):
+    """Удаление строки родительской таблицы удаляет зависимые строки в самой базе данных."""
+    execute_cascade_sql(schema_editor, CASCADES, INSTALL_SQL)
+
+
+def remove_cascades(apps, schema_editor):
+    execute_cascade_sql(schema_editor, CASCADES, REMOVE_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_country_city'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_cascades, remove_cascades),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from books.fast_delete import execute_cascade_sql
+
+
+CASCADES = (('books_bookratingshard', 'book_id', 'books_book'),)
+
+# SQL каскадов на момент этой миграции (см. 0010_database_cascades)
+INSTALL_SQL = {
+    'sqlite': (
+        'CREATE TRIGGER {table}_{column}_cascade BEFORE DELETE ON {parent} '
+        'BEGIN DELETE FROM {table} WHERE {column} = OLD.id; END',
+    ),
+    'postgresql': (
+        'ALTER TABLE {table} DROP CONSTRAINT {constraint}',
+        'ALTER TABLE {table} ADD CONSTRAINT {constraint} FOREIGN KEY ({column}) '
+        'REFERENCES {parent} (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED',
+    ),
+}
+
+REMOVE_SQL = {
+    'sqlite': ('DROP TRIGGER IF EXISTS {table}_{column}_cascade',),
+    'postgresql': (
+        'ALTER TABLE {table} DROP CONSTRAINT {constraint}',
+        'ALTER TABLE {table} ADD CONSTRAINT {constraint} FOREIGN KEY ({column}) '
+        'REFERENCES {parent} (id) DEFERRABLE INITIALLY DEFERRED',
+    ),
+}
+
+
+def fill_counters(apps, schema_editor):
+    """Счетчики существующих отзывов записываются в часть 0 каждой книги."""
+    Review = apps.get_model('books', 'Review')
+    BookRatingShard = apps.get_model('books', 'BookRatingShard')
+    totals = Review.objects.values('book_id').annotate(
+        count=models.Count('id'), total=models.Sum('rating')
+    ).order_by()
+    BookRatingShard.objects.bulk_create([
+        BookRatingShard(book_id=row['book_id'], shard=0, count=row['count'], total=row['total'])
+        for row in totals
+    ], batch_size=1000)
+
+
+def install_cascade(apps, schema_editor):
+    """Части счетчика удаляются вместе с книгой в базе данных."""
+    execute_cascade_sql(schema_editor, CASCADES, INSTALL_SQL)
+
+
+def remove_cascade(apps, schema_editor):
+    execute_cascade_sql(schema_editor, CASCADES, REMOVE_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0010_database_cascades'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookRatingShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField(verbose_name='Номер части')),
+                ('count', models.IntegerField(default=0, verbose_name='Количество оценок')),
+                ('total', models.IntegerField(default=0, verbose_name='Сумма оценок')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_shards', to='books.book', verbose_name='Книга')),
+            ],
+            options={
+                'verbose_name': 'Часть счетчика оценок',
+                'verbose_name_plural': 'Счетчики оценок',
+                'constraints': [models.UniqueConstraint(fields=('book', 'shard'), name='unique_rating_shard')],
+            },
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+        migrations.RunPython(install_cascade, remove_cascade),
+    ]
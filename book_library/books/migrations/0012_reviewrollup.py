@@ -0,0 +1,106 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:20
+
+from collections import Counter, defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from books.fast_delete import execute_cascade_sql
+
+
+CASCADES = (('books_reviewrollup', 'book_id', 'books_book'),)
+
+# SQL каскадов на момент этой миграции (см. 0010_database_cascades)
+INSTALL_SQL = {
+    'sqlite': (
+        'CREATE TRIGGER {table}_{column}_cascade BEFORE DELETE ON {parent} '
+        'BEGIN DELETE FROM {table} WHERE {column} = OLD.id; END',
+    ),
+    'postgresql': (
+        'ALTER TABLE {table} DROP CONSTRAINT {constraint}',
+        'ALTER TABLE {table} ADD CONSTRAINT {constraint} FOREIGN KEY ({column}) '
+        'REFERENCES {parent} (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED',
+    ),
+}
+
+REMOVE_SQL = {
+    'sqlite': ('DROP TRIGGER IF EXISTS {table}_{column}_cascade',),
+    'postgresql': (
+        'ALTER TABLE {table} DROP CONSTRAINT {constraint}',
+        'ALTER TABLE {table} ADD CONSTRAINT {constraint} FOREIGN KEY ({column}) '
+        'REFERENCES {parent} (id) DEFERRABLE INITIALLY DEFERRED',
+    ),
+}
+
+FIELDS = ('count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5')
+
+
+def fill_rollups(apps, schema_editor):
+    """Сводки существующих отзывов записываются в часть 0 (см. review_rollups.rebuild_review_rollups)."""
+    Review = apps.get_model('books', 'Review')
+    ReviewRollup = apps.get_model('books', 'ReviewRollup')
+    days = Review.objects.annotate(
+        day=TruncDate('created_date', tzinfo=timezone.get_default_timezone())
+    ).values('book_id', 'day').annotate(
+        count=models.Count('id'),
+        rating_sum=models.Sum('rating'),
+        **{f'rating_{rating}': models.Count('id', filter=models.Q(rating=rating)) for rating in range(1, 6)},
+    ).order_by()
+    totals = defaultdict(Counter)
+    for row in days:
+        values = {name: row[name] for name in FIELDS}
+        month = row['day'].replace(day=1)
+        for key in (
+            ('day', row['day'], row['book_id']), ('month', month, row['book_id']),
+            ('day', row['day'], None), ('month', month, None),
+        ):
+            totals[key].update(values)
+    ReviewRollup.objects.bulk_create([
+        ReviewRollup(period=period, period_start=start, book_id=book_id, **values)
+        for (period, start, book_id), values in totals.items()
+    ], batch_size=1000)
+
+
+def install_cascade(apps, schema_editor):
+    """Сводки книги удаляются вместе с книгой в базе данных."""
+    execute_cascade_sql(schema_editor, CASCADES, INSTALL_SQL)
+
+
+def remove_cascade(apps, schema_editor):
+    execute_cascade_sql(schema_editor, CASCADES, REMOVE_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0011_bookratingshard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'День'), ('month', 'Месяц')], max_length=5, verbose_name='Период')),
+                ('period_start', models.DateField(verbose_name='Начало периода')),
+                ('shard', models.PositiveSmallIntegerField(default=0, verbose_name='Номер части')),
+                ('count', models.IntegerField(default=0, verbose_name='Количество отзывов')),
+                ('rating_sum', models.IntegerField(default=0, verbose_name='Сумма оценок')),
+                ('rating_1', models.IntegerField(default=0, verbose_name='Оценок 1')),
+                ('rating_2', models.IntegerField(default=0, verbose_name='Оценок 2')),
+                ('rating_3', models.IntegerField(default=0, verbose_name='Оценок 3')),
+                ('rating_4', models.IntegerField(default=0, verbose_name='Оценок 4')),
+                ('rating_5', models.IntegerField(default=0, verbose_name='Оценок 5')),
+                ('book', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='review_rollups', to='books.book', verbose_name='Книга')),
+            ],
+            options={
+                'verbose_name': 'Сводка отзывов',
+                'verbose_name_plural': 'Сводки отзывов',
+                'constraints': [models.UniqueConstraint(condition=models.Q(('book__isnull', False)), fields=('book', 'period', 'period_start', 'shard'), name='unique_book_review_rollup'), models.UniqueConstraint(condition=models.Q(('book__isnull', True)), fields=('period', 'period_start', 'shard'), name='unique_catalog_review_rollup')],
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+        migrations.RunPython(install_cascade, remove_cascade),
+    ]
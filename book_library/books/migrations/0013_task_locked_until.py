@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:36
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+
+def rehash_dedup_keys(apps, schema_editor):
+    """Ключи ожидающих задач пересчитываются в новом виде (см. tasks.make_dedup_key)."""
+    Task = apps.get_model('books', 'Task')
+    for task in Task.objects.filter(status='pending'):
+        canonical = json.dumps(task.payload, sort_keys=True, ensure_ascii=False)
+        task.dedup_key = f"{task.name}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+        task.save(update_fields=['dedup_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0012_reviewrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='locked_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Захвачена до'),
+        ),
+        migrations.RunPython(rehash_dedup_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0013_task_locked_until'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLogCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Потребитель')),
+                ('cursor', models.BigIntegerField(verbose_name='Курсор')),
+                ('updated_date', models.DateTimeField(auto_now=True, verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'Курсор журнала изменений',
+                'verbose_name_plural': 'Курсоры журнала изменений',
+            },
+        ),
+    ]
@@ -0,0 +1,141 @@
+from django.db import migrations
+
+from books.changelog import execute_trigger_sql
+
+
+# Записи журнала об отзывах хранят id книги в ref_id, а изменение ref_id
+# записывает и прежнее значение (перенос отзыва к другой книге обновляет обе):
+# имя таблицы -> (колонка row_id, колонка ref_id)
+TABLES = {
+    'books_review': ('id', 'book_id'),
+    'books_book_stores': ('book_id', 'store_id'),
+}
+
+# Те же таблицы до этой миграции (0004_changelogentry)
+PREVIOUS_TABLES = {
+    'books_review': ('id', None),
+    'books_book_stores': ('book_id', 'store_id'),
+}
+
+# SQL триггеров на момент этой миграции
+POSTGRESQL_FUNCTION = """
+CREATE OR REPLACE FUNCTION books_changelog_capture() RETURNS trigger AS $$
+DECLARE
+    data jsonb;
+    old_data jsonb;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        data := to_jsonb(OLD);
+    ELSE
+        data := to_jsonb(NEW);
+    END IF;
+    IF TG_OP = 'UPDATE' AND TG_ARGV[1] <> '' THEN
+        old_data := to_jsonb(OLD);
+        IF (old_data ->> TG_ARGV[1]) IS DISTINCT FROM (data ->> TG_ARGV[1]) THEN
+            INSERT INTO books_changelogentry (table_name, operation, row_id, ref_id, created_date)
+            VALUES (
+                TG_TABLE_NAME, 'U',
+                (old_data ->> TG_ARGV[0])::bigint, (old_data ->> TG_ARGV[1])::bigint,
+                clock_timestamp()
+            );
+        END IF;
+    END IF;
+    INSERT INTO books_changelogentry (table_name, operation, row_id, ref_id, created_date)
+    VALUES (
+        TG_TABLE_NAME,
+        left(TG_OP, 1),
+        (data ->> TG_ARGV[0])::bigint,
+        (data ->> NULLIF(TG_ARGV[1], ''))::bigint,
+        clock_timestamp()
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+# Функция PostgreSQL до этой миграции: без записи прежнего ref_id
+PREVIOUS_POSTGRESQL_FUNCTION = """
+CREATE OR REPLACE FUNCTION books_changelog_capture() RETURNS trigger AS $$
+DECLARE
+    data jsonb;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        data := to_jsonb(OLD);
+    ELSE
+        data := to_jsonb(NEW);
+    END IF;
+    INSERT INTO books_changelogentry (table_name, operation, row_id, ref_id, created_date)
+    VALUES (
+        TG_TABLE_NAME,
+        left(TG_OP, 1),
+        (data ->> TG_ARGV[0])::bigint,
+        (data ->> NULLIF(TG_ARGV[1], ''))::bigint,
+        clock_timestamp()
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+INSTALL_SQL = {
+    'sqlite': (
+        'CREATE TRIGGER {table}_changelog_insert AFTER INSERT ON {table} BEGIN '
+        'INSERT INTO books_changelogentry (table_name, operation, row_id, ref_id, created_date) '
+        "VALUES ('{table}', 'I', NEW.{row_column}, {new_ref}, strftime('%Y-%m-%d %H:%M:%f', 'now')); END",
+        'CREATE TRIGGER {table}_changelog_update AFTER UPDATE ON {table} BEGIN '
+        'INSERT INTO books_changelogentry (table_name, operation, row_id, ref_id, created_date) '
+        "VALUES ('{table}', 'U', NEW.{row_column}, {new_ref}, strftime('%Y-%m-%d %H:%M:%f', 'now')); END",
+        'CREATE TRIGGER {table}_changelog_delete AFTER DELETE ON {table} BEGIN '
+        'INSERT INTO books_changelogentry (table_name, operation, row_id, ref_id, created_date) '
+        "VALUES ('{table}', 'D', OLD.{row_column}, {old_ref}, strftime('%Y-%m-%d %H:%M:%f', 'now')); END",
+    ),
+    'postgresql': (
+        'CREATE TRIGGER {table}_changelog AFTER INSERT OR UPDATE OR DELETE ON {table} '
+        "FOR EACH ROW EXECUTE FUNCTION books_changelog_capture('{row_column}', '{ref_column}')",
+    ),
+}
+
+# Прежнее значение ref_id при его изменении (в PostgreSQL его пишет функция)
+MOVE_SQL = {
+    'sqlite': (
+        'CREATE TRIGGER {table}_changelog_move AFTER UPDATE OF {ref_column} ON {table} '
+        'WHEN OLD.{ref_column} IS NOT NEW.{ref_column} BEGIN '
+        'INSERT INTO books_changelogentry (table_name, operation, row_id, ref_id, created_date) '
+        "VALUES ('{table}', 'U', OLD.{row_column}, OLD.{ref_column}, strftime('%Y-%m-%d %H:%M:%f', 'now')); END",
+    ),
+}
+
+REMOVE_SQL = {
+    'sqlite': (
+        'DROP TRIGGER IF EXISTS {table}_changelog_insert',
+        'DROP TRIGGER IF EXISTS {table}_changelog_update',
+        'DROP TRIGGER IF EXISTS {table}_changelog_delete',
+        'DROP TRIGGER IF EXISTS {table}_changelog_move',
+    ),
+    'postgresql': ('DROP TRIGGER IF EXISTS {table}_changelog ON {table}',),
+}
+
+
+def install_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(POSTGRESQL_FUNCTION)
+    execute_trigger_sql(schema_editor, TABLES, REMOVE_SQL)
+    execute_trigger_sql(schema_editor, TABLES, INSTALL_SQL, MOVE_SQL)
+
+
+def restore_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(PREVIOUS_POSTGRESQL_FUNCTION)
+    execute_trigger_sql(schema_editor, PREVIOUS_TABLES, REMOVE_SQL)
+    execute_trigger_sql(schema_editor, PREVIOUS_TABLES, INSTALL_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0014_changelogcursor'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_triggers, restore_triggers),
+    ]
@@ -0,0 +1,71 @@
+from django.db import migrations
+
+from books.changelog import execute_trigger_sql
+
+
+# Записи журнала о книгах хранят id автора в ref_id, а смена автора
+# записывает и прежнего автора: имя таблицы -> (колонка row_id, колонка ref_id)
+TABLES = {'books_book': ('id', 'author_id')}
+
+# Та же таблица до этой миграции (0004_changelogentry)
+PREVIOUS_TABLES = {'books_book': ('id', None)}
+
+# SQL триггеров на момент этой миграции (функция PostgreSQL - из 0015_review_changelog_book)
+INSTALL_SQL = {
+    'sqlite': (
+        'CREATE TRIGGER {table}_changelog_insert AFTER INSERT ON {table} BEGIN '
+        'INSERT INTO books_changelogentry (table_name, operation, row_id, ref_id, created_date) '
+        "VALUES ('{table}', 'I', NEW.{row_column}, {new_ref}, strftime('%Y-%m-%d %H:%M:%f', 'now')); END",
+        'CREATE TRIGGER {table}_changelog_update AFTER UPDATE ON {table} BEGIN '
+        'INSERT INTO books_changelogentry (table_name, operation, row_id, ref_id, created_date) '
+        "VALUES ('{table}', 'U', NEW.{row_column}, {new_ref}, strftime('%Y-%m-%d %H:%M:%f', 'now')); END",
+        'CREATE TRIGGER {table}_changelog_delete AFTER DELETE ON {table} BEGIN '
+        'INSERT INTO books_changelogentry (table_name, operation, row_id, ref_id, created_date) '
+        "VALUES ('{table}', 'D', OLD.{row_column}, {old_ref}, strftime('%Y-%m-%d %H:%M:%f', 'now')); END",
+    ),
+    'postgresql': (
+        'CREATE TRIGGER {table}_changelog AFTER INSERT OR UPDATE OR DELETE ON {table} '
+        "FOR EACH ROW EXECUTE FUNCTION books_changelog_capture('{row_column}', '{ref_column}')",
+    ),
+}
+
+# Прежнее значение ref_id при его изменении (в PostgreSQL его пишет функция)
+MOVE_SQL = {
+    'sqlite': (
+        'CREATE TRIGGER {table}_changelog_move AFTER UPDATE OF {ref_column} ON {table} '
+        'WHEN OLD.{ref_column} IS NOT NEW.{ref_column} BEGIN '
+        'INSERT INTO books_changelogentry (table_name, operation, row_id, ref_id, created_date) '
+        "VALUES ('{table}', 'U', OLD.{row_column}, OLD.{ref_column}, strftime('%Y-%m-%d %H:%M:%f', 'now')); END",
+    ),
+}
+
+REMOVE_SQL = {
+    'sqlite': (
+        'DROP TRIGGER IF EXISTS {table}_changelog_insert',
+        'DROP TRIGGER IF EXISTS {table}_changelog_update',
+        'DROP TRIGGER IF EXISTS {table}_changelog_delete',
+        'DROP TRIGGER IF EXISTS {table}_changelog_move',
+    ),
+    'postgresql': ('DROP TRIGGER IF EXISTS {table}_changelog ON {table}',),
+}
+
+
+def install_triggers(apps, schema_editor):
+    execute_trigger_sql(schema_editor, TABLES, REMOVE_SQL)
+    execute_trigger_sql(schema_editor, TABLES, INSTALL_SQL, MOVE_SQL)
+
+
+def restore_triggers(apps, schema_editor):
+    execute_trigger_sql(schema_editor, PREVIOUS_TABLES, REMOVE_SQL)
+    execute_trigger_sql(schema_editor, PREVIOUS_TABLES, INSTALL_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0015_review_changelog_book'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_triggers, restore_triggers),
+    ]
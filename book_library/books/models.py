@@ -1,4 +1,9 @@
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+
+from .date_ranges import published_after, published_between, published_since
+from .display import query_free_str, related_label
 
 class Author(models.Model):
     """
@@ -8,6 +13,41 @@ class Author(models.Model):
     name = models.CharField(max_length=100)
     bio = models.TextField()
 
+    @query_free_str
+    def __str__(self):
+        return self.name
+
+
+class Country(models.Model):
+    """
+    Справочник стран издательств.
+    Издательства ссылаются на страну целочисленным ключом (см. locations.py).
+    """
+    name = models.CharField(max_length=100, unique=True, verbose_name="Название")
+
+    class Meta:
+        verbose_name = "Страна"
+        verbose_name_plural = "Страны"
+        ordering = ['name']
+
+    @query_free_str
+    def __str__(self):
+        return self.name
+
+
+class City(models.Model):
+    """
+    Справочник городов магазинов.
+    Магазины ссылаются на город целочисленным ключом (см. locations.py).
+    """
+    name = models.CharField(max_length=100, unique=True, verbose_name="Название")
+
+    class Meta:
+        verbose_name = "Город"
+        verbose_name_plural = "Города"
+        ordering = ['name']
+
+    @query_free_str
     def __str__(self):
         return self.name
 
@@ -18,14 +58,20 @@ class Publisher(models.Model):
     Связь: одно издательство может опубликовать много книг (один ко многим).
     """
     name = models.CharField(max_length=200, verbose_name="Название издательства")
-    country = models.CharField(max_length=100, verbose_name="Страна")
+    country = models.ForeignKey(
+        Country,
+        on_delete=models.PROTECT,
+        related_name='publishers',
+        verbose_name="Страна"
+    )
     
     class Meta:
         verbose_name = "Издательство"
         verbose_name_plural = "Издательства"
 
+    @query_free_str
     def __str__(self):
-        return f"{self.name} ({self.country})"
+        return f"{self.name} ({related_label(self, 'country', 'name')})"
 
 
 class Store(models.Model):
@@ -35,14 +81,33 @@ class Store(models.Model):
     и одна книга может продаваться в нескольких магазинах (многие ко многим).
     """
     name = models.CharField(max_length=200, verbose_name="Название магазина")
-    city = models.CharField(max_length=100, verbose_name="Город")
+    city = models.ForeignKey(
+        City,
+        on_delete=models.PROTECT,
+        related_name='stores',
+        verbose_name="Город"
+    )
     
     class Meta:
         verbose_name = "Магазин"
         verbose_name_plural = "Магазины"
 
+    @query_free_str
     def __str__(self):
-        return f"{self.name} (г. {self.city})"
+        return f"{self.name} (г. {related_label(self, 'city', 'name')})"
+
+
+class BookQuerySet(models.QuerySet):
+    """QuerySet книг с фильтрами по году публикации (см. date_ranges.py)."""
+
+    def published_since(self, day):
+        return self.filter(published_since(day))
+
+    def published_after(self, year):
+        return self.filter(published_after(year))
+
+    def published_between(self, start_year, end_year):
+        return self.filter(published_between(start_year, end_year))
 
 
 class Book(models.Model):
@@ -78,10 +143,17 @@ class Book(models.Model):
         blank=True
     )
     
+    objects = BookQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Книга"
         verbose_name_plural = "Книги"
+        indexes = [
+            # Фильтры по году публикации - диапазоны дат (см. date_ranges.py)
+            models.Index(fields=['published_date'], name='book_published_idx'),
+        ]
 
+    @query_free_str
     def __str__(self):
         return self.title
 
@@ -108,6 +180,249 @@ class Review(models.Model):
         verbose_name = "Отзыв"
         verbose_name_plural = "Отзывы"
         ordering = ['-created_date']  # Сортировка по дате создания (новые сначала)
+        indexes = [
+            # Лента отзывов книги с постраничным выводом по ключу (см. pagination.py)
+            models.Index(fields=['book', 'created_date', 'id'], name='review_book_feed_idx'),
+        ]
+
+    @query_free_str
+    def __str__(self):
+        # Название книги выводится, только если книга уже загружена
+        return f"Отзыв на '{related_label(self, 'book', 'title')}' - {self.rating}/5"
+
+
+class BookRatingShard(models.Model):
+    """
+    Часть счетчика оценок книги.
+    Новый отзыв увеличивает случайную из BOOKS_RATING_SHARDS строк книги,
+    поэтому одновременные отзывы на одну книгу не ждут блокировку одной строки.
+    Сумма по всем строкам книги - количество и сумма оценок (см. rating_counters.py).
+    """
+    book = models.ForeignKey(
+        Book,
+        on_delete=models.CASCADE,
+        related_name='rating_shards',
+        verbose_name="Книга"
+    )
+    shard = models.PositiveSmallIntegerField(verbose_name="Номер части")
+    # Отдельная часть может уйти в минус: отзыв удаляется из случайной части,
+    # а не из той, в которую был добавлен; суммы по книге остаются точными
+    count = models.IntegerField(default=0, verbose_name="Количество оценок")
+    total = models.IntegerField(default=0, verbose_name="Сумма оценок")
+
+    class Meta:
+        verbose_name = "Часть счетчика оценок"
+        verbose_name_plural = "Счетчики оценок"
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'shard'], name='unique_rating_shard'),
+        ]
+
+    @query_free_str
+    def __str__(self):
+        return f"#{self.book_id}/{self.shard}: {self.count} оценок"
+
+
+class ReviewRollup(models.Model):
+    """
+    Сводка отзывов за день или месяц: по книге или по всему каталогу (book = NULL).
+    Как и счетчик оценок, сводка за период разбита на части (shard),
+    чтобы одновременные отзывы не ждали блокировку одной строки;
+    значения периода - суммы по его частям (см. review_rollups.py).
+    """
+    DAY = 'day'
+    MONTH = 'month'
+    PERIOD_CHOICES = [
+        (DAY, 'День'),
+        (MONTH, 'Месяц'),
+    ]
+
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES, verbose_name="Период")
+    period_start = models.DateField(verbose_name="Начало периода")
+    book = models.ForeignKey(
+        Book,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='review_rollups',
+        verbose_name="Книга"
+    )
+    shard = models.PositiveSmallIntegerField(default=0, verbose_name="Номер части")
+    count = models.IntegerField(default=0, verbose_name="Количество отзывов")
+    rating_sum = models.IntegerField(default=0, verbose_name="Сумма оценок")
+    # Гистограмма оценок
+    rating_1 = models.IntegerField(default=0, verbose_name="Оценок 1")
+    rating_2 = models.IntegerField(default=0, verbose_name="Оценок 2")
+    rating_3 = models.IntegerField(default=0, verbose_name="Оценок 3")
+    rating_4 = models.IntegerField(default=0, verbose_name="Оценок 4")
+    rating_5 = models.IntegerField(default=0, verbose_name="Оценок 5")
+
+    class Meta:
+        verbose_name = "Сводка отзывов"
+        verbose_name_plural = "Сводки отзывов"
+        constraints = [
+            # Индексы запросов за диапазон дат по книге и по каталогу
+            models.UniqueConstraint(
+                fields=['book', 'period', 'period_start', 'shard'],
+                condition=Q(book__isnull=False),
+                name='unique_book_review_rollup',
+            ),
+            models.UniqueConstraint(
+                fields=['period', 'period_start', 'shard'],
+                condition=Q(book__isnull=True),
+                name='unique_catalog_review_rollup',
+            ),
+        ]
+
+    @query_free_str
+    def __str__(self):
+        scope = f"#{self.book_id}" if self.book_id else "каталог"
+        return f"{scope} {self.period} {self.period_start}/{self.shard}: {self.count} отзывов"
+
+
+class Task(models.Model):
+    """
+    Модель фоновой задачи.
+    Задачи хранятся в базе данных и выполняются процессом `manage.py run_worker`.
+    Одинаковые ожидающие задачи дедуплицируются по ключу `dedup_key`.
+    Выполняющаяся задача с истекшим `locked_until` (воркер завершился аварийно)
+    снова захватывается воркером.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Ожидает'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Выполнена'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    name = models.CharField(max_length=100, verbose_name="Имя задачи")
+    payload = models.JSONField(default=dict, blank=True, verbose_name="Аргументы")
+    dedup_key = models.CharField(max_length=255, verbose_name="Ключ дедупликации")
+    priority = models.IntegerField(default=0, verbose_name="Приоритет")  # Больше - раньше
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING,
+        verbose_name="Статус"
+    )
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попыток")
+    max_attempts = models.PositiveIntegerField(default=3, verbose_name="Максимум попыток")
+    run_after = models.DateTimeField(default=timezone.now, verbose_name="Выполнить после")
+    # Срок захвата задачи воркером; воркер продлевает его, пока выполняет задачу
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name="Захвачена до")
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    created_date = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    updated_date = models.DateTimeField(auto_now=True, verbose_name="Дата изменения")
+
+    class Meta:
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+        ordering = ['-priority', 'run_after']
+        indexes = [
+            # Выборка следующей задачи воркером
+            models.Index(fields=['status', '-priority', 'run_after'], name='task_queue_idx'),
+        ]
+        constraints = [
+            # Не больше одной ожидающей задачи с одинаковым ключом
+            models.UniqueConstraint(
+                fields=['dedup_key'],
+                condition=Q(status='pending'),
+                name='unique_pending_task',
+            ),
+        ]
+
+    @query_free_str
+    def __str__(self):
+        return f"{self.name} [{self.get_status_display()}]"
+
+
+class ChangeLogEntry(models.Model):
+    """
+    Модель записи журнала изменений каталога (change data capture).
+    Записи создаются триггерами базы данных (см. changelog.py),
+    поэтому журнал видит и bulk_create(), и update(), и сырой SQL.
+    id - монотонно возрастающий номер изменения (курсор для потребителей).
+    """
+    OPERATION_CHOICES = [
+        ('I', 'Добавление'),
+        ('U', 'Изменение'),
+        ('D', 'Удаление'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    table_name = models.CharField(max_length=100, verbose_name="Таблица")
+    operation = models.CharField(max_length=1, choices=OPERATION_CHOICES, verbose_name="Операция")
+    # ref_id - связанная строка (см. changelog.py): для книги - автор,
+    # для отзыва - книга, для связи книга-магазин row_id - книга, ref_id - магазин
+    row_id = models.BigIntegerField(verbose_name="ID строки")
+    ref_id = models.BigIntegerField(null=True, blank=True, verbose_name="ID связанной строки")
+    created_date = models.DateTimeField(verbose_name="Дата изменения")
+
+    class Meta:
+        verbose_name = "Запись журнала изменений"
+        verbose_name_plural = "Журнал изменений"
+        ordering = ['id']
+
+    @query_free_str
+    def __str__(self):
+        return f"#{self.id} {self.operation} {self.table_name}:{self.row_id}"
+
+
+class ChangeLogCursor(models.Model):
+    """
+    Модель курсора потребителя журнала изменений, сохраненного в базе.
+    Записи журнала удаляются только после того, как их прочитали все такие
+    потребители (см. changelog.prune_changelog); курсор с именем 'pruned' -
+    граница уже удаленных записей.
+    """
+    name = models.CharField(max_length=100, unique=True, verbose_name="Потребитель")
+    cursor = models.BigIntegerField(verbose_name="Курсор")
+    updated_date = models.DateTimeField(auto_now=True, verbose_name="Дата изменения")
+
+    class Meta:
+        verbose_name = "Курсор журнала изменений"
+        verbose_name_plural = "Курсоры журнала изменений"
+
+    @query_free_str
+    def __str__(self):
+        return f"{self.name}: {self.cursor}"
+
+
+class BookRecommendation(models.Model):
+    """
+    Модель рекомендации «есть в тех же магазинах».
+    Таблица заполняется расчетом по разреженной матрице книга x магазин
+    (см. recommendations.py): для каждой книги хранятся top-K похожих книг.
+    """
+    book = models.ForeignKey(
+        Book,
+        on_delete=models.CASCADE,
+        related_name='recommendations',
+        verbose_name="Книга"
+    )
+    recommended = models.ForeignKey(
+        Book,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name="Рекомендуемая книга"
+    )
+    rank = models.PositiveSmallIntegerField(verbose_name="Место")
+    score = models.FloatField(verbose_name="Сходство")
+
+    class Meta:
+        verbose_name = "Рекомендация"
+        verbose_name_plural = "Рекомендации"
+        ordering = ['book', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'rank'], name='unique_recommendation_rank'),
+        ]
 
+    @query_free_str
     def __str__(self):
-        return f"Отзыв на '{self.book.title}' - {self.rating}/5"
+        return (
+            f"{related_label(self, 'book', 'title')} -> "
+            f"{related_label(self, 'recommended', 'title')} ({self.score:.2f})"
+        )
@@ -8,9 +8,76 @@ prefetch_related() - для ManyToMany и обратных ForeignKey связе
 
 from django.db import connection
 from django.db.models import Prefetch
+from .field_plans import plan_queryset
 from .models import Author, Book, Publisher, Store, Review
 
 
+# Построители оптимизированных запросов.
+# Возвращают QuerySet без выполнения (см. также query_plans.py).
+
+def books_with_author_and_publisher():
+    """Книги с автором и издательством в одном запросе (JOIN)."""
+    return Book.objects.select_related('author', 'publisher').all()
+
+
+def books_with_stores():
+    """Книги с магазинами (2 запроса)."""
+    return Book.objects.prefetch_related('stores').all()
+
+
+def books_with_positive_reviews():
+    """Книги с автором и отзывами с оценкой >= 4 в атрибуте positive_reviews."""
+    return Book.objects.select_related('author').prefetch_related(
+        Prefetch(
+            'reviews',
+            queryset=Review.objects.filter(rating__gte=4).order_by('-rating'),
+            to_attr='positive_reviews'  # Сохраняем в кастомный атрибут
+        )
+    ).all()
+
+
+def books_with_all_relations():
+    """Книги со всеми связями: JOIN для ForeignKey и prefetch для остальных."""
+    return Book.objects.select_related(
+        'author',              # ForeignKey - используем select_related
+        'publisher__country'   # ForeignKey через ForeignKey - тоже одним JOIN
+    ).prefetch_related(
+        # ManyToMany - используем prefetch_related, город магазина - JOIN в том же запросе
+        Prefetch('stores', queryset=Store.objects.select_related('city')),
+        Prefetch(
+            'reviews',
+            queryset=Review.objects.order_by('-rating', '-created_date'),
+            to_attr='sorted_reviews'
+        )
+    ).all()
+
+
+def authors_with_books():
+    """Авторы с книгами (и их издательствами) в атрибуте published_books."""
+    return Author.objects.prefetch_related(
+        Prefetch(
+            'books',
+            queryset=Book.objects.select_related('publisher').order_by('-published_date'),
+            to_attr='published_books'
+        )
+    ).all()
+
+
+# Поля, которые выводит demonstrate_field_plan()
+PLANNED_BOOK_FIELDS = [
+    'title', 'author.name', 'publisher.name', 'publisher.country',
+    'stores.name', 'stores.city', 'reviews.rating',
+]
+
+
+def books_with_planned_fields():
+    """
+    Книги со связями, план загрузки которых построен по выводимым полям
+    (field_plans.py): JOIN, Prefetch и only() подбираются автоматически.
+    """
+    return plan_queryset(Book, PLANNED_BOOK_FIELDS)
+
+
 def reset_queries():
     """Сбрасывает счетчик SQL запросов для демонстрации."""
     connection.queries_log.clear()
@@ -61,7 +128,7 @@ def demonstrate_select_related():
     reset_queries()
     
     # ХОРОШО: select_related загружает связанные данные в одном запросе
-    books = Book.objects.select_related('author', 'publisher').all()
+    books = books_with_author_and_publisher()
     
     print("📚 Список книг с авторами и издательствами (С оптимизацией):")
     for book in books:
@@ -85,7 +152,7 @@ def demonstrate_prefetch_related_basic():
     reset_queries()
     
     # ХОРОШО: prefetch_related загружает магазины отдельным оптимизированным запросом
-    books = Book.objects.prefetch_related('stores').all()
+    books = books_with_stores()
     
     print("📚 Книги и магазины, где они продаются:")
     for book in books:
@@ -109,13 +176,7 @@ def demonstrate_prefetch_related_advanced():
     reset_queries()
     
     # ПРОДВИНУТО: загружаем только положительные отзывы (рейтинг >= 4) с авторами книг
-    books = Book.objects.select_related('author').prefetch_related(
-        Prefetch(
-            'reviews',
-            queryset=Review.objects.filter(rating__gte=4).order_by('-rating'),
-            to_attr='positive_reviews'  # Сохраняем в кастомный атрибут
-        )
-    ).all()
+    books = books_with_positive_reviews()
     
     print("📚 Книги с положительными отзывами (рейтинг >= 4):")
     for book in books:
@@ -144,17 +205,7 @@ def demonstrate_combined_optimization():
     reset_queries()
     
     # ОПТИМАЛЬНО: комбинируем оба метода для максимальной эффективности
-    books = Book.objects.select_related(
-        'author',      # ForeignKey - используем select_related
-        'publisher'    # ForeignKey - используем select_related
-    ).prefetch_related(
-        'stores',      # ManyToMany - используем prefetch_related
-        Prefetch(
-            'reviews',
-            queryset=Review.objects.order_by('-rating', '-created_date'),
-            to_attr='sorted_reviews'
-        )
-    ).all()
+    books = books_with_all_relations()
     
     print("📚 Полная информация о книгах:")
     for book in books:
@@ -190,13 +241,7 @@ def demonstrate_reverse_foreign_key_optimization():
     reset_queries()
     
     # Получаем авторов с их книгами и издательствами
-    authors = Author.objects.prefetch_related(
-        Prefetch(
-            'books',
-            queryset=Book.objects.select_related('publisher').order_by('-published_date'),
-            to_attr='published_books'
-        )
-    ).all()
+    authors = authors_with_books()
     
     print("👤 Авторы и их книги:")
     for author in authors:
@@ -211,6 +256,31 @@ def demonstrate_reverse_foreign_key_optimization():
     return query_count
 
 
+def demonstrate_field_plan():
+    """
+    Демонстрирует план загрузки по списку выводимых полей.
+    
+    Вместо ручного выбора select_related()/prefetch_related() перечисляются
+    поля, которые нужны при выводе; остальные поля откладываются (only()).
+    """
+    print("\n🧭 ПЛАН ЗАГРУЗКИ ПО ВЫВОДИМЫМ ПОЛЯМ")
+    print("=" * 38)
+    
+    reset_queries()
+    
+    books = books_with_planned_fields()
+    
+    print(f"📋 Поля: {', '.join(PLANNED_BOOK_FIELDS)}")
+    for book in books:
+        stores = ', '.join(f"{store.name} ({store.city})" for store in book.stores.all())
+        ratings = [review.rating for review in book.reviews.all()]
+        print(f"- '{book.title}' ({book.author.name}, {book.publisher.name}, {book.publisher.country}): "
+              f"магазины: {stores or 'нет'}, оценки: {ratings or 'нет'}")
+    
+    query_count = print_query_count("🧭 План по выводимым полям")
+    return query_count
+
+
 def run_optimization_comparison():
     """
     Запускает полное сравнение оптимизированных и неоптимизированных запросов.
@@ -234,6 +304,7 @@ def run_optimization_comparison():
     demonstrate_prefetch_related_advanced()
     demonstrate_combined_optimization()
     demonstrate_reverse_foreign_key_optimization()
+    demonstrate_field_plan()
     
     print("\n" + "="*60)
     print("💡 ВЫВОДЫ ПО ОПТИМИЗАЦИИ:")
@@ -241,6 +312,7 @@ def run_optimization_comparison():
     print("• prefetch_related() - для ManyToMany/обратные FK (отдельные запросы)")  
     print("• Prefetch() - для кастомной фильтрации и сортировки")
     print("• Комбинирование методов дает максимальную эффективность")
+    print("• plan_queryset() - подбор всех методов по списку выводимых полей")
     print("• Всегда тестируйте производительность на реальных данных!")
 
 
@@ -0,0 +1,105 @@
+"""
+Модуль постраничного вывода по ключу (keyset pagination).
+
+Вместо OFFSET следующая страница запрашивается условием «строки после
+последней показанной» по упорядоченному ключу (created_date, id).
+Вместе с составным индексом (book_id, created_date, id) это дает поиск
+по индексу и чтение только limit + 1 строк, поэтому любая страница книги
+с миллионом отзывов стоит столько же, сколько страница книги с десятью.
+
+Курсор - непрозрачная строка (base64 от JSON с ключом последней строки).
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+from functools import lru_cache
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .models import Review
+from .prepared import PreparedQuery
+
+
+class InvalidCursor(ValueError):
+    """Курсор страницы поврежден или создан не этим модулем."""
+
+
+def encode_cursor(created_date, pk):
+    """Курсор, указывающий на строку с ключом (created_date, pk)."""
+    raw = json.dumps([created_date.isoformat(), pk]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Ключ (created_date, pk) из курсора."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created, pk = json.loads(raw)
+        created_date = parse_datetime(created)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if created_date is None or not isinstance(pk, int):
+        raise InvalidCursor(cursor)
+    return created_date, pk
+
+
+def book_reviews_feed(book_id, rating=None):
+    """
+    Отзывы книги от новых к старым: порядок совпадает с индексом
+    review_book_feed_idx, поэтому сортировка выполняется без временного B-дерева.
+    """
+    reviews = Review.objects.filter(book_id=book_id).order_by('-created_date', '-id')
+    if rating is not None:
+        reviews = reviews.filter(rating=rating)
+    return reviews
+
+
+def book_reviews_page(book_id, cursor=None, limit=20, rating=None):
+    """
+    Страница отзывов книги после курсора.
+
+    Возвращает (отзывы, курсор следующей страницы или None).
+    """
+    values = {'book_id': book_id}
+    if rating is not None:
+        values['rating'] = rating
+    if cursor:
+        values['created_date'], values['pk'] = decode_cursor(cursor)
+
+    # Лишняя строка показывает, есть ли следующая страница
+    rows = _prepared_page(bool(cursor), rating is not None, limit)(**values)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_date, rows[-1].id)
+
+
+def _page_reviews(book_id, rating=None, created_date=None, pk=None, limit=20):
+    """QuerySet страницы: limit + 1 отзывов после ключа (created_date, pk)."""
+    reviews = book_reviews_feed(book_id, rating)
+    if created_date is not None:
+        # (created_date, id) < (курсор): избыточное условие created_date <= ...
+        # дает поиск по диапазону индекса, а не фильтрацию всех отзывов книги
+        reviews = reviews.filter(
+            Q(created_date__lt=created_date) | Q(id__lt=pk),
+            created_date__lte=created_date,
+        )
+    return reviews[:limit + 1]
+
+
+@lru_cache(maxsize=64)
+def _prepared_page(after_cursor, by_rating, limit):
+    """
+    Подготовленный запрос страницы (см. prepared.py). Наличие курсора,
+    фильтр по оценке и размер страницы меняют текст SQL,
+    поэтому запрос готовится для каждого их сочетания.
+    """
+    params = {'book_id': int}
+    if by_rating:
+        params['rating'] = int
+    if after_cursor:
+        params.update(created_date=datetime, pk=int)
+    return PreparedQuery(lambda **values: _page_reviews(limit=limit, **values), **params)
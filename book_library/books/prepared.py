@@ -0,0 +1,220 @@
+"""
+Модуль подготовленных запросов.
+
+Каждое вычисление QuerySet заново строит дерево Query, разрешает
+F/Q/аннотации и компилирует SQL, хотя у запросов страниц меняются
+только значения параметров. PreparedQuery компилирует запрос один раз
+для каждого бэкенда базы данных и дальше только подставляет значения:
+
+    by_country = PreparedQuery(books_by_country, country=str)
+    books = by_country(country='Россия')
+
+Построитель (build) вызывается при подготовке дважды с разными
+значениями-метками для каждого параметра. По совпадению двух
+компиляций определяется, какие позиции параметров SQL принадлежат
+какому параметру запроса; все остальные позиции - константы запроса.
+Если от значений зависит сам текст SQL (срез, список IN переменной
+длины, None), подготовка завершается ошибкой.
+
+Ограничения:
+- значения подставляются в SQL как есть (для дат и времени - через
+  адаптер бэкенда), преобразования внутри построителя (normalize_name,
+  year_start) при выполнении не повторяются - их выполняет вызывающий код;
+- запросы prefetch_related выполняются обычным образом и не должны
+  зависеть от параметров.
+
+Строки превращаются в объекты моделей (с select_related и аннотациями),
+словари values(), кортежи values_list() или объекты row_class теми же
+классами Django (ModelIterable и др.), что и при вычислении QuerySet:
+компилятор запроса вместо выполнения SQL отдает им уже прочитанные строки.
+"""
+
+import copy
+import threading
+from datetime import date, datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Prefetch, prefetch_related_objects
+from django.db.models.query import FlatValuesListIterable, ModelIterable, ValuesIterable, ValuesListIterable
+
+
+# Адаптеры бэкенда, которыми DateField и DateTimeField приводят значения к виду SQL
+ADAPTERS = {
+    date: 'adapt_datefield_value',
+    datetime: 'adapt_datetimefield_value',
+}
+
+
+def _marker(kind, number, variant):
+    """Значение-метка параметра number типа kind для компиляции variant (0 или 1)."""
+    if kind is int:
+        # В пределах PositiveSmallIntegerField: значения вне диапазона поля
+        # Django заменяет пустым результатом без параметра
+        return 30000 + 100 * variant + number
+    if kind is float:
+        return 1000.5 + 100 * variant + number
+    if kind is str:
+        return f'~prepared-{variant}-{number}~'
+    if kind is date:
+        return date(1900 + variant, 1, 1 + number)
+    if kind is datetime:
+        tzinfo = dt_timezone.utc if settings.USE_TZ else None
+        return datetime(1900 + variant, 1, 1 + number, 12, tzinfo=tzinfo)
+    raise TypeError(f'Тип параметра {kind.__name__} не поддерживается')
+
+
+class CompiledQuery:
+    """SQL запроса, позиции его параметров и сведения для создания объектов."""
+
+    def __init__(self, sql, constants, slots, queryset, compiler):
+        self.sql = sql
+        # Параметры SQL с константами на своих местах
+        self.constants = constants
+        # (позиция в параметрах SQL, имя параметра, имя адаптера бэкенда или None)
+        self.slots = slots
+        # QuerySet построителя и его компилятор (после as_sql): по ним строки
+        # превращаются в результат
+        self.queryset = queryset
+        self.compiler = compiler
+
+
+class PreparedQuery:
+    """Запрос фиксированной формы, скомпилированный один раз (см. описание модуля)."""
+
+    def __init__(self, build, *, row_class=None, **params):
+        """
+        build - функция, которая по значениям параметров возвращает QuerySet;
+        params - типы параметров: int, float, str, date или datetime;
+        row_class - класс для строк values() (row_class(**row))
+        и values_list() (row_class(*row)).
+        """
+        for kind in params.values():
+            _marker(kind, 0, 0)
+        self.build = build
+        self.params = params
+        self.row_class = row_class
+        self._compiled = {}
+        self._lock = threading.Lock()
+
+    def _build(self, variant):
+        values = {
+            name: _marker(kind, number, variant)
+            for number, (name, kind) in enumerate(self.params.items())
+        }
+        return values, self.build(**values)
+
+    def compile(self, using=DEFAULT_DB_ALIAS):
+        """Скомпилированный запрос для бэкенда соединения using (кэшируется)."""
+        connection = connections[using]
+        compiled = self._compiled.get(connection.vendor)
+        if compiled is None:
+            with self._lock:
+                compiled = self._compiled.get(connection.vendor)
+                if compiled is None:
+                    compiled = self._compiled[connection.vendor] = self._compile(using)
+        return compiled
+
+    def _compile(self, using):
+        connection = connections[using]
+        values, queryset = self._build(0)
+        other_values, other_queryset = self._build(1)
+
+        iterable_class = queryset._iterable_class
+        if iterable_class not in (ModelIterable, ValuesIterable, ValuesListIterable, FlatValuesListIterable):
+            raise TypeError(f'{iterable_class.__name__} не поддерживается подготовленными запросами')
+        if queryset._known_related_objects:
+            raise TypeError('QuerySet связанного менеджера не поддерживается подготовленными запросами')
+
+        compiler = queryset.query.get_compiler(using=using)
+        sql, params = compiler.as_sql()
+        other_sql, other_params = other_queryset.query.get_compiler(using=using).as_sql()
+        if sql != other_sql or len(params) != len(other_params):
+            raise ValueError('Текст SQL зависит от значений параметров: запрос нельзя подготовить')
+
+        adapted = {}
+        for name, kind in self.params.items():
+            adapter = ADAPTERS.get(kind)
+            adapt = getattr(connection.ops, adapter) if adapter else (lambda value: value)
+            adapted[name] = (adapt(values[name]), adapt(other_values[name]), adapter)
+
+        slots = []
+        for position, (value, other_value) in enumerate(zip(params, other_params)):
+            for name, (marker, other_marker, adapter) in adapted.items():
+                if value == marker and other_value == other_marker:
+                    slots.append((position, name, adapter))
+                    break
+            else:
+                if value != other_value:
+                    raise ValueError(
+                        f'Параметр SQL №{position} зависит от значений параметров, '
+                        f'но не совпадает ни с одним из них'
+                    )
+        missing = set(self.params) - {name for _, name, _ in slots}
+        if missing:
+            raise ValueError(
+                f'Параметры {", ".join(sorted(missing))} не попадают в SQL без преобразования'
+            )
+
+        prefetch_lookups = queryset._prefetch_related_lookups
+        if _prefetch_sql(prefetch_lookups, using) != _prefetch_sql(other_queryset._prefetch_related_lookups, using):
+            raise ValueError('Запросы prefetch_related зависят от значений параметров')
+
+        return CompiledQuery(sql, list(params), slots, queryset, compiler)
+
+    def __call__(self, using=DEFAULT_DB_ALIAS, **values):
+        """Выполняет запрос со значениями параметров и возвращает список строк."""
+        if set(values) != set(self.params):
+            raise TypeError(
+                f'Ожидаются параметры {", ".join(self.params) or "(нет)"}, '
+                f'получены {", ".join(values) or "(нет)"}'
+            )
+        connection = connections[using]
+        compiled = self.compile(using)
+
+        params = list(compiled.constants)
+        for position, name, adapter in compiled.slots:
+            value = values[name]
+            if not isinstance(value, self.params[name]):
+                raise TypeError(f'Параметр {name} должен быть {self.params[name].__name__}')
+            params[position] = getattr(connection.ops, adapter)(value) if adapter else value
+
+        with connection.cursor() as cursor:
+            cursor.execute(compiled.sql, params)
+            rows = cursor.fetchall()
+        return self._hydrate(compiled, rows, using)
+
+    def _hydrate(self, compiled, rows, using):
+        # Компилятор создан в потоке подготовки: конвертеры значений
+        # берутся у соединения текущего потока
+        compiler = copy.copy(compiled.compiler)
+        compiler.connection = connections[using]
+        if compiler.has_extra_select:
+            rows = [row[:compiler.col_count] for row in rows]
+        # Вместо выполнения SQL компилятор отдает прочитанные строки
+        # одним блоком, как execute_sql()
+        compiler.execute_sql = lambda *args, **kwargs: [rows]
+
+        queryset = compiled.queryset.using(using)
+        queryset.query.get_compiler = lambda *args, **kwargs: compiler
+        results = list(queryset._iterable_class(queryset))
+
+        if self.row_class is not None:
+            if queryset._iterable_class is ValuesIterable:
+                return [self.row_class(**row) for row in results]
+            if queryset._iterable_class is ValuesListIterable:
+                return [self.row_class(*row) for row in results]
+        if queryset._prefetch_related_lookups:
+            prefetch_related_objects(results, *queryset._prefetch_related_lookups)
+        return results
+
+
+def _prefetch_sql(lookups, using):
+    """SQL запросов Prefetch(queryset=...) для сравнения двух компиляций."""
+    statements = []
+    for lookup in lookups:
+        if isinstance(lookup, Prefetch) and lookup.queryset is not None:
+            statements.append(lookup.queryset.query.get_compiler(using=using).as_sql())
+        else:
+            statements.append(str(lookup))
+    return statements
@@ -0,0 +1,328 @@
+"""
+Модуль профилирования отдельных HTTP-запросов.
+
+ProfilingMiddleware профилирует запрос, если:
+- пришел заголовок X-Profile (только при BOOKS_PROFILE_ALLOW_HEADER);
+- запрос попал в случайную выборку с долей BOOKS_PROFILE_SAMPLE_RATE;
+- профилирование включено принудительно (force_profiling(),
+  команда python manage.py profile_requests).
+
+Режимы (значение заголовка X-Profile или BOOKS_PROFILE_MODE):
+- sample - сэмплирующий профилировщик: отдельный поток каждые
+  BOOKS_PROFILE_INTERVAL секунд снимает стек потока запроса;
+- cprofile - детерминированный профилировщик cProfile.
+
+Результаты пишутся в BOOKS_PROFILE_DIR:
+- <id>.collapsed - свернутые стеки («a;b;c число»), которые открываются
+  как flame graph (flamegraph.pl, speedscope, inferno);
+- <id>.prof - статистика cProfile (режим cprofile, для pstats/snakeviz);
+- <id>.json - сводка: время по фазам db (SQL), orm (создание объектов
+  моделей и построение запросов), template (шаблоны) и other.
+
+Время SQL измеряется точно (query_observers.py), доли ORM и шаблонов
+оцениваются по модулям в стеках. Сводка также возвращается в заголовке
+Server-Timing. Когда профилирование выключено, middleware проверяет
+один заголовок и одно случайное число.
+"""
+
+import cProfile
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+from .query_observers import observe_queries
+
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+MODES = ('sample', 'cprofile')
+
+# Фазы в порядке проверки: кадр относится к первой фазе, модуль которой
+# встретился в стеке ближе всего к вершине
+PHASE_MODULES = (
+    ('db', ('django.db.backends', 'sqlite3', 'psycopg', 'psycopg2')),
+    ('orm', ('django.db.models',)),
+    ('template', ('django.template',)),
+)
+PHASES = ('db', 'orm', 'template', 'other')
+
+_forced = threading.local()
+
+# В процессе может работать только один cProfile: в Python 3.12+ второй
+# enable() бросает ValueError (см. profiler_slot)
+_cprofile_lock = threading.Lock()
+
+
+@contextmanager
+def force_profiling(mode=None):
+    """Профилирует все запросы текущего потока (для команд и тестов)."""
+    previous = getattr(_forced, 'mode', None)
+    _forced.mode = mode or profile_setting('MODE', 'sample')
+    try:
+        yield
+    finally:
+        _forced.mode = previous
+
+
+def profile_setting(name, default):
+    return getattr(settings, f'BOOKS_PROFILE_{name}', default)
+
+
+def frame_label(code, module):
+    """Подпись кадра в свернутом стеке."""
+    # co_qualname появилось в Python 3.11
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+@contextmanager
+def profiler_slot(mode):
+    """
+    Разрешение запустить профилировщик режима mode: блок получает True или
+    False. Запрос в режиме cprofile, пришедший, пока другой поток профилирует
+    cProfile, не профилируется, а не завершается ошибкой.
+    """
+    if mode != 'cprofile':
+        yield True
+    elif _cprofile_lock.acquire(blocking=False):
+        try:
+            yield True
+        finally:
+            _cprofile_lock.release()
+    else:
+        yield False
+
+
+def phase_of(modules):
+    """Фаза стека по именам модулей кадров (от вершины стека к основанию)."""
+    for module in modules:
+        for phase, prefixes in PHASE_MODULES:
+            if module.startswith(prefixes):
+                return phase
+    return 'other'
+
+
+class StackSampler:
+    """
+    Сэмплирующий профилировщик потока: фоновый поток периодически
+    читает стек целевого потока через sys._current_frames().
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.phase_samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='books-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            labels, modules = [], []
+            while frame is not None:
+                module = frame.f_globals.get('__name__', '?')
+                labels.append(frame_label(frame.f_code, module))
+                modules.append(module)
+                # Кадры ниже middleware (сервер, обработчик WSGI) одинаковы у всех сэмплов
+                if frame.f_code is ProfilingMiddleware.__call__.__code__:
+                    break
+                frame = frame.f_back
+            if labels:
+                self.stacks[';'.join(reversed(labels))] += 1
+                self.phase_samples[phase_of(modules)] += 1
+
+
+def cprofile_phases(profiler):
+    """Собственное время функций cProfile, разнесенное по фазам по модулям."""
+    import pstats
+
+    phases = Counter()
+    stats = pstats.Stats(profiler).stats
+    for (filename, _, name), (_, _, own_time, _, _) in stats.items():
+        if filename == '~':
+            # Встроенные функции: "<method 'execute' of 'sqlite3.Cursor' objects>"
+            module = name.split("'")[-2] if " of '" in name else name
+        else:
+            module = filename.replace('\\', '/').split('site-packages/')[-1].replace('/', '.')
+        phases[phase_of([module])] += own_time
+    return phases
+
+
+def cprofile_collapsed(profiler):
+    """
+    Свернутые стеки из cProfile: cProfile хранит только пары
+    вызывающий -> вызываемый, поэтому стеки восстанавливаются на глубину двух
+    кадров (вызывающий;функция), а вес - собственное время в микросекундах.
+    """
+    import pstats
+
+    def label(key):
+        filename, line, name = key
+        return f'{Path(filename).stem}:{name}:{line}'
+
+    stacks = Counter()
+    for key, (_, _, own_time, _, callers) in pstats.Stats(profiler).stats.items():
+        if not callers:
+            stacks[label(key)] += int(own_time * 1e6)
+        # Для каждого вызывающего cProfile хранит собственное время вызовов из него
+        for caller_key, (_, _, caller_own_time, _) in callers.items():
+            stacks[f'{label(caller_key)};{label(key)}'] += int(caller_own_time * 1e6)
+    return +stacks
+
+
+def write_collapsed(path, stacks):
+    with open(path, 'w', encoding='utf-8') as output:
+        for stack, count in sorted(stacks.items()):
+            output.write(f'{stack} {count}\n')
+
+
+class RequestProfile:
+    """Профиль одного запроса: запуск, остановка и запись результатов."""
+
+    def __init__(self, mode, request):
+        self.mode = mode
+        self.profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.path = request.path
+        self.method = request.method
+        self.db_time = 0.0
+        self.queries = 0
+        self.profiler = None
+        self.sampler = None
+
+    def record_query(self, sql, duration):
+        self.db_time += duration
+        self.queries += 1
+
+    @contextmanager
+    def running(self):
+        if self.mode == 'cprofile':
+            self.profiler = cProfile.Profile()
+        else:
+            self.sampler = StackSampler(threading.get_ident(), profile_setting('INTERVAL', 0.001))
+
+        started = time.perf_counter()
+        with observe_queries(self.record_query):
+            if self.profiler is not None:
+                self.profiler.enable()
+            else:
+                self.sampler.start()
+            try:
+                yield self
+            finally:
+                if self.profiler is not None:
+                    self.profiler.disable()
+                else:
+                    self.sampler.stop()
+                self.total_time = time.perf_counter() - started
+
+    def phases(self):
+        """
+        Время по фазам в секундах. SQL - измеренное время запросов,
+        остальное время распределяется пропорционально сэмплам
+        (или собственному времени cProfile) фаз orm, template и other.
+        """
+        if self.profiler is not None:
+            weights = cprofile_phases(self.profiler)
+        else:
+            weights = Counter(self.sampler.phase_samples)
+        weights.pop('db', None)
+
+        rest = max(self.total_time - self.db_time, 0.0)
+        total_weight = sum(weights.values())
+        result = {'db': self.db_time}
+        for phase in PHASES[1:]:
+            result[phase] = rest * weights[phase] / total_weight if total_weight else 0.0
+        if not total_weight:
+            result['other'] = rest
+        return result
+
+    def summary(self):
+        return {
+            'id': self.profile_id,
+            'method': self.method,
+            'path': self.path,
+            'mode': self.mode,
+            'total_ms': self.total_time * 1000,
+            'queries': self.queries,
+            'phases_ms': {phase: value * 1000 for phase, value in self.phases().items()},
+        }
+
+    def save(self, directory):
+        """Записывает свернутые стеки, статистику cProfile и сводку; возвращает сводку."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', self.path).strip('_') or 'root'
+        base = directory / f'{self.profile_id}-{self.method.lower()}-{slug}'
+
+        if self.profiler is not None:
+            self.profiler.dump_stats(f'{base}.prof')
+            stacks = cprofile_collapsed(self.profiler)
+        else:
+            stacks = self.sampler.stacks
+        write_collapsed(f'{base}.collapsed', stacks)
+
+        summary = self.summary()
+        summary['files'] = {
+            kind: f'{base}.{kind}' for kind in ('collapsed', 'prof', 'json')
+            if kind != 'prof' or self.profiler is not None
+        }
+        Path(f'{base}.json').write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding='utf-8')
+        return summary
+
+
+def requested_mode(request):
+    """Режим профилирования для запроса или None, если профилировать не нужно."""
+    forced = getattr(_forced, 'mode', None)
+    if forced:
+        return forced
+
+    header = request.META.get(PROFILE_HEADER)
+    if header and profile_setting('ALLOW_HEADER', False):
+        return header if header in MODES else profile_setting('MODE', 'sample')
+
+    rate = profile_setting('SAMPLE_RATE', 0.0)
+    if rate and random.random() < rate:
+        return profile_setting('MODE', 'sample')
+    return None
+
+
+class ProfilingMiddleware:
+    """Middleware выборочного профилирования запросов (см. описание модуля)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = requested_mode(request)
+        if mode is None:
+            return self.get_response(request)
+
+        profile = RequestProfile(mode, request)
+        with profiler_slot(mode) as acquired:
+            if not acquired:
+                return self.get_response(request)
+            with profile.running():
+                response = self.get_response(request)
+
+        summary = profile.save(profile_setting('DIR', Path(settings.BASE_DIR) / 'profiles'))
+        response['X-Profile-Id'] = profile.profile_id
+        response['Server-Timing'] = ', '.join(
+            f'{phase};dur={value:.1f}' for phase, value in summary['phases_ms'].items()
+        )
+        request.profile_summary = summary
+        return response
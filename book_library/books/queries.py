@@ -3,8 +3,142 @@
 Содержит все запросы из Задания 2.
 """
 
-from django.db.models import Count, Avg, Q
+from datetime import date
+
+from django.db.models import Count, Avg, IntegerField, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from .date_ranges import year_start
+from .locations import in_city, in_country, normalize_name
 from .models import Author, Book, Publisher, Store, Review
+from .prepared import PreparedQuery
+
+
+# Построители запросов.
+# Возвращают QuerySet без выполнения и без вывода на экран,
+# чтобы те же запросы можно было анализировать (см. query_plans.py).
+
+BookStores = Book.stores.through
+
+
+def books_in_stores(stores):
+    """
+    Книги, которые продаются хотя бы в одном из магазинов stores (QuerySet).
+
+    Условие id IN (подзапрос по связям) - полусоединение: каждая книга
+    попадает в результат один раз, сколько бы магазинов ее ни продавали,
+    поэтому JOIN не размножает строки и DISTINCT не нужен. PostgreSQL
+    выполняет IN и EXISTS одинаково (Semi Join), а SQLite строит список
+    id из подзапроса и читает книги по первичному ключу, не сканируя таблицу.
+    """
+    return Book.objects.filter(
+        pk__in=BookStores.objects.filter(store__in=stores).values('book_id')
+    )
+
+
+def stores_with_books(books):
+    """Магазины, в которых продается хотя бы одна из книг books (QuerySet), полусоединением."""
+    return Store.objects.filter(
+        pk__in=BookStores.objects.filter(book__in=books).values('store_id')
+    )
+
+
+def count_books_in_store(books):
+    """Подзапрос: количество книг из books в магазине внешнего запроса."""
+    counts = BookStores.objects.filter(
+        store_id=OuterRef('pk'), book__in=books
+    ).order_by().values('store_id').annotate(count=Count('*')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def books_by_country(country):
+    """Книги издательств из страны country (сравнение по id страны, см. locations.py)."""
+    return Book.objects.filter(in_country(country, prefix='publisher__'))
+
+
+def books_by_city(city):
+    """Книги, которые продаются в магазинах города city."""
+    return books_in_stores(Store.objects.filter(in_city(city)))
+
+
+def books_by_city_with_stores(city):
+    """
+    Книги города city со списком его магазинов в атрибуте city_stores:
+    магазины всех книг загружаются одним отфильтрованным Prefetch.
+    """
+    return books_by_city(city).prefetch_related(Prefetch(
+        'stores',
+        queryset=Store.objects.filter(in_city(city)).only('id', 'name').order_by('name'),
+        to_attr='city_stores',
+    ))
+
+
+def books_by_average_rating(min_rating):
+    """Книги со средней оценкой выше min_rating (по убыванию оценки)."""
+    return Book.objects.annotate(
+        avg_rating=Avg('reviews__rating')
+    ).filter(
+        avg_rating__gt=min_rating
+    ).order_by('-avg_rating')
+
+
+def books_count_by_store():
+    """Магазины с количеством книг (по убыванию количества)."""
+    return Store.objects.annotate(
+        books_count=Count('books')
+    ).order_by('-books_count')
+
+
+def stores_by_publication_date(year):
+    """Магазины с книгами, изданными после year, и количеством таких книг."""
+    return stores_published_since(year_start(year + 1))
+
+
+def stores_published_since(day):
+    """Магазины с книгами, изданными начиная с даты day, и количеством таких книг."""
+    return stores_ranked_by_books(Book.objects.published_since(day))
+
+
+def stores_ranked_by_books(books):
+    """Магазины с книгами из books и количеством таких книг (по убыванию количества)."""
+    return stores_with_books(books).annotate(
+        recent_books_count=count_books_in_store(books)
+    ).order_by('-recent_books_count', 'id')
+
+
+# Подготовленные запросы (см. prepared.py): SQL тех же построителей
+# компилируется один раз, при вызове подставляются только значения.
+# Значения передаются в том виде, в котором попадают в SQL.
+
+_prepared_books_by_country = PreparedQuery(books_by_country, country=str)
+_prepared_books_by_city = PreparedQuery(books_by_city, city=str)
+_prepared_books_by_average_rating = PreparedQuery(books_by_average_rating, min_rating=float)
+_prepared_books_count_by_store = PreparedQuery(books_count_by_store)
+_prepared_stores_by_publication_date = PreparedQuery(stores_published_since, day=date)
+
+
+def prepared_books_by_country(country):
+    """Список книг books_by_country(country) подготовленным запросом."""
+    return _prepared_books_by_country(country=normalize_name(country))
+
+
+def prepared_books_by_city(city):
+    """Список книг books_by_city(city) подготовленным запросом."""
+    return _prepared_books_by_city(city=normalize_name(city))
+
+
+def prepared_books_by_average_rating(min_rating):
+    """Список книг books_by_average_rating(min_rating) подготовленным запросом."""
+    return _prepared_books_by_average_rating(min_rating=float(min_rating))
+
+
+def prepared_books_count_by_store():
+    """Список магазинов books_count_by_store() подготовленным запросом."""
+    return _prepared_books_count_by_store()
+
+
+def prepared_stores_by_publication_date(year):
+    """Список магазинов stores_by_publication_date(year) подготовленным запросом."""
+    return _prepared_stores_by_publication_date(day=year_start(year + 1))
 
 
 def query_1_books_by_country(country="Россия"):
@@ -17,7 +151,7 @@ def query_1_books_by_country(country="Россия"):
     print(f"\n=== ЗАПРОС 1: Книги издательств из страны '{country}' ===")
     
     # Фильтруем книги по стране издательства
-    books = Book.objects.filter(publisher__country=country)
+    books = books_by_country(country).select_related('publisher__country')
     
     print(f"Найдено книг: {books.count()}")
     for book in books:
@@ -35,13 +169,12 @@ def query_2_books_by_city(city="Москва"):
     print(f"\n=== ЗАПРОС 2: Книги, продающиеся в городе '{city}' ===")
     
     # Фильтруем книги по городу магазинов (ManyToMany связь)
-    books = Book.objects.filter(stores__city=city).distinct()
+    books = books_by_city_with_stores(city)
     
     print(f"Найдено уникальных книг: {books.count()}")
     for book in books:
-        # Получаем магазины в указанном городе для каждой книги
-        stores_in_city = book.stores.filter(city=city)
-        store_names = [store.name for store in stores_in_city]
+        # Магазины в указанном городе загружены одним запросом для всех книг
+        store_names = [store.name for store in book.city_stores]
         print(f"- '{book.title}' (магазины: {', '.join(store_names)})")
     
     return books
@@ -56,11 +189,7 @@ def query_3_books_by_average_rating(min_rating=4.5):
     print(f"\n=== ЗАПРОС 3: Книги со средней оценкой выше {min_rating} ===")
     
     # Аннотируем книги средней оценкой и фильтруем
-    books = Book.objects.annotate(
-        avg_rating=Avg('reviews__rating')
-    ).filter(
-        avg_rating__gt=min_rating
-    ).order_by('-avg_rating')
+    books = books_by_average_rating(min_rating)
     
     print(f"Найдено книг: {books.count()}")
     for book in books:
@@ -81,9 +210,7 @@ def query_4_books_count_by_store():
     print(f"\n=== ЗАПРОС 4: Количество книг в каждом магазине ===")
     
     # Аннотируем магазины количеством книг
-    stores = Store.objects.annotate(
-        books_count=Count('books')
-    ).order_by('-books_count')
+    stores = books_count_by_store().select_related('city')
     
     print(f"Всего магазинов: {stores.count()}")
     for store in stores:
@@ -102,18 +229,15 @@ def query_5_stores_by_publication_date(year=2010):
     print(f"\n=== ЗАПРОС 5: Магазины с книгами, изданными после {year} года ===")
     
     # Фильтруем магазины по дате публикации книг и считаем количество
-    stores = Store.objects.filter(
-        books__published_date__year__gt=year
-    ).annotate(
-        recent_books_count=Count('books', filter=Q(books__published_date__year__gt=year))
-    ).distinct().order_by('-recent_books_count')
+    stores = stores_by_publication_date(year).select_related('city').prefetch_related(
+        Prefetch('books', queryset=Book.objects.published_after(year), to_attr='recent_books')
+    )
     
     print(f"Найдено магазинов: {stores.count()}")
     for store in stores:
         # Получаем книги, изданные после указанного года
-        recent_books = store.books.filter(published_date__year__gt=year)
         print(f"- {store.name} (г. {store.city}): {store.recent_books_count} книг после {year} года")
-        for book in recent_books:
+        for book in store.recent_books:
             print(f"  * '{book.title}' ({book.published_date.year} г.)")
     
     return stores
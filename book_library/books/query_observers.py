@@ -0,0 +1,53 @@
+"""
+Модуль наблюдения за SQL-запросами текущего контекста.
+
+Ко всем соединениям с базой данных при их создании подключается одна
+обертка выполнения запросов. Обертка вызывает наблюдателей, добавленных
+через observe_queries() в текущем контексте (contextvars), и передает им
+текст запроса и время выполнения. run_in_parallel копирует контекст
+в потоки пула, поэтому наблюдатель видит и параллельные запросы.
+
+Без наблюдателей обертка добавляет к запросу одно чтение ContextVar.
+
+Пример:
+    durations = []
+    with observe_queries(lambda sql, duration: durations.append(duration)):
+        list(Book.objects.all())
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+
+
+_observers = contextvars.ContextVar('books_query_observers', default=())
+
+
+def _dispatch(execute, sql, params, many, context):
+    observers = _observers.get()
+    if not observers:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        for observer in observers:
+            observer(sql, duration)
+
+
+def install(sender, connection, **kwargs):
+    """Обработчик connection_created: подключает обертку к новому соединению."""
+    # В начало списка: execute_wrapper() снимает обертки с конца
+    if _dispatch not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _dispatch)
+
+
+@contextmanager
+def observe_queries(observer):
+    """Вызывает observer(sql, duration) для каждого запроса в текущем контексте."""
+    token = _observers.set(_observers.get() + (observer,))
+    try:
+        yield
+    finally:
+        _observers.reset(token)
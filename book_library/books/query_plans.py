@@ -0,0 +1,206 @@
+"""
+Модуль для анализа планов выполнения именованных запросов.
+
+Каждый запрос из NAMED_QUERIES выполняется, все его SQL-инструкции
+(включая запросы prefetch_related) перехватываются и для каждой
+выполняется EXPLAIN. Нормализованные планы сохраняются в JSON-снимок
+и сравниваются с ним при следующих запусках:
+python manage.py explain_queries
+
+Регрессией считается:
+- новое полное сканирование таблицы (SCAN / Seq Scan вместо поиска по индексу);
+- новая временная сортировка (USE TEMP B-TREE / Sort);
+- увеличение количества SQL-инструкций запроса (например, появление N+1).
+"""
+
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.query import QuerySet
+from django.utils import timezone
+
+from . import book_documents, optimized_queries, pagination, queries
+from .dashboard import dashboard_snapshot
+
+
+# Именованные запросы: имя -> функция без аргументов,
+# возвращающая QuerySet (он будет вычислен) или выполняющая запросы сама
+NAMED_QUERIES = {
+    'query_1_books_by_country': lambda: queries.books_by_country('Россия'),
+    'query_2_books_by_city': lambda: queries.books_by_city('Москва'),
+    'query_2_books_by_city_with_stores': lambda: queries.books_by_city_with_stores('Москва'),
+    'query_3_books_by_average_rating': lambda: queries.books_by_average_rating(4.5),
+    'query_4_books_count_by_store': queries.books_count_by_store,
+    'query_5_stores_by_publication_date': lambda: queries.stores_by_publication_date(2010),
+    'books_with_author_and_publisher': optimized_queries.books_with_author_and_publisher,
+    'books_with_stores': optimized_queries.books_with_stores,
+    'books_with_positive_reviews': optimized_queries.books_with_positive_reviews,
+    'books_with_all_relations': optimized_queries.books_with_all_relations,
+    'authors_with_books': optimized_queries.authors_with_books,
+    'books_with_planned_fields': optimized_queries.books_with_planned_fields,
+    'dashboard_snapshot': dashboard_snapshot,
+    'book_document': lambda: book_documents.fetch_book_document(1),
+    'book_reviews_first_page': lambda: pagination.book_reviews_page(1),
+    'book_reviews_next_page': lambda: pagination.book_reviews_page(
+        1, pagination.encode_cursor(timezone.now(), 0), rating=5
+    ),
+}
+
+
+def default_snapshot_path(vendor):
+    """Путь к снимку планов для бэкенда базы данных."""
+    return Path(settings.BASE_DIR) / 'query_plans' / f'{vendor}.json'
+
+
+def capture_statements(func, using=DEFAULT_DB_ALIAS):
+    """
+    Выполняет запрос и возвращает список выполненных инструкций (sql, params).
+
+    Выполнение идет внутри транзакции: так run_in_parallel не уносит
+    запросы в другие потоки, где их не увидит перехватчик.
+    """
+    statements = []
+
+    def wrapper(execute, sql, params, many, context):
+        statements.append((sql, tuple(params or ())))
+        return execute(sql, params, many, context)
+
+    connection = connections[using]
+    with transaction.atomic(using=using), connection.execute_wrapper(wrapper):
+        result = func()
+        if isinstance(result, QuerySet):
+            list(result)
+    return statements
+
+
+def explain_statement(sql, params, analyze=False, using=DEFAULT_DB_ALIAS):
+    """Выполняет EXPLAIN для инструкции и возвращает нормализованный план."""
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        prefix = connection.ops.explain_query_prefix()
+        with connection.cursor() as cursor:
+            cursor.execute(f"{prefix} {sql}", params)
+            return normalize_sqlite_plan(cursor.fetchall())
+
+    if connection.vendor == 'postgresql':
+        options = {'format': 'json'}
+        if analyze:
+            options['analyze'] = True
+        prefix = connection.ops.explain_query_prefix(**options)
+        with connection.cursor() as cursor:
+            cursor.execute(f"{prefix} {sql}", params)
+            document = cursor.fetchone()[0]
+        if isinstance(document, str):
+            document = json.loads(document)
+        return normalize_postgresql_plan(document[0]['Plan'])
+
+    raise NotImplementedError(f"Бэкенд {connection.vendor} не поддерживается")
+
+
+def normalize_sqlite_plan(rows):
+    """
+    Превращает строки EXPLAIN QUERY PLAN (id, parent, notused, detail)
+    в список строк с отступами по уровню вложенности.
+    """
+    depth = {0: -1}
+    plan = []
+    for node_id, parent_id, _, detail in rows:
+        depth[node_id] = depth.get(parent_id, -1) + 1
+        plan.append('  ' * depth[node_id] + detail)
+    return plan
+
+
+def normalize_postgresql_plan(node, level=0):
+    """
+    Превращает JSON-план PostgreSQL в список строк с отступами.
+    Стоимости, оценки строк и время отбрасываются: они меняются от запуска к запуску.
+    """
+    line = node['Node Type']
+    if 'Relation Name' in node:
+        line += f" on {node['Relation Name']}"
+    if 'Index Name' in node:
+        line += f" using {node['Index Name']}"
+    plan = ['  ' * level + line]
+    for child in node.get('Plans', []):
+        plan.extend(normalize_postgresql_plan(child, level + 1))
+    return plan
+
+
+def plan_features(plan):
+    """
+    Извлекает из плана признаки для сравнения:
+    таблицы, читаемые полным сканированием, и количество временных сортировок.
+    """
+    full_scans = set()
+    temp_sorts = 0
+    for line in plan:
+        words = line.split()
+        if words[0] == 'SCAN' and len(words) == 2 and words[1] != 'CONSTANT':
+            full_scans.add(words[1])
+        elif line.lstrip().startswith('Seq Scan on '):
+            full_scans.add(words[3])
+        if 'USE TEMP B-TREE' in line or words[0] in ('Sort', 'Incremental'):
+            temp_sorts += 1
+    return full_scans, temp_sorts
+
+
+def capture_plans(names=None, analyze=False, using=DEFAULT_DB_ALIAS):
+    """Снимает планы всех (или выбранных) именованных запросов."""
+    result = {}
+    for name, func in NAMED_QUERIES.items():
+        if names and name not in names:
+            continue
+        result[name] = [
+            {'sql': sql, 'plan': explain_statement(sql, params, analyze, using)}
+            for sql, params in capture_statements(func, using)
+        ]
+    return result
+
+
+def find_regressions(old, new):
+    """
+    Сравнивает снимки {имя: [инструкции]} и возвращает список описаний регрессий.
+    Запросы, которых нет в старом снимке, не сравниваются.
+    """
+    regressions = []
+    for name, new_statements in new.items():
+        old_statements = old.get(name)
+        if old_statements is None:
+            continue
+        if len(new_statements) > len(old_statements):
+            regressions.append(
+                f"{name}: количество SQL-инструкций выросло "
+                f"с {len(old_statements)} до {len(new_statements)}"
+            )
+        for index, (before, after) in enumerate(zip(old_statements, new_statements), start=1):
+            old_scans, old_sorts = plan_features(before['plan'])
+            new_scans, new_sorts = plan_features(after['plan'])
+            for table in sorted(new_scans - old_scans):
+                regressions.append(f"{name} [инструкция {index}]: новое полное сканирование {table}")
+            if new_sorts > old_sorts:
+                regressions.append(
+                    f"{name} [инструкция {index}]: временных сортировок стало "
+                    f"{new_sorts} вместо {old_sorts}"
+                )
+    return regressions
+
+
+def load_snapshot(path):
+    """Загружает снимок планов или возвращает пустой словарь."""
+    path = Path(path)
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding='utf-8'))['queries']
+
+
+def save_snapshot(path, vendor, plans):
+    """Сохраняет снимок планов в JSON."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    document = {'vendor': vendor, 'queries': plans}
+    path.write_text(
+        json.dumps(document, ensure_ascii=False, indent=2, sort_keys=True) + '\n',
+        encoding='utf-8',
+    )
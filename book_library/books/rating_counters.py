@@ -0,0 +1,146 @@
+"""
+Модуль распределенных счетчиков оценок книг.
+
+Если хранить количество и сумму оценок в строке книги, каждый новый
+отзыв на популярную книгу ждет блокировку этой строки, и запись отзывов
+на одну книгу выполняется строго по очереди. Счетчик книги разбит на
+BOOKS_RATING_SHARDS строк BookRatingShard; запись увеличивает случайную
+из них одним UPDATE, поэтому одновременные записи расходятся по разным
+строкам и не блокируют друг друга (в SQLite запись все равно
+последовательна: блокируется вся база данных).
+
+Чтение суммирует строки книги (их не больше BOOKS_RATING_SHARDS)
+и кэширует результат на BOOKS_RATING_CACHE_SECONDS секунд.
+compact_rating_counters() сливает части каждой книги в часть 0,
+чтобы у книг без новых отзывов оставалось по одной строке.
+"""
+
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import BookRatingShard, Review
+
+
+RATING_CACHE_KEY = 'books:rating:{book_id}'
+
+
+def shard_count():
+    return getattr(settings, 'BOOKS_RATING_SHARDS', 8)
+
+
+def _cache_seconds():
+    return getattr(settings, 'BOOKS_RATING_CACHE_SECONDS', 5)
+
+
+def add_rating(book_id, rating, count=1):
+    """
+    Добавляет count оценок rating (отрицательный count - удаляет).
+    Возвращает True, если для записи пришлось создать новую часть счетчика.
+    """
+    shard = random.randrange(shard_count())
+    changes = {'count': F('count') + count, 'total': F('total') + rating * count}
+    shards = BookRatingShard.objects.filter(book_id=book_id, shard=shard)
+    if shards.update(**changes):
+        return False
+
+    # Часть создается при первой записи; конкурентная вставка той же части
+    # игнорируется, и обе записи выполняют UPDATE уже существующей строки
+    BookRatingShard.objects.bulk_create(
+        [BookRatingShard(book_id=book_id, shard=shard)], ignore_conflicts=True
+    )
+    shards.update(**changes)
+    return True
+
+
+def _summary(count, total):
+    return {
+        'count': count or 0,
+        'average': round(total / count, 2) if count else None,
+    }
+
+
+def book_rating(book_id):
+    """Количество и средняя оценка книги: {'count', 'average'}."""
+    return ratings_for([book_id])[book_id]
+
+
+def ratings_for(book_ids):
+    """
+    Оценки нескольких книг: {book_id: {'count', 'average'}}.
+    Книги, которых нет в кэше, суммируются одним запросом GROUP BY.
+    """
+    keys = {RATING_CACHE_KEY.format(book_id=book_id): book_id for book_id in book_ids}
+    cached = cache.get_many(list(keys))
+    result = {keys[key]: value for key, value in cached.items()}
+
+    missing = [book_id for book_id in book_ids if book_id not in result]
+    if missing:
+        totals = BookRatingShard.objects.filter(book_id__in=missing).values('book_id').annotate(
+            count_sum=Sum('count'), total_sum=Sum('total')
+        ).order_by()
+        loaded = {book_id: _summary(0, 0) for book_id in missing}
+        for row in totals:
+            loaded[row['book_id']] = _summary(row['count_sum'], row['total_sum'])
+        cache.set_many(
+            {RATING_CACHE_KEY.format(book_id=book_id): value for book_id, value in loaded.items()},
+            _cache_seconds(),
+        )
+        result.update(loaded)
+    return result
+
+
+def compact_rating_counters():
+    """
+    Сливает части счетчиков каждой книги в часть 0.
+    Возвращает количество удаленных строк.
+    """
+    removed = 0
+    book_ids = BookRatingShard.objects.filter(shard__gt=0).values_list('book_id', flat=True).distinct()
+    for book_id in list(book_ids):
+        with transaction.atomic():
+            # Блокируются только строки одной книги и только на время слияния;
+            # запись в удаленную часть создаст ее заново (см. add_rating)
+            shards = list(
+                BookRatingShard.objects.select_for_update().filter(book_id=book_id).order_by('shard')
+            )
+            merged = [shard for shard in shards if shard.shard > 0]
+            if not merged:
+                continue
+            count = sum(shard.count for shard in merged)
+            total = sum(shard.total for shard in merged)
+            BookRatingShard.objects.filter(pk__in=[shard.pk for shard in merged]).delete()
+            if shards[0].shard == 0:
+                BookRatingShard.objects.filter(pk=shards[0].pk).update(
+                    count=F('count') + count, total=F('total') + total
+                )
+            else:
+                BookRatingShard.objects.create(book_id=book_id, shard=0, count=count, total=total)
+            removed += len(merged)
+    return removed
+
+
+def rebuild_rating_counters(book_ids=None):
+    """
+    Пересчитывает счетчики по таблице отзывов (после массовых операций,
+    которые не отправляют сигналы: bulk_create, update, fast_delete):
+    все или только книг book_ids. Возвращает количество книг с отзывами.
+    """
+    reviews = Review.objects.all()
+    shards = BookRatingShard.objects.all()
+    if book_ids is not None:
+        reviews = reviews.filter(book_id__in=book_ids)
+        shards = shards.filter(book_id__in=book_ids)
+    totals = reviews.values('book_id').annotate(
+        count=Count('id'), total=Sum('rating')
+    ).order_by()
+    with transaction.atomic():
+        shards.delete()
+        shards = BookRatingShard.objects.bulk_create([
+            BookRatingShard(book_id=row['book_id'], shard=0, count=row['count'], total=row['total'])
+            for row in totals
+        ], batch_size=1000)
+    return len(shards)
@@ -0,0 +1,191 @@
+"""
+Модуль рекомендаций «есть в тех же магазинах».
+
+Связи книга-магазин загружаются в разреженную матрицу A (книги x магазины,
+scipy.sparse CSR). Сходство двух книг - косинусная мера их наборов
+магазинов: |общие магазины| / sqrt(|магазины 1| * |магазины 2|).
+Строки сходства считаются одним разреженным произведением A[строки] @ A.T,
+затем для каждой книги выбираются top-K соседей (np.partition).
+Перемножаются только ненулевые элементы, поэтому стоимость растет
+с количеством общих магазинов, а не с квадратом числа книг, как у JOIN
+связей с самими собой.
+
+Результаты хранятся в таблице BookRecommendation. Обновление
+инкрементальное: по журналу изменений (changelog.py) находятся
+измененные книги и магазины, и пересчитываются только книги, которые
+продаются в этих магазинах, - у остальных сходство не могло измениться.
+Курсор журнала хранится в базе (changelog.save_cursor), чтобы очистка
+журнала не удалила непрочитанные записи; без курсора или после удаления
+непрочитанных записей выполняется полный пересчет.
+"""
+
+import numpy as np
+from django.db import transaction
+from scipy import sparse
+
+from .changelog import ChangeLogPruned, get_cursor, iter_changes, latest_cursor, save_cursor
+from .models import Book, BookRecommendation
+
+
+BookStores = Book.stores.through
+
+# Сколько рекомендаций хранится для каждой книги
+TOP_K = 10
+
+# Имя курсора журнала изменений
+RECOMMENDATIONS_CURSOR = 'recommendations'
+
+# Сколько строк сходства вычисляется одним разреженным произведением
+CHUNK_SIZE = 1000
+
+
+class StoreMatrix:
+    """Разреженная матрица книга x магазин и нормы ее строк."""
+
+    def __init__(self):
+        self.book_ids = np.array(
+            Book.objects.order_by('id').values_list('id', flat=True), dtype=np.int64
+        )
+        links = np.array(
+            BookStores.objects.order_by().values_list('book_id', 'store_id'), dtype=np.int64
+        ).reshape(-1, 2)
+        self.store_ids, store_pos = np.unique(links[:, 1], return_inverse=True)
+        book_pos = np.searchsorted(self.book_ids, links[:, 0])
+
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(links), dtype=np.float64), (book_pos, store_pos)),
+            shape=(len(self.book_ids), len(self.store_ids)),
+        )
+        self.norms = np.sqrt(np.asarray(self.matrix.sum(axis=1)).ravel())
+
+    def positions(self, book_ids):
+        """Позиции существующих книг из book_ids в матрице (удаленные книги пропускаются)."""
+        book_ids = np.asarray(sorted(book_ids), dtype=np.int64)
+        positions = np.searchsorted(self.book_ids, book_ids)
+        found = positions < len(self.book_ids)
+        found[found] = self.book_ids[positions[found]] == book_ids[found]
+        return positions[found]
+
+    def books_in_stores(self, store_ids):
+        """Позиции книг, которые продаются хотя бы в одном из магазинов store_ids."""
+        columns = np.flatnonzero(np.isin(self.store_ids, list(store_ids)))
+        if not len(columns):
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(self.matrix[:, columns].getnnz(axis=1))
+
+    def top_similar(self, positions, k=TOP_K):
+        """
+        Возвращает {book_id: [(id похожей книги, сходство), ...]} для книг
+        на позициях positions, по убыванию сходства (при равенстве - по id).
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        result = {}
+        if not len(positions):
+            return result
+
+        # Строки сходства считаются пачками, чтобы ограничить память произведения
+        for chunk_start in range(0, len(positions), CHUNK_SIZE):
+            chunk = positions[chunk_start:chunk_start + CHUNK_SIZE]
+            products = (self.matrix[chunk] @ self.matrix.T).tocsr()
+            for row, position in enumerate(chunk.tolist()):
+                start, end = products.indptr[row], products.indptr[row + 1]
+                columns = products.indices[start:end]
+                keep = columns != position
+                columns = columns[keep]
+                scores = products.data[start:end][keep] / (self.norms[position] * self.norms[columns])
+
+                if len(columns) > k:
+                    # Порог k-го значения, затем точная сортировка небольшого остатка
+                    threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+                    candidates = scores >= threshold
+                    columns, scores = columns[candidates], scores[candidates]
+                order = np.lexsort((self.book_ids[columns], -scores))[:k]
+                result[int(self.book_ids[position])] = list(zip(
+                    self.book_ids[columns[order]].tolist(), scores[order].tolist()
+                ))
+        return result
+
+
+def save_recommendations(similar):
+    """Заменяет рекомендации книг из similar ({book_id: [(id, сходство)]})."""
+    with transaction.atomic():
+        BookRecommendation.objects.filter(book_id__in=list(similar)).delete()
+        BookRecommendation.objects.bulk_create([
+            BookRecommendation(book_id=book_id, recommended_id=recommended_id, rank=rank, score=score)
+            for book_id, neighbours in similar.items()
+            for rank, (recommended_id, score) in enumerate(neighbours, start=1)
+        ], batch_size=1000)
+
+
+def rebuild_recommendations(k=TOP_K):
+    """Полный пересчет рекомендаций всех книг. Возвращает количество книг."""
+    cursor = latest_cursor()
+    matrix = StoreMatrix()
+    similar = matrix.top_similar(np.arange(len(matrix.book_ids)), k)
+    with transaction.atomic():
+        # Удаляются и строки книг, у которых больше нет ни одного магазина
+        BookRecommendation.objects.all().delete()
+        save_recommendations(similar)
+        save_cursor(RECOMMENDATIONS_CURSOR, cursor)
+    return len(similar)
+
+
+def changed_since(cursor):
+    """
+    Изменения каталога после cursor, влияющие на рекомендации:
+    (id книг, id магазинов, новый курсор).
+    """
+    book_ids, store_ids = set(), set()
+    for batch in iter_changes(cursor):
+        for entry in batch:
+            if entry.table_name == 'books_book_stores':
+                book_ids.add(entry.row_id)
+                store_ids.add(entry.ref_id)
+            elif entry.table_name == 'books_book':
+                book_ids.add(entry.row_id)
+            elif entry.table_name == 'books_store':
+                store_ids.add(entry.row_id)
+        cursor = batch[-1].id
+    return book_ids, store_ids, cursor
+
+
+def refresh_recommendations(k=TOP_K):
+    """
+    Обновляет рекомендации по журналу изменений после сохраненного курсора.
+    Возвращает количество пересчитанных книг.
+    """
+    cursor = get_cursor(RECOMMENDATIONS_CURSOR)
+    if cursor is None:
+        return rebuild_recommendations(k)
+    try:
+        book_ids, store_ids, new_cursor = changed_since(cursor)
+    except ChangeLogPruned:
+        return rebuild_recommendations(k)
+    if not book_ids and not store_ids:
+        # Курсор сдвигается и без изменений связей, чтобы не удерживать очистку журнала
+        if new_cursor != cursor:
+            save_cursor(RECOMMENDATIONS_CURSOR, new_cursor)
+        return 0
+
+    matrix = StoreMatrix()
+    # Сходство книги меняется, только если меняются ее магазины
+    # или состав книг в одном из ее магазинов
+    positions = np.union1d(matrix.positions(book_ids), matrix.books_in_stores(store_ids))
+    # Удаленных книг нет в матрице: их рекомендации удаляются,
+    # а книги, которым они были рекомендованы, пересчитываются
+    deleted = sorted(set(book_ids) - set(matrix.book_ids.tolist()))
+    if deleted:
+        referring = BookRecommendation.objects.filter(recommended_id__in=deleted).values_list('book_id', flat=True)
+        positions = np.union1d(positions, matrix.positions(referring))
+    with transaction.atomic():
+        BookRecommendation.objects.filter(book_id__in=deleted).delete()
+        save_recommendations(matrix.top_similar(positions, k))
+        save_cursor(RECOMMENDATIONS_CURSOR, new_cursor)
+    return len(positions)
+
+
+def recommendations_for(book_id):
+    """Рекомендации книги: QuerySet BookRecommendation с рекомендуемыми книгами."""
+    return BookRecommendation.objects.filter(book_id=book_id).select_related(
+        'recommended__author'
+    ).order_by('rank')
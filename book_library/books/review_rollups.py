@@ -0,0 +1,262 @@
+"""
+Модуль сводок отзывов по дням и месяцам.
+
+Вопросы вида «сколько отзывов и какая средняя оценка у книги по дням,
+неделям или месяцам» по таблице отзывов требуют чтения всех отзывов
+периода с группировкой по усеченной дате. Таблица ReviewRollup хранит
+готовые суммы: количество отзывов, сумму оценок и гистограмму оценок
+за день и за месяц, по каждой книге и по всему каталогу (book = NULL).
+
+Сводки обновляются при записи отзывов (signals.py): отзыв увеличивает
+четыре строки - день и месяц книги и каталога. Как в счетчиках оценок
+(rating_counters.py), строка периода разбита на части, и запись
+увеличивает случайную часть. Дни и месяцы считаются в часовом поясе
+TIME_ZONE, чтобы граница суток не зависела от часового пояса запроса.
+
+Запросы за диапазон дат читают месячные строки за полные месяцы
+диапазона и дневные строки только за неполные месяцы по краям:
+год статистики - 12 строк на часть вместо 365 или миллионов отзывов.
+
+Массовые операции, которые не отправляют сигналы (bulk_create, update),
+требуют пересчета: python manage.py backfill_review_rollups.
+"""
+
+import random
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Review, ReviewRollup
+from .rating_counters import shard_count
+
+
+RATINGS = range(1, 6)
+
+# Суммируемые поля сводки
+FIELDS = ('count', 'rating_sum') + tuple(f'rating_{rating}' for rating in RATINGS)
+
+BUCKETS = ('day', 'week', 'month')
+
+
+def rollup_timezone():
+    return timezone.get_default_timezone()
+
+
+def review_day(created_date):
+    """День отзыва в часовом поясе сводок."""
+    if timezone.is_naive(created_date):
+        return created_date.date()
+    return timezone.localdate(created_date, rollup_timezone())
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (month_start(day) + timedelta(days=32)).replace(day=1)
+
+
+def bucket_start(day, bucket):
+    """Начало интервала графика (день, неделя с понедельника или месяц), в который попадает day."""
+    if bucket == 'day':
+        return day
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return month_start(day)
+    raise ValueError(f'Неизвестный интервал: {bucket}')
+
+
+def _next_bucket(start, bucket):
+    if bucket == 'day':
+        return start + timedelta(days=1)
+    if bucket == 'week':
+        return start + timedelta(days=7)
+    return next_month(start)
+
+
+def _review_values(rating, count):
+    return {'count': count, 'rating_sum': rating * count, f'rating_{rating}': count}
+
+
+def _apply(deltas):
+    """
+    Прибавляет изменения {(период, начало, book_id): {поле: приращение}}
+    к случайной части каждой строки.
+    """
+    for (period, start, book_id), values in deltas.items():
+        values = {name: value for name, value in values.items() if value}
+        if not values:
+            continue
+        key = {'period': period, 'period_start': start, 'book_id': book_id, 'shard': random.randrange(shard_count())}
+        changes = {name: F(name) + value for name, value in values.items()}
+        rows = ReviewRollup.objects.filter(**key)
+        if rows.update(**changes):
+            continue
+        # Часть создается при первой записи за период; конкурентная вставка
+        # той же части игнорируется, и обе записи выполняют UPDATE
+        ReviewRollup.objects.bulk_create([ReviewRollup(**key)], ignore_conflicts=True)
+        rows.update(**changes)
+
+
+def _deltas(rows, book_rows=True):
+    """
+    Изменения строк сводок для отзывов rows - пар (book_id, day) и значений
+    полей; book_rows=False - только строки каталога.
+    """
+    deltas = defaultdict(Counter)
+    for (book_id, day), values in rows:
+        for period, start in ((ReviewRollup.DAY, day), (ReviewRollup.MONTH, month_start(day))):
+            deltas[(period, start, None)].update(values)
+            if book_rows:
+                deltas[(period, start, book_id)].update(values)
+    return deltas
+
+
+def add_review(book_id, rating, created_date, count=1, book_rows=True):
+    """
+    Добавляет count отзывов с оценкой rating (отрицательный count - удаляет).
+    book_rows=False - только в сводки каталога (строки книги удаляются вместе с ней).
+    """
+    row = ((book_id, review_day(created_date)), _review_values(rating, count))
+    _apply(_deltas([row], book_rows))
+
+
+def add_reviews(reviews):
+    """Добавляет в сводки отзывы, созданные без сигналов (например, bulk_create)."""
+    _apply(_deltas(
+        ((review.book_id, review_day(review.created_date)), _review_values(review.rating, 1))
+        for review in reviews
+    ))
+
+
+def remove_catalog_reviews(reviews):
+    """
+    Вычитает отзывы QuerySet reviews из сводок каталога одним запросом
+    с группировкой по дню и оценке. Используется перед удалением, при котором
+    база данных удаляет отзывы и строки сводок книг сама (fast_delete.py).
+    """
+    days = reviews.annotate(day=TruncDate('created_date', tzinfo=rollup_timezone())).values(
+        'day', 'rating'
+    ).annotate(reviews=Count('id')).order_by()
+    _apply(_deltas(
+        (((None, row['day']), _review_values(row['rating'], -row['reviews'])) for row in days),
+        book_rows=False,
+    ))
+
+
+def rebuild_review_rollups(since=None, batch_size=1000):
+    """
+    Пересчитывает сводки по таблице отзывов: все или начиная с месяца даты since.
+    Дневные строки книг считаются в базе данных одним запросом GROUP BY,
+    остальные складываются из них. Возвращает количество созданных строк.
+    """
+    reviews = Review.objects.all()
+    rollups = ReviewRollup.objects.all()
+    if since is not None:
+        first = month_start(since)
+        reviews = reviews.filter(
+            created_date__gte=timezone.make_aware(datetime.combine(first, time.min), rollup_timezone())
+        )
+        rollups = rollups.filter(period_start__gte=first)
+
+    days = reviews.annotate(day=TruncDate('created_date', tzinfo=rollup_timezone())).values(
+        'book_id', 'day'
+    ).annotate(
+        count=Count('id'),
+        rating_sum=Sum('rating'),
+        **{f'rating_{rating}': Count('id', filter=Q(rating=rating)) for rating in RATINGS},
+    ).order_by()
+
+    created = 0
+    totals = defaultdict(Counter)
+    with transaction.atomic():
+        rollups.delete()
+        batch = []
+        for row in days.iterator(chunk_size=batch_size):
+            values = {name: row[name] for name in FIELDS}
+            batch.append(ReviewRollup(
+                period=ReviewRollup.DAY, period_start=row['day'], book_id=row['book_id'], **values
+            ))
+            month = month_start(row['day'])
+            totals[(ReviewRollup.MONTH, month, row['book_id'])].update(values)
+            totals[(ReviewRollup.DAY, row['day'], None)].update(values)
+            totals[(ReviewRollup.MONTH, month, None)].update(values)
+            if len(batch) >= batch_size:
+                created += len(ReviewRollup.objects.bulk_create(batch))
+                batch = []
+        batch += [
+            ReviewRollup(period=period, period_start=start, book_id=book_id, **values)
+            for (period, start, book_id), values in totals.items()
+        ]
+        created += len(ReviewRollup.objects.bulk_create(batch, batch_size=batch_size))
+    return created
+
+
+def _covering_rows(start, end, use_months):
+    """
+    Условие строк сводок за дни start..end включительно: полные месяцы
+    диапазона - месячными строками (если use_months), остальные дни - дневными.
+    """
+    days = Q(period=ReviewRollup.DAY, period_start__gte=start, period_start__lte=end)
+    first_full = start if start.day == 1 else next_month(start)
+    after_full = month_start(end + timedelta(days=1))
+    if not use_months or first_full >= after_full:
+        return days
+    return (
+        Q(period=ReviewRollup.MONTH, period_start__gte=first_full, period_start__lt=after_full)
+        | Q(period=ReviewRollup.DAY, period_start__gte=start, period_start__lt=first_full)
+        | Q(period=ReviewRollup.DAY, period_start__gte=after_full, period_start__lte=end)
+    )
+
+
+def _summary(values):
+    count = values.get('count') or 0
+    return {
+        'count': count,
+        'average': round(values['rating_sum'] / count, 2) if count else None,
+        'histogram': {rating: values.get(f'rating_{rating}') or 0 for rating in RATINGS},
+    }
+
+
+def review_totals(start, end, book_id=None):
+    """
+    Отзывы за дни start..end включительно (date) по книге book_id
+    или по каталогу: {'count', 'average', 'histogram': {оценка: количество}}.
+    """
+    values = ReviewRollup.objects.filter(
+        _covering_rows(start, end, use_months=True), book_id=book_id
+    ).aggregate(**{name: Sum(name) for name in FIELDS})
+    return _summary(values)
+
+
+def review_trend(start, end, bucket='day', book_id=None):
+    """
+    Отзывы по интервалам графика (day, week или month) за дни start..end:
+    список {'period_start', 'count', 'average', 'histogram'} без пропусков.
+    Значения крайних интервалов учитывают только дни внутри диапазона.
+    """
+    if bucket not in BUCKETS:
+        raise ValueError(f'Неизвестный интервал: {bucket}')
+    if start > end:
+        return []
+
+    rows = ReviewRollup.objects.filter(
+        _covering_rows(start, end, use_months=bucket == 'month'), book_id=book_id
+    ).values('period', 'period_start').annotate(**{name: Sum(name) for name in FIELDS}).order_by()
+
+    buckets = defaultdict(Counter)
+    for row in rows:
+        buckets[bucket_start(row['period_start'], bucket)].update({name: row[name] for name in FIELDS})
+
+    trend = []
+    current = bucket_start(start, bucket)
+    while current <= end:
+        trend.append({'period_start': current, **_summary(buckets.get(current, {}))})
+        current = _next_bucket(current, bucket)
+    return trend
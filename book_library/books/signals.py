@@ -0,0 +1,153 @@
+"""
+Обработчики сигналов моделей.
+
+Вместо синхронного пересчета агрегатов в момент записи обработчики
+ставят отложенную фоновую задачу. Повторные изменения за время задержки
+схлопываются в одну задачу (см. books.tasks.enqueue и enqueue_once).
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete, pre_save, m2m_changed
+from django.dispatch import receiver
+
+from .autocomplete import mark_autocomplete_changed
+from .fast_delete import bulk_deleted
+from .rating_counters import add_rating
+from .review_rollups import add_review
+from .models import Author, Book, City, Country, Publisher, Store, Review
+from .store_assignment import stores_assigned
+from . import tasks
+
+
+def _debounce_seconds():
+    return getattr(settings, 'BOOKS_TASK_DEBOUNCE_SECONDS', 5)
+
+
+# Модели каталога: от них зависит статистика главной страницы.
+# Индекс фасетов обновляется сам по журналу изменений (см. facets.py)
+CATALOG_MODELS = (Author, Book, Publisher, Store, Review, Country, City)
+
+# Модели, от которых зависят подсказки автодополнения (названия, имена, ранги)
+AUTOCOMPLETE_MODELS = (Author, Book, Review)
+
+
+def schedule_homepage_stats():
+    tasks.enqueue_once('books.refresh_homepage_stats', delay=_debounce_seconds())
+
+
+def on_catalog_change(sender, **kwargs):
+    """
+    Реакция на любое изменение каталога: после фиксации транзакции
+    планирует пересчет статистики главной страницы. Пока пересчет
+    не начался, повторные изменения не обращаются к таблице задач,
+    поэтому отзывы на разные книги не пишут в одну общую строку.
+    """
+    transaction.on_commit(schedule_homepage_stats)
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(on_catalog_change, sender=model)
+    post_delete.connect(on_catalog_change, sender=model)
+
+
+def on_autocomplete_change(sender, **kwargs):
+    """После фиксации транзакции сообщает индексам автодополнения, что пора прочитать журнал."""
+    transaction.on_commit(mark_autocomplete_changed)
+
+
+for model in AUTOCOMPLETE_MODELS:
+    post_save.connect(on_autocomplete_change, sender=model)
+    post_delete.connect(on_autocomplete_change, sender=model)
+
+
+def schedule_recommendations():
+    tasks.enqueue_once('books.refresh_recommendations', delay=_debounce_seconds())
+
+
+def on_book_stores_change(sender, **kwargs):
+    """
+    После фиксации транзакции планирует пересчет рекомендаций «есть в тех
+    же магазинах». Какие книги пересчитать, задача определит по журналу
+    изменений. Повторные изменения не откладывают уже запланированный
+    пересчет, поэтому при постоянных правках он все равно выполняется.
+    """
+    transaction.on_commit(schedule_recommendations)
+
+
+post_delete.connect(on_book_stores_change, sender=Book)
+post_delete.connect(on_book_stores_change, sender=Store)
+
+
+@receiver(m2m_changed, sender=Book.stores.through)
+def on_stores_change(sender, action, **kwargs):
+    """Рейтинг магазинов и рекомендации зависят от связей книга-магазин."""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        on_catalog_change(sender, **kwargs)
+        on_book_stores_change(sender, **kwargs)
+
+
+@receiver(stores_assigned)
+def on_stores_assigned(sender, **kwargs):
+    """Массовое назначение магазинов отправляет один сигнал вместо m2m_changed."""
+    on_catalog_change(sender, **kwargs)
+    on_book_stores_change(sender, **kwargs)
+
+
+@receiver(bulk_deleted)
+def on_bulk_deleted(sender, **kwargs):
+    """Быстрое удаление не отправляет post_delete, поэтому реакция - один раз на всю операцию."""
+    on_catalog_change(sender, **kwargs)
+    on_book_stores_change(sender, **kwargs)
+    if any(model in AUTOCOMPLETE_MODELS for model in kwargs['counts']):
+        on_autocomplete_change(sender, **kwargs)
+
+
+# Через сколько секунд после появления новых частей счетчика их слить
+RATING_COMPACT_DELAY = 600
+
+
+def _update_rating(book_id, rating, count):
+    if add_rating(book_id, rating, count):
+        tasks.enqueue_once('books.compact_rating_counters', delay=RATING_COMPACT_DELAY)
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    """Запоминает книгу, оценку и дату изменяемого отзыва, чтобы перенести их в счетчике и сводках."""
+    if not instance._state.adding and instance.pk is not None:
+        instance._review_before = Review.objects.filter(pk=instance.pk).values_list(
+            'book_id', 'rating', 'created_date'
+        ).first()
+
+
+@receiver(post_save, sender=Review)
+def count_review_rating(sender, instance, created, **kwargs):
+    """
+    Добавляет оценку в распределенный счетчик книги (см. rating_counters.py)
+    и в сводки отзывов по дням и месяцам (см. review_rollups.py).
+    """
+    before = getattr(instance, '_review_before', None)
+    instance._review_before = None
+    if not created and before == (instance.book_id, instance.rating, instance.created_date):
+        return
+    if before is not None:
+        book_id, rating, created_date = before
+        _update_rating(book_id, rating, -1)
+        add_review(book_id, rating, created_date, -1)
+    _update_rating(instance.book_id, instance.rating, 1)
+    add_review(instance.book_id, instance.rating, instance.created_date)
+
+
+@receiver(post_delete, sender=Review)
+def uncount_review_rating(sender, instance, origin=None, **kwargs):
+    """
+    Вычитает оценку удаленного отзыва; при удалении книги ее счетчик
+    и сводки удаляются вместе с ней, а из сводок каталога отзыв вычитается.
+    """
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    own = origin is None or origin_model is Review
+    if own:
+        _update_rating(instance.book_id, instance.rating, -1)
+    add_review(instance.book_id, instance.rating, instance.created_date, -1, book_rows=own)
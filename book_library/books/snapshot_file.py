@@ -0,0 +1,146 @@
+"""
+Модуль бинарного формата файла снимка каталога.
+
+Файл отображается в память (mmap) и массивы снимка создаются поверх
+отображения без копирования, поэтому запуск воркера аналитики занимает
+миллисекунды, а страницы файла разделяются всеми процессами через
+страничный кэш ОС.
+
+Формат (все числа little-endian):
+    8 байт   сигнатура b'BOOKSNAP'
+    4 байта  версия формата (uint32)
+    4 байта  длина заголовка N (uint32)
+    N байт   заголовок JSON: {"columns": {имя: {"dtype", "offset", "length"}}, ...}
+    ...      массивы, каждый выровнен по границе 64 байт
+
+Таблица строк хранится двумя массивами: UTF-8 байты всех строк подряд
+(strings_data) и смещения начала каждой строки (strings_offsets).
+"""
+
+import json
+import mmap
+import os
+import struct
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+import numpy as np
+
+from .analytics import CatalogSnapshot
+
+
+MAGIC = b'BOOKSNAP'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+PREFIX = struct.Struct('<8sII')
+
+
+class SnapshotFormatError(Exception):
+    """Файл не является снимком каталога или имеет другую версию формата."""
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _string_table(strings):
+    encoded = [value.encode('utf-8') for value in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return data, offsets
+
+
+def write_snapshot(snapshot, path, metadata=None):
+    """
+    Записывает снимок в файл.
+
+    Запись идет во временный файл, который затем атомарно заменяет целевой:
+    процессы, уже отобразившие старый файл, продолжают работать с ним.
+    """
+    path = Path(path)
+    arrays = {name: np.ascontiguousarray(getattr(snapshot, name)) for name in CatalogSnapshot.COLUMNS}
+    arrays['strings_data'], arrays['strings_offsets'] = _string_table(snapshot.strings)
+
+    # Размер заголовка влияет на смещения, поэтому считаем их от запаса под заголовок
+    columns = {
+        name: {'dtype': array.dtype.newbyteorder('<').str, 'length': int(array.size)}
+        for name, array in arrays.items()
+    }
+    header = {
+        'columns': columns,
+        'created': datetime.now(dt_timezone.utc).isoformat(),
+        'metadata': metadata or {},
+    }
+    header_size = _align(PREFIX.size + len(json.dumps(header).encode('utf-8')) + 64 * len(columns))
+
+    offset = header_size
+    for name, array in arrays.items():
+        columns[name]['offset'] = offset
+        offset = _align(offset + array.nbytes)
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    if PREFIX.size + len(header_bytes) > header_size:
+        raise SnapshotFormatError('Заголовок не помещается в отведенное место')
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(path.name + '.tmp')
+    with open(temp_path, 'wb') as output:
+        output.write(PREFIX.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        output.write(header_bytes)
+        for name, array in arrays.items():
+            output.seek(columns[name]['offset'])
+            output.write(array.astype(columns[name]['dtype'], copy=False).tobytes())
+        output.truncate(offset)
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(temp_path, path)
+    return path
+
+
+def read_header(buffer):
+    """Проверяет сигнатуру и версию, возвращает заголовок JSON."""
+    if len(buffer) < PREFIX.size:
+        raise SnapshotFormatError('Файл слишком короткий')
+    magic, version, header_length = PREFIX.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise SnapshotFormatError('Неверная сигнатура файла снимка')
+    if version != FORMAT_VERSION:
+        raise SnapshotFormatError(f'Неподдерживаемая версия формата: {version}')
+    return json.loads(bytes(buffer[PREFIX.size:PREFIX.size + header_length]))
+
+
+def read_snapshot(path):
+    """
+    Отображает файл в память и возвращает снимок, массивы которого
+    ссылаются на отображение (только для чтения, без копирования).
+    """
+    with open(path, 'rb') as source:
+        mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+
+    header = read_header(mapped)
+    arrays = {
+        name: np.frombuffer(mapped, dtype=column['dtype'], count=column['length'], offset=column['offset'])
+        for name, column in header['columns'].items()
+    }
+    missing = set(CatalogSnapshot.COLUMNS) - set(arrays)
+    if missing:
+        raise SnapshotFormatError(f"В файле нет массивов: {', '.join(sorted(missing))}")
+
+    snapshot = CatalogSnapshot()
+    for name in CatalogSnapshot.COLUMNS:
+        setattr(snapshot, name, arrays[name])
+
+    data = arrays['strings_data'].tobytes()
+    offsets = arrays['strings_offsets'].tolist()
+    snapshot.strings = [
+        data[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:])
+    ]
+
+    # Изменения после курсора снимок догонит по журналу изменений
+    snapshot.cursor = header['metadata'].get('cursor', 0)
+
+    # Отображение живет, пока на него ссылается снимок
+    snapshot.mapped_file = mapped
+    snapshot.file_header = header
+    return snapshot
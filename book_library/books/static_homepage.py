@@ -0,0 +1,157 @@
+"""
+Модуль публикации главной страницы статическим файлом.
+
+Содержимое главной страницы меняется только вместе с данными каталога,
+поэтому в режиме публикации (BOOKS_HOMEPAGE_PUBLISH = True) она
+отрисовывается заранее: фоновая задача пересчета статистики после
+изменения Book, Review, Store, Author или Publisher (с задержкой
+BOOKS_TASK_DEBOUNCE_SECONDS, см. signals.py) записывает в
+BOOKS_HOMEPAGE_PUBLISH_DIR файлы:
+
+    index.html      - страница
+    index.html.gz   - сжатая gzip
+    index.html.br   - сжатая brotli (если установлен пакет brotli)
+
+Файлы заменяются атомарно (запись во временный файл и os.replace),
+поэтому читатель никогда не видит недописанную страницу.
+
+StaticHomepageMiddleware отдает файл с подходящим Content-Encoding
+без обращения к ORM и шаблонам и отвечает 304 на условные запросы.
+Файлы можно отдавать и прокси-сервером напрямую (пример для nginx
+в README: gzip_static / brotli_static).
+"""
+
+import gzip
+import os
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:  # Необязательная зависимость: без нее публикуется только .gz
+    brotli = None
+
+
+HOMEPAGE_FILE = 'index.html'
+
+# Варианты файла в порядке предпочтения: (Content-Encoding, расширение)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def publishing_enabled():
+    return getattr(settings, 'BOOKS_HOMEPAGE_PUBLISH', False)
+
+
+def publish_dir():
+    return Path(getattr(settings, 'BOOKS_HOMEPAGE_PUBLISH_DIR', Path(settings.BASE_DIR) / 'published'))
+
+
+def _write_atomic(path, data):
+    temporary = path.with_name(f'.{path.name}.{uuid.uuid4().hex}.tmp')
+    temporary.write_bytes(data)
+    os.replace(temporary, path)
+
+
+def compressed_variants(html):
+    """Сжатые варианты страницы: {Content-Encoding: байты}."""
+    variants = {'gzip': gzip.compress(html, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(html, quality=11)
+    return variants
+
+
+def publish_homepage():
+    """
+    Отрисовывает главную страницу и записывает ее файлы.
+    Возвращает {Content-Encoding или 'identity': путь}.
+    """
+    from .views import homepage_context
+
+    html = render_to_string('index.html', homepage_context()).encode('utf-8')
+    directory = publish_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    page = directory / HOMEPAGE_FILE
+
+    files = {}
+    variants = compressed_variants(html)
+    for encoding, suffix in ENCODINGS:
+        path = page.with_name(page.name + suffix)
+        if encoding in variants:
+            _write_atomic(path, variants[encoding])
+            files[encoding] = path
+        else:
+            # Вариант от предыдущей публикации устарел бы
+            path.unlink(missing_ok=True)
+    # Несжатый файл записывается последним: по его времени изменения строится ETag
+    _write_atomic(page, html)
+    files['identity'] = page
+    return files
+
+
+def accepted_encodings(header):
+    """Кодировки из Accept-Encoding, кроме явно запрещенных (q=0)."""
+    encodings = set()
+    for item in header.split(','):
+        name, *params = [part.strip() for part in item.split(';')]
+        weight = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name and weight > 0:
+            encodings.add(name.lower())
+    return encodings
+
+
+def serve_published(request):
+    """Ответ с опубликованной страницей или None, если она еще не опубликована."""
+    page = publish_dir() / HOMEPAGE_FILE
+    try:
+        stat = page.stat()
+    except FileNotFoundError:
+        return None
+
+    accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    encoding, path = None, page
+    for name, suffix in ENCODINGS:
+        candidate = page.with_name(page.name + suffix)
+        if (name in accepted or '*' in accepted) and candidate.exists():
+            encoding, path = name, candidate
+            break
+
+    etag = f'"{stat.st_mtime_ns:x}-{encoding or "identity"}"'
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = FileResponse(path.open('rb'), content_type='text/html; charset=utf-8')
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Vary'] = 'Accept-Encoding'
+    # Браузер проверяет актуальность при каждом открытии и получает 304
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+class StaticHomepageMiddleware:
+    """Отдает опубликованную главную страницу без вызова представления (см. описание модуля)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.path == '/' and request.method in ('GET', 'HEAD') and publishing_enabled():
+            response = serve_published(request)
+            if response is not None:
+                return response
+        return self.get_response(request)
@@ -0,0 +1,91 @@
+"""
+Модуль массового назначения магазинов книгам.
+
+book.stores.add(store) и book.stores.set(...) работают с одной книгой
+за раз и отправляют m2m_changed для каждой книги. При синхронизации
+каталога, когда меняются магазины тысяч книг, assign_stores():
+1. читает текущие связи всех книг из промежуточной таблицы одним запросом;
+2. вычисляет разницу с целевыми наборами магазинов в Python;
+3. добавляет недостающие связи через bulk_create(ignore_conflicts=True);
+4. удаляет лишние связи пакетными DELETE ... WHERE id IN (...);
+5. отправляет один сигнал stores_assigned со всеми изменениями.
+"""
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.dispatch import Signal
+
+from .models import Book
+
+
+BookStores = Book.stores.through
+
+# Сигнал с итогом массового назначения.
+# Аргументы: added и removed - списки пар (book_id, store_id).
+stores_assigned = Signal()
+
+
+def _pk(obj):
+    """Принимает как объект модели, так и его первичный ключ."""
+    return getattr(obj, 'pk', obj)
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def assign_stores(assignments, batch_size=500, using=DEFAULT_DB_ALIAS):
+    """
+    Приводит магазины книг к целевым наборам.
+
+    assignments - словарь {книга: набор магазинов}; ключи и элементы наборов
+    могут быть объектами моделей или их id. Книги, которых нет в словаре,
+    не изменяются; пустой набор снимает книгу со всех магазинов.
+
+    Текущие связи читаются одним запросом (на бэкендах с лимитом параметров,
+    например SQLite, список id книг разбивается на части под этот лимит).
+    Возвращает словарь {'added': количество, 'removed': количество}.
+    """
+    target = {
+        _pk(book): {_pk(store) for store in stores}
+        for book, stores in assignments.items()
+    }
+    if not target:
+        return {'added': 0, 'removed': 0}
+
+    max_params = connections[using].features.max_query_params or len(target)
+    book_ids = list(target)
+
+    with transaction.atomic(using=using):
+        current = {}
+        for chunk in _chunks(book_ids, max_params):
+            rows = BookStores.objects.using(using).filter(
+                book_id__in=chunk
+            ).values_list('id', 'book_id', 'store_id')
+            for link_id, book_id, store_id in rows:
+                current.setdefault(book_id, {})[store_id] = link_id
+
+        added, removed, removed_link_ids = [], [], []
+        for book_id, store_ids in target.items():
+            existing = current.get(book_id, {})
+            for store_id in store_ids - existing.keys():
+                added.append((book_id, store_id))
+            for store_id in existing.keys() - store_ids:
+                removed.append((book_id, store_id))
+                removed_link_ids.append(existing[store_id])
+
+        BookStores.objects.using(using).bulk_create(
+            [BookStores(book_id=book_id, store_id=store_id) for book_id, store_id in added],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+
+        # У промежуточной модели нет сигналов и каскадов,
+        # поэтому delete() выполняется одним DELETE на пакет без загрузки объектов
+        for chunk in _chunks(removed_link_ids, min(batch_size, max_params)):
+            BookStores.objects.using(using).filter(id__in=chunk).delete()
+
+    if added or removed:
+        stores_assigned.send(sender=Book, added=added, removed=removed, using=using)
+
+    return {'added': len(added), 'removed': len(removed)}
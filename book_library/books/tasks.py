@@ -0,0 +1,314 @@
+"""
+Модуль фоновых задач.
+
+Задачи хранятся в таблице модели Task и выполняются отдельным процессом:
+python manage.py run_worker
+
+Возможности:
+- приоритеты (задачи с большим priority выполняются раньше)
+- повторные попытки с экспоненциальной задержкой
+- дедупликация одинаковых ожидающих задач
+- отложенный запуск (debounce): повторная постановка сдвигает время запуска
+- постановка без обращения к базе, пока задача уже запланирована (enqueue_once)
+- повторный захват задач аварийно завершившегося воркера: захват действует
+  BOOKS_TASK_LOCK_SECONDS секунд и продлевается, пока задача выполняется
+"""
+
+import hashlib
+import json
+import logging
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, close_old_connections, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Task
+
+
+logger = logging.getLogger(__name__)
+
+# Реестр задач: имя -> (функция, максимум попыток)
+_registry = {}
+
+# Ключ кэша: задача запланирована функцией enqueue_once() и еще не начала выполняться
+SCHEDULED_KEY = 'books:task_scheduled:{name}'
+
+
+def task(name, max_attempts=3):
+    """
+    Декоратор регистрации функции как фоновой задачи.
+
+    Аргументы задачи передаются как именованные параметры и должны
+    сериализоваться в JSON.
+    """
+    def decorator(func):
+        _registry[name] = (func, max_attempts)
+        return func
+    return decorator
+
+
+def make_dedup_key(name, payload):
+    """
+    Ключ дедупликации: имя задачи и хэш SHA-256 ее аргументов в каноническом виде.
+    Длина ключа не зависит от размера аргументов.
+    """
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return f"{name}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+
+
+def lock_seconds():
+    return getattr(settings, 'BOOKS_TASK_LOCK_SECONDS', 300)
+
+
+def enqueue(name, payload=None, priority=0, delay=0, reschedule=True):
+    """
+    Ставит задачу в очередь.
+
+    Если такая же задача (то же имя и аргументы) уже ожидает выполнения,
+    новая не создается: у существующей сдвигается время запуска на `delay`
+    секунд вперед и повышается приоритет. Так серия изменений данных
+    приводит к одному пересчету после затишья. С reschedule=False
+    ожидающая задача не меняется (периодические задачи).
+    """
+    if name not in _registry:
+        raise KeyError(f"Неизвестная задача: {name}")
+
+    payload = payload or {}
+    dedup_key = make_dedup_key(name, payload)
+    run_after = timezone.now() + timedelta(seconds=delay)
+
+    pending = Task.objects.filter(status=Task.STATUS_PENDING, dedup_key=dedup_key)
+    if not reschedule:
+        if pending.exists():
+            return False
+    elif pending.update(run_after=run_after):
+        Task.objects.filter(
+            status=Task.STATUS_PENDING, dedup_key=dedup_key, priority__lt=priority
+        ).update(priority=priority)
+        return False
+
+    try:
+        # Конкурентная постановка упрется в условный уникальный индекс
+        with transaction.atomic():
+            Task.objects.create(
+                name=name,
+                payload=payload,
+                dedup_key=dedup_key,
+                priority=priority,
+                run_after=run_after,
+                max_attempts=_registry[name][1],
+            )
+    except IntegrityError:
+        return False
+    return True
+
+
+def enqueue_once(name, delay=0):
+    """
+    Ставит в очередь задачу без аргументов, если она еще не запланирована.
+
+    В отличие от enqueue(), пока задача ждет выполнения, повторный вызов
+    не обращается к базе данных: отметка хранится в кэше (cache.add)
+    и снимается, когда воркер начинает задачу (execute_task). Так частые
+    изменения данных не обновляют раз за разом одну строку задачи.
+    Если задача потеряна, отметка истекает через delay + BOOKS_TASK_LOCK_SECONDS.
+    Изменения, сделанные после начала задачи, ставят ее заново.
+    """
+    key = SCHEDULED_KEY.format(name=name)
+    if not cache.add(key, 1, delay + lock_seconds()):
+        return False
+    try:
+        enqueue(name, delay=delay)
+    except Exception:
+        cache.delete(key)
+        raise
+    return True
+
+
+def claim_next_task():
+    """
+    Забирает следующую готовую к выполнению задачу: ожидающую
+    или выполняющуюся с истекшим сроком захвата (ее воркер завершился аварийно).
+
+    Захват делается условным UPDATE по тому же условию, поэтому несколько
+    воркеров не возьмут одну и ту же задачу ни на одном из бэкендов.
+    """
+    while True:
+        now = timezone.now()
+        expired = Q(status=Task.STATUS_RUNNING, locked_until__lt=now)
+        # Задача, которая уже исчерпала попытки, больше не захватывается
+        Task.objects.filter(expired, attempts__gte=F('max_attempts')).update(
+            status=Task.STATUS_FAILED, locked_until=None,
+            last_error='Воркер не завершил задачу до истечения срока захвата',
+        )
+
+        ready = Q(status=Task.STATUS_PENDING, run_after__lte=now) | expired
+        candidate = Task.objects.filter(ready).order_by(
+            '-priority', 'run_after', 'id'
+        ).values_list('id', flat=True).first()
+        if candidate is None:
+            return None
+
+        claimed = Task.objects.filter(ready, id=candidate).update(
+            status=Task.STATUS_RUNNING,
+            attempts=F('attempts') + 1,
+            locked_until=now + timedelta(seconds=lock_seconds()),
+        )
+        if claimed:
+            return Task.objects.get(id=candidate)
+
+
+def extend_locks(task_ids):
+    """Продлевает срок захвата выполняющихся задач task_ids."""
+    if not task_ids:
+        return 0
+    return Task.objects.filter(id__in=task_ids, status=Task.STATUS_RUNNING).update(
+        locked_until=timezone.now() + timedelta(seconds=lock_seconds())
+    )
+
+
+def execute_task(task_obj):
+    """
+    Выполняет задачу и сохраняет результат.
+
+    При ошибке задача возвращается в очередь с задержкой 2^attempts секунд,
+    пока не исчерпан лимит попыток.
+    """
+    func, _ = _registry.get(task_obj.name, (None, None))
+    try:
+        if func is None:
+            raise KeyError(f"Неизвестная задача: {task_obj.name}")
+        if not task_obj.payload:
+            # Изменения с этого момента должны запланировать задачу заново (см. enqueue_once)
+            cache.delete(SCHEDULED_KEY.format(name=task_obj.name))
+        func(**task_obj.payload)
+    except Exception:
+        task_obj.last_error = traceback.format_exc()
+        if task_obj.attempts < task_obj.max_attempts:
+            task_obj.status = Task.STATUS_PENDING
+            task_obj.run_after = timezone.now() + timedelta(seconds=2 ** task_obj.attempts)
+        else:
+            task_obj.status = Task.STATUS_FAILED
+        logger.exception("Задача %s завершилась ошибкой", task_obj)
+    else:
+        task_obj.status = Task.STATUS_DONE
+
+    task_obj.locked_until = None
+    try:
+        task_obj.save(update_fields=['status', 'run_after', 'locked_until', 'last_error', 'updated_date'])
+    except IntegrityError:
+        # Пока задача выполнялась, такую же уже поставили в очередь заново
+        Task.objects.filter(id=task_obj.id).update(
+            status=Task.STATUS_DONE, locked_until=None, last_error=task_obj.last_error
+        )
+    return task_obj.status
+
+
+def _execute_in_thread(task_obj):
+    """Выполняет задачу в потоке пула и закрывает соединения потока."""
+    try:
+        return execute_task(task_obj)
+    finally:
+        connections.close_all()
+
+
+def run_worker(concurrency=4, poll_interval=1.0, burst=False, stop_event=None):
+    """
+    Основной цикл воркера.
+
+    Задачи выполняются в пуле из `concurrency` потоков, у каждого потока свое
+    соединение с базой. Пока задачи выполняются, воркер продлевает срок их
+    захвата (каждую треть срока). В режиме `burst` воркер завершается, когда
+    в очереди не остается готовых задач. Возвращает количество выполненных задач.
+    """
+    schedule_periodic_tasks()
+    processed = 0
+    running = {}
+    heartbeat = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='books-worker') as pool:
+        while stop_event is None or not stop_event.is_set():
+            close_old_connections()
+
+            while len(running) < concurrency:
+                task_obj = claim_next_task()
+                if task_obj is None:
+                    break
+                running[pool.submit(_execute_in_thread, task_obj)] = task_obj.id
+
+            if not running:
+                if burst:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+            processed += len(done)
+
+            if time.monotonic() - heartbeat >= lock_seconds() / 3:
+                extend_locks(list(running.values()))
+                heartbeat = time.monotonic()
+
+        done, _ = wait(running)
+        processed += len(done)
+
+    return processed
+
+
+@task('books.refresh_homepage_stats')
+def refresh_homepage_stats():
+    """
+    Пересчитывает снимок статистики главной страницы,
+    в режиме публикации - и файл главной страницы.
+    """
+    from .dashboard import refresh_snapshot_cache
+    from .static_homepage import publish_homepage, publishing_enabled
+    refresh_snapshot_cache()
+    if publishing_enabled():
+        publish_homepage()
+
+
+@task('books.refresh_recommendations')
+def refresh_recommendations():
+    """Пересчитывает рекомендации книг, затронутых изменениями каталога."""
+    from .recommendations import refresh_recommendations as refresh
+    from .static_homepage import publish_homepage, publishing_enabled
+    # Рекомендации выводятся в карточках книг на главной странице
+    if refresh() and publishing_enabled():
+        publish_homepage()
+
+
+@task('books.compact_rating_counters')
+def compact_rating_counters():
+    """Сливает части счетчиков оценок книг в одну строку на книгу."""
+    from .rating_counters import compact_rating_counters as compact
+    compact()
+
+
+
+def prune_interval():
+    return getattr(settings, 'BOOKS_CHANGELOG_PRUNE_INTERVAL', 60 * 60)
+
+
+@task('books.prune_changelog')
+def prune_changelog():
+    """
+    Удаляет прочитанные записи журнала изменений (см. changelog.prune_changelog).
+    Следующая очистка планируется заранее, чтобы ошибка не прервала расписание.
+    """
+    from .changelog import prune_changelog as prune
+    enqueue('books.prune_changelog', delay=prune_interval(), reschedule=False)
+    prune()
+
+
+def schedule_periodic_tasks():
+    """Ставит в очередь периодические задачи, если они еще не ожидают выполнения (при запуске воркера)."""
+    enqueue('books.prune_changelog', delay=prune_interval(), reschedule=False)
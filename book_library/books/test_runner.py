@@ -0,0 +1,26 @@
+"""
+Запуск тестов приложения (python manage.py test, см. TEST_RUNNER).
+
+Тесты используют кэш в памяти процесса вместо файлового кэша из settings:
+иначе они делят кэш с запущенными сервером и воркером фоновых задач
+и оставляют каталог .django_cache. Классы тестов не могут переопределить
+CACHES сами: кэш открывается еще при создании тестовой базы данных
+(createcachetable), до запуска первого теста.
+"""
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._test_caches = override_settings(CACHES=TEST_CACHES)
+        self._test_caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._test_caches.disable()
+        super().teardown_test_environment(**kwargs)
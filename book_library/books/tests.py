@@ -1,3 +1,1499 @@
-from django.test import TestCase
+import gzip
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import loadtest, queries, tasks
+from .analytics import CatalogSnapshot
+from .autocomplete import (
+    AUTOCOMPLETE_INDEX_VERSION_KEY, AutocompleteIndex, autocomplete_index, mark_autocomplete_changed, normalize,
+)
+from .concurrency import can_run_in_parallel, run_in_parallel
+from .changelog import (
+    ChangeLogPruned, iter_changes, latest_cursor, prune_changelog, pruned_cursor, read_changes, save_cursor,
+)
+from .dashboard import dashboard_snapshot
+from .date_ranges import year_range
+from .display import StrQueryError, query_free_str, strict_str
+from .facets import FacetIndex
+from .field_plans import parse_paths, plan_queryset
+from .fast_delete import bulk_deleted, cascade_counts, fast_delete
+from .locations import cities_by_name, in_city, in_country
+from .prepared import PreparedQuery
+from .query_plans import find_regressions, normalize_postgresql_plan, normalize_sqlite_plan
+from .profiling import _cprofile_lock, force_profiling, frame_label
+from .rating_counters import book_rating, compact_rating_counters, ratings_for, rebuild_rating_counters
+from .recommendations import rebuild_recommendations, recommendations_for, refresh_recommendations
+from .review_rollups import rebuild_review_rollups, review_totals, review_trend
+from .snapshot_file import read_snapshot, write_snapshot
+from .static_homepage import accepted_encodings, publish_homepage
+from .models import (
+    Author, Book, BookRatingShard, BookRecommendation, ChangeLogEntry, City, Country, Publisher, Store, Review,
+    ReviewRollup, Task,
+)
+from .store_assignment import assign_stores, stores_assigned
+
+
+class CatalogTestCase(TestCase):
+    """
+    Базовый класс тестов с небольшим каталогом:
+    3 автора, 2 страны, 2 города, 2 издательства, 3 магазина, 4 книги и 5 отзывов.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tolstoy = Author.objects.create(name='Лев Толстой', bio='')
+        cls.pushkin = Author.objects.create(name='Александр Пушкин', bio='')
+        cls.king = Author.objects.create(name='Стивен Кинг', bio='')
+
+        cls.russia = Country.objects.create(name='Россия')
+        cls.usa = Country.objects.create(name='США')
+        cls.moscow = City.objects.create(name='Москва')
+        cls.spb = City.objects.create(name='Санкт-Петербург')
+
+        cls.eksmo = Publisher.objects.create(name='Эксмо', country=cls.russia)
+        cls.penguin = Publisher.objects.create(name='Penguin Random House', country=cls.usa)
+
+        cls.bukvoed = Store.objects.create(name='Буквоед', city=cls.moscow)
+        cls.dom_knigi = Store.objects.create(name='Дом книги', city=cls.moscow)
+        cls.labirint = Store.objects.create(name='Лабиринт', city=cls.spb)
+
+        cls.war_and_peace = Book.objects.create(
+            title='Война и мир', author=cls.tolstoy, publisher=cls.eksmo,
+            published_date=date(2015, 3, 15), description=''
+        )
+        cls.anna = Book.objects.create(
+            title='Анна Каренина', author=cls.tolstoy, publisher=cls.eksmo,
+            published_date=date(2008, 9, 12), description=''
+        )
+        cls.onegin = Book.objects.create(
+            title='Евгений Онегин', author=cls.pushkin, publisher=None,
+            published_date=date(2020, 1, 10), description=''
+        )
+        cls.shining = Book.objects.create(
+            title='Сияние', author=cls.king, publisher=cls.penguin,
+            published_date=date(2021, 11, 5), description=''
+        )
+
+        cls.war_and_peace.stores.add(cls.bukvoed, cls.dom_knigi, cls.labirint)
+        cls.anna.stores.add(cls.bukvoed)
+        cls.shining.stores.add(cls.bukvoed, cls.labirint)
+
+        Review.objects.create(book=cls.war_and_peace, rating=5, comment='')
+        Review.objects.create(book=cls.war_and_peace, rating=4, comment='')
+        Review.objects.create(book=cls.anna, rating=3, comment='')
+        Review.objects.create(book=cls.shining, rating=5, comment='')
+        Review.objects.create(book=cls.shining, rating=5, comment='')
+
+
+class DashboardSnapshotTests(CatalogTestCase):
+
+    def test_snapshot_uses_two_queries(self):
+        with self.assertNumQueries(2):
+            dashboard_snapshot()
+
+    def test_stats(self):
+        self.assertEqual(dashboard_snapshot()['stats'], {
+            'books_count': 4,
+            'authors_count': 3,
+            'publishers_count': 2,
+            'stores_count': 3,
+            'reviews_count': 5,
+        })
+
+    def test_leaderboards(self):
+        snapshot = dashboard_snapshot()
+
+        self.assertEqual(
+            [(book['title'], book['avg_rating'], book['reviews_count']) for book in snapshot['top_books']],
+            [('Сияние', 5.0, 2), ('Война и мир', 4.5, 2), ('Анна Каренина', 3.0, 1)],
+        )
+        self.assertEqual(snapshot['top_books'][0]['author'], {'name': 'Стивен Кинг'})
+        self.assertEqual(snapshot['top_books'][0]['publisher'], {'name': 'Penguin Random House'})
+
+        self.assertEqual(snapshot['top_authors'][0], {
+            'id': self.tolstoy.id, 'name': 'Лев Толстой', 'books_count': 2,
+        })
+        self.assertEqual(snapshot['top_stores'][0], {
+            'id': self.bukvoed.id, 'name': 'Буквоед', 'city': 'Москва', 'books_count': 3,
+        })
+        self.assertEqual(len(snapshot['top_authors']), 3)
+        self.assertEqual(len(snapshot['top_stores']), 3)
+
+
+executed_payloads = []
+
+
+@tasks.task('tests.record', max_attempts=2)
+def record_task(**payload):
+    executed_payloads.append(payload)
+
+
+@tasks.task('tests.fail', max_attempts=2)
+def failing_task():
+    raise RuntimeError('ошибка задачи')
+
+
+class TaskQueueTests(TestCase):
+
+    def setUp(self):
+        executed_payloads.clear()
+
+    def test_enqueue_deduplicates_pending_tasks(self):
+        self.assertTrue(tasks.enqueue('tests.record', {'book': 1}, delay=10))
+        self.assertFalse(tasks.enqueue('tests.record', {'book': 1}, priority=5, delay=20))
+        self.assertTrue(tasks.enqueue('tests.record', {'book': 2}))
+        task = Task.objects.get(payload={'book': 1})
+        self.assertEqual(task.priority, 5)
+        self.assertGreater(task.run_after, timezone.now() + timedelta(seconds=15))
+        with self.assertRaises(KeyError):
+            tasks.enqueue('tests.unknown')
+
+    def test_long_payloads_get_distinct_keys(self):
+        prefix = 'x' * 300
+        tasks.enqueue('tests.record', {'text': prefix + 'a'})
+        tasks.enqueue('tests.record', {'text': prefix + 'b'})
+        self.assertEqual(Task.objects.count(), 2)
+        self.assertLessEqual(max(len(key) for key in Task.objects.values_list('dedup_key', flat=True)), 255)
+
+    def test_claim_order_and_execution(self):
+        tasks.enqueue('tests.record', {'order': 'low'})
+        tasks.enqueue('tests.record', {'order': 'high'}, priority=10)
+        tasks.enqueue('tests.record', {'order': 'later'}, priority=20, delay=60)
+        while (task := tasks.claim_next_task()) is not None:
+            self.assertEqual(tasks.execute_task(task), Task.STATUS_DONE)
+        self.assertEqual(executed_payloads, [{'order': 'high'}, {'order': 'low'}])
+        self.assertEqual(Task.objects.filter(status=Task.STATUS_DONE, locked_until=None).count(), 2)
+        self.assertIsNone(tasks.claim_next_task())
+
+    def test_retry_with_backoff_then_failure(self):
+        tasks.enqueue('tests.fail')
+        task = tasks.claim_next_task()
+        self.assertIsNotNone(task.locked_until)
+        with self.assertLogs('books.tasks', 'ERROR'):
+            self.assertEqual(tasks.execute_task(task), Task.STATUS_PENDING)
+        task.refresh_from_db()
+        self.assertEqual(task.attempts, 1)
+        self.assertIn('ошибка задачи', task.last_error)
+        self.assertGreater(task.run_after, timezone.now() + timedelta(seconds=1))
+        self.assertIsNone(tasks.claim_next_task())
+
+        Task.objects.filter(pk=task.pk).update(run_after=timezone.now())
+        with self.assertLogs('books.tasks', 'ERROR'):
+            self.assertEqual(tasks.execute_task(tasks.claim_next_task()), Task.STATUS_FAILED)
+        self.assertEqual(Task.objects.get(pk=task.pk).attempts, 2)
+
+    def test_expired_running_task_is_reclaimed(self):
+        tasks.enqueue('tests.record', {'book': 1})
+        task = tasks.claim_next_task()
+        self.assertIsNone(tasks.claim_next_task())
+        self.assertEqual(tasks.extend_locks([task.pk]), 1)
+
+        # Воркер завершился аварийно: срок захвата истек
+        Task.objects.filter(pk=task.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        reclaimed = tasks.claim_next_task()
+        self.assertEqual((reclaimed.pk, reclaimed.attempts), (task.pk, 2))
+        self.assertGreater(reclaimed.locked_until, timezone.now())
+
+        # Попытки исчерпаны: задача помечается ошибкой, а не захватывается снова
+        Task.objects.filter(pk=task.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(tasks.claim_next_task())
+        self.assertEqual(Task.objects.get(pk=task.pk).status, Task.STATUS_FAILED)
+
+    def test_enqueue_once_skips_database_until_task_starts(self):
+        cache.clear()
+        self.assertTrue(tasks.enqueue_once('tests.record', delay=10))
+        with self.assertNumQueries(0):
+            self.assertFalse(tasks.enqueue_once('tests.record', delay=10))
+
+        task = Task.objects.get(name='tests.record')
+        Task.objects.filter(pk=task.pk).update(run_after=timezone.now())
+        tasks.execute_task(tasks.claim_next_task())
+        self.assertTrue(tasks.enqueue_once('tests.record'))
+        self.assertEqual(Task.objects.filter(name='tests.record', status=Task.STATUS_PENDING).count(), 1)
+
+
+class HotRowTests(CatalogTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def review_writes(self, book, shard):
+        """UPDATE-инструкции сохранения отзыва на книгу book (части счетчиков с номером shard)."""
+        with mock.patch('random.randrange', return_value=shard):
+            with CaptureQueriesContext(connection) as queries:
+                with self.captureOnCommitCallbacks(execute=True):
+                    Review.objects.create(book=book, rating=4, comment='')
+        return [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+
+    def test_reviews_for_different_books_touch_no_shared_row(self):
+        # Первый отзыв планирует фоновые задачи
+        self.review_writes(self.onegin, 0)
+
+        anna = self.review_writes(self.anna, 1)
+        shining = self.review_writes(self.shining, 2)
+
+        self.assertTrue(anna)
+        self.assertEqual(set(anna) & set(shining), set())
+        self.assertFalse([sql for sql in anna + shining if 'books_task' in sql])
+        self.assertEqual(Task.objects.filter(name='books.refresh_homepage_stats').count(), 1)
+
+
+def current_thread_name():
+    return threading.current_thread().name
+
+
+def failing_job():
+    raise ValueError('ошибка задания')
+
+
+class RunInParallelTests(TestCase):
+
+    def parallel_allowed(self):
+        """Снимает ограничения тестовой базы: транзакцию TestCase и SQLite в памяти."""
+        self.enterContext(mock.patch.object(connection, 'in_atomic_block', False))
+        self.enterContext(mock.patch.object(connection, 'is_in_memory_db', return_value=False))
+
+    def test_sequential_inside_transaction_and_in_memory_db(self):
+        self.assertTrue(connection.in_atomic_block)
+        self.assertFalse(can_run_in_parallel())
+        with mock.patch.object(connection, 'in_atomic_block', False):
+            self.assertTrue(connection.is_in_memory_db())
+            self.assertFalse(can_run_in_parallel())
+
+        results = run_in_parallel({'first': current_thread_name, 'books': Book.objects.none()})
+        self.assertEqual(results, {'first': threading.current_thread().name, 'books': []})
+
+    def test_jobs_run_in_pool_threads(self):
+        self.parallel_allowed()
+        self.assertTrue(can_run_in_parallel())
+        results = run_in_parallel({'first': current_thread_name, 'second': current_thread_name})
+        self.assertEqual(list(results), ['first', 'second'])
+        self.assertTrue(all(name.startswith('books-query') for name in results.values()))
+
+    def test_nested_call_runs_in_the_same_pool_thread(self):
+        self.parallel_allowed()
+
+        def nested():
+            return current_thread_name(), run_in_parallel({'a': current_thread_name, 'b': current_thread_name})
+
+        results = run_in_parallel({'outer': nested, 'other': current_thread_name})
+        outer, inner = results['outer']
+        self.assertEqual(inner, {'a': outer, 'b': outer})
+
+    def test_errors_are_propagated(self):
+        jobs = {'ok': current_thread_name, 'broken': failing_job}
+        with self.assertRaisesMessage(ValueError, 'ошибка задания'):
+            run_in_parallel(jobs)
+        self.parallel_allowed()
+        with self.assertRaisesMessage(ValueError, 'ошибка задания'):
+            run_in_parallel(jobs)
+
+
+class AssignStoresTests(CatalogTestCase):
+
+    def test_applies_diff(self):
+        result = assign_stores({
+            self.war_and_peace: {self.bukvoed, self.dom_knigi},  # -Лабиринт
+            self.onegin.id: {self.labirint.id},                  # +Лабиринт
+            self.anna: set(),                                    # -Буквоед
+        })
+
+        self.assertEqual(result, {'added': 1, 'removed': 2})
+        self.assertEqual(set(self.war_and_peace.stores.all()), {self.bukvoed, self.dom_knigi})
+        self.assertEqual(list(self.onegin.stores.all()), [self.labirint])
+        self.assertFalse(self.anna.stores.exists())
+        # Книги вне словаря не изменяются
+        self.assertEqual(set(self.shining.stores.all()), {self.bukvoed, self.labirint})
+
+    def test_sends_single_signal(self):
+        calls = []
+
+        def receiver(sender, added, removed, **kwargs):
+            calls.append((sorted(added), sorted(removed)))
+
+        stores_assigned.connect(receiver)
+        self.addCleanup(stores_assigned.disconnect, receiver)
+
+        assign_stores({self.anna: {self.dom_knigi, self.labirint}})
+        assign_stores({self.anna: {self.dom_knigi, self.labirint}})  # Без изменений
+
+        self.assertEqual(calls, [(
+            sorted([(self.anna.id, self.dom_knigi.id), (self.anna.id, self.labirint.id)]),
+            [(self.anna.id, self.bukvoed.id)],
+        )])
+
+
+class QueryPlanTests(TestCase):
+
+    def test_normalization(self):
+        rows = [
+            (2, 0, 0, 'SCAN books_book'),
+            (5, 2, 0, 'SEARCH books_author USING INTEGER PRIMARY KEY (rowid=?)'),
+            (9, 0, 0, 'USE TEMP B-TREE FOR ORDER BY'),
+        ]
+        self.assertEqual(normalize_sqlite_plan(rows), [
+            'SCAN books_book',
+            '  SEARCH books_author USING INTEGER PRIMARY KEY (rowid=?)',
+            'USE TEMP B-TREE FOR ORDER BY',
+        ])
+        node = {
+            'Node Type': 'Sort', 'Total Cost': 12.5,
+            'Plans': [{'Node Type': 'Index Scan', 'Relation Name': 'books_book',
+                       'Index Name': 'book_published_idx', 'Plan Rows': 40}],
+        }
+        self.assertEqual(normalize_postgresql_plan(node), [
+            'Sort', '  Index Scan on books_book using book_published_idx',
+        ])
+
+    def test_regressions_are_reported(self):
+        old = {
+            'books': [{'sql': 'SELECT 1', 'plan': ['SEARCH books_book USING INDEX book_published_idx (published_date>?)']}],
+            'stores': [{'sql': 'SELECT 2', 'plan': ['SCAN books_store']}],
+        }
+        new = {
+            'books': [
+                {'sql': 'SELECT 1', 'plan': ['SCAN books_book', 'USE TEMP B-TREE FOR ORDER BY']},
+                {'sql': 'SELECT 3', 'plan': ['SCAN books_review']},
+            ],
+            'stores': [{'sql': 'SELECT 2', 'plan': ['SCAN books_store']}],
+            'new_query': [{'sql': 'SELECT 4', 'plan': ['SCAN books_city']}],
+        }
+        self.assertEqual(find_regressions(old, new), [
+            'books: количество SQL-инструкций выросло с 1 до 2',
+            'books [инструкция 1]: новое полное сканирование books_book',
+            'books [инструкция 1]: временных сортировок стало 1 вместо 0',
+        ])
+        self.assertEqual(find_regressions(new, old), [])
+
+
+class FacetTests(CatalogTestCase):
+
+    def test_index_facet_counts(self):
+        index = FacetIndex.build()
+
+        book_ids, counts = index.search({'city': ['Москва']})
+
+        self.assertEqual(book_ids, sorted([self.war_and_peace.id, self.anna.id, self.shining.id]))
+        # Фасет города не сужается собственным фильтром
+        self.assertEqual(counts['city'], {'Москва': 3, 'Санкт-Петербург': 2})
+        self.assertEqual(counts['country'], {'Россия': 2, 'США': 1})
+        self.assertEqual(counts['rating'], {5: 1, 4: 1, 3: 1})
+        # Книги без отзывов попадают в корзину 0
+        self.assertEqual(index.search({})[1]['rating'][0], 1)
+
+    def assertSameIndex(self, index, expected):
+        for selected in ({}, {'city': ['Москва']}, {'country': ['Россия']}, {'rating': [0, 5]}):
+            self.assertEqual(index.search(selected), expected.search(selected))
+        self.assertEqual(index.author_names, expected.author_names)
+
+    def test_catch_up_matches_rebuild(self):
+        index = FacetIndex.build()
+        positions = len(index.book_ids)
+
+        review = Review.objects.create(book=self.onegin, rating=2, comment='')
+        # Перенос отзыва: прежняя книга остается без отзывов
+        Review.objects.filter(book=self.anna).update(book=self.onegin)
+        self.shining.stores.clear()
+        self.spb.name = 'Петербург'
+        self.spb.save()
+        self.penguin.country = self.russia
+        self.penguin.save()
+        self.pushkin.name = 'А. С. Пушкин'
+        self.pushkin.save()
+        self.war_and_peace.delete()
+        daughter = Book.objects.create(
+            title='Капитанская дочка', author=self.pushkin, publisher=self.eksmo,
+            published_date=date(2019, 5, 1), description=''
+        )
+        self.assertIsNotNone(review.pk)
+
+        index.catch_up()
+
+        self.assertSameIndex(index, FacetIndex.build())
+        self.assertEqual(index.search({'rating': [2]})[0], [self.onegin.id])
+        self.assertEqual(index.search({'rating': [0]})[0], [self.anna.id, daughter.id])
+        self.assertEqual(index.search({'city': ['Петербург']})[0], [])
+        # Новая книга заняла позицию удаленной
+        self.assertEqual(len(index.book_ids), positions)
+
+    def test_review_updates_only_its_book(self):
+        index = FacetIndex.build()
+
+        Review.objects.create(book=self.onegin, rating=4, comment='')
+        with mock.patch.object(FacetIndex, 'apply_changes', wraps=index.apply_changes) as apply_changes:
+            index.catch_up()
+
+        apply_changes.assert_called_once_with({self.onegin.id}, set())
+        self.assertEqual(index.search({'rating': [4]})[0], sorted([self.war_and_peace.id, self.onegin.id]))
+
+    def test_browse_endpoint(self):
+        response = self.client.get(
+            reverse('browse_books'), {'country': 'Россия', 'rating': ['4', '5']}
+        )
+
+        data = response.json()
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(data['results'][0]['title'], 'Война и мир')
+        # Фасет рейтинга учитывает только фильтр по стране
+        self.assertEqual(data['facets']['rating'], [
+            {'value': 3, 'label': '3', 'count': 1},
+            {'value': 4, 'label': '4', 'count': 1},
+        ])
+
+    def test_browse_endpoint_rejects_bad_year(self):
+        response = self.client.get(reverse('browse_books'), {'year': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+
+class AnalyticsSnapshotTests(CatalogTestCase):
+
+    def test_matches_sql(self):
+        snapshot = CatalogSnapshot.load()
+
+        self.assertEqual(
+            set(snapshot.books_count_by_store()),
+            {(store.id, store.books_count) for store in queries.books_count_by_store()},
+        )
+        self.assertEqual(
+            set(snapshot.stores_by_publication_date(2010)),
+            {(store.id, store.recent_books_count) for store in queries.stores_by_publication_date(2010)},
+        )
+        self.assertEqual(
+            snapshot.books_by_average_rating(4),
+            [(self.shining.id, 5.0), (self.war_and_peace.id, 4.5)],
+        )
+
+    def test_apply_changes(self):
+        snapshot = CatalogSnapshot.load()
+
+        review = Review.objects.create(book=self.onegin, rating=5, comment='')
+        self.onegin.stores.add(self.dom_knigi)
+        anna_id = self.anna.id
+        self.anna.delete()
+        snapshot.apply_changes(book_ids={self.onegin.id, anna_id}, review_ids={review.id})
+
+        self.assertEqual(
+            dict(snapshot.books_count_by_store()),
+            {self.bukvoed.id: 2, self.dom_knigi.id: 2, self.labirint.id: 2},
+        )
+        self.assertEqual(
+            snapshot.books_by_average_rating(4),
+            [(self.onegin.id, 5.0), (self.shining.id, 5.0), (self.war_and_peace.id, 4.5)],
+        )
+
+
+class SnapshotFileTests(CatalogTestCase):
+
+    def test_round_trip(self):
+        snapshot = CatalogSnapshot.load()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = write_snapshot(snapshot, Path(directory) / 'catalog.snap')
+            loaded = read_snapshot(path)
+
+            for name in CatalogSnapshot.COLUMNS:
+                self.assertEqual(getattr(loaded, name).tolist(), getattr(snapshot, name).tolist(), name)
+            self.assertEqual(loaded.store_cities(), ['Москва', 'Москва', 'Санкт-Петербург'])
+            self.assertEqual(loaded.books_count_by_store(), snapshot.books_count_by_store())
+            # Массивы ссылаются на отображение файла и не копируются
+            self.assertFalse(loaded.book_ids.flags.writeable)
+
+
+class ChangeLogTests(CatalogTestCase):
+
+    def test_captures_bulk_paths(self):
+        cursor = latest_cursor()
+
+        Book.objects.filter(id=self.onegin.id).update(title='Евгений Онегин (изд. 2)')
+        Review.objects.bulk_create([Review(book=self.onegin, rating=5, comment='')])
+        Book.stores.through.objects.filter(book_id=self.anna.id).delete()
+
+        changes = [
+            (entry.table_name, entry.operation, entry.row_id, entry.ref_id)
+            for entry in read_changes(cursor)
+        ]
+        self.assertEqual(changes[0], ('books_book', 'U', self.onegin.id, self.pushkin.id))
+        self.assertEqual(changes[1], ('books_review', 'I', Review.objects.latest('id').id, self.onegin.id))
+        self.assertEqual(changes[2], ('books_book_stores', 'D', self.anna.id, self.bukvoed.id))
+
+    def test_batches_and_cursor(self):
+        batches = list(iter_changes(0, batch_size=10))
+
+        ids = [entry.id for batch in batches for entry in batch]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(ids[-1], latest_cursor())
+        self.assertTrue(all(len(batch) <= 10 for batch in batches))
+        self.assertEqual(read_changes(latest_cursor()), [])
+
+    def test_snapshot_catches_up(self):
+        snapshot = CatalogSnapshot.load()
+
+        # Массовые операции не отправляют сигналов, но попадают в журнал
+        Review.objects.bulk_create([Review(book=self.onegin, rating=4, comment='')])
+        Book.stores.through.objects.bulk_create([
+            Book.stores.through(book_id=self.onegin.id, store_id=self.dom_knigi.id),
+        ])
+        snapshot.catch_up()
+
+        fresh = CatalogSnapshot.load()
+        self.assertEqual(snapshot.books_count_by_store(), fresh.books_count_by_store())
+        self.assertEqual(snapshot.books_by_average_rating(0), fresh.books_by_average_rating(0))
+        self.assertEqual(snapshot.cursor, fresh.cursor)
+
+    def test_rolled_back_gap_does_not_stop_reading(self):
+        cursor = latest_cursor()
+        Author.objects.create(name='Первый', bio='')
+        Author.objects.create(name='Второй', bio='')
+        Author.objects.create(name='Третий', bio='')
+        # Запись из середины как будто принадлежала откаченной транзакции
+        ChangeLogEntry.objects.filter(id=cursor + 2).delete()
+        self.assertEqual([entry.id for entry in read_changes(cursor, gap_timeout=3600)], [cursor + 1, cursor + 3])
+
+    def test_prune_keeps_unread_and_recent_entries(self):
+        old = latest_cursor()
+        ChangeLogEntry.objects.update(created_date=timezone.now() - timedelta(days=2))
+        Author.objects.create(name='Новый автор', bio='')
+        save_cursor('recommendations', old - 3)
+        held_back = ChangeLogEntry.objects.filter(id__lte=old - 3).count()
+
+        # Курсор потребителя удерживает записи после него
+        self.assertEqual(prune_changelog(), held_back)
+        self.assertEqual(pruned_cursor(), old - 3)
+        save_cursor('recommendations', old)
+        prune_changelog()
+        # Записи моложе срока хранения остаются
+        self.assertEqual(list(ChangeLogEntry.objects.values_list('id', flat=True)), [old + 1])
+
+        with self.assertRaises(ChangeLogPruned):
+            read_changes(old - 1)
+        self.assertEqual(len(read_changes(old)), 1)
+        self.assertEqual(read_changes(old + 1), [])
+
+    def test_prune_keeps_last_entry_and_ignores_stale_consumers(self):
+        save_cursor('forgotten', 0)
+        ChangeLogEntry.objects.update(created_date=timezone.now() - timedelta(days=2))
+        with override_settings(BOOKS_CHANGELOG_CONSUMER_TTL=0):
+            prune_changelog()
+        self.assertEqual(list(ChangeLogEntry.objects.values_list('id', flat=True)), [latest_cursor()])
+
+    def test_snapshot_reloads_after_prune(self):
+        snapshot = CatalogSnapshot.load()
+        Review.objects.bulk_create([Review(book=self.onegin, rating=1, comment='')])
+        Review.objects.bulk_create([Review(book=self.onegin, rating=2, comment='')])
+        ChangeLogEntry.objects.update(created_date=timezone.now() - timedelta(days=2))
+        prune_changelog()
+        with self.assertRaises(ChangeLogPruned):
+            snapshot.catch_up()
+
+    def test_prune_task_reschedules_itself(self):
+        tasks.schedule_periodic_tasks()
+        run_after = Task.objects.get(name='books.prune_changelog').run_after
+        # Повторное планирование (перезапуск воркера) не откладывает очистку
+        tasks.schedule_periodic_tasks()
+        self.assertEqual(Task.objects.get(name='books.prune_changelog').run_after, run_after)
+
+        task = Task.objects.get(name='books.prune_changelog')
+        Task.objects.filter(pk=task.pk).update(run_after=timezone.now())
+        self.assertEqual(tasks.execute_task(tasks.claim_next_task()), Task.STATUS_DONE)
+        self.assertEqual(Task.objects.filter(name='books.prune_changelog', status=Task.STATUS_PENDING).count(), 1)
+
+
+class QueryFreeStrTests(CatalogTestCase):
+    def test_review_str_without_loaded_book(self):
+        review = Review.objects.filter(book=self.anna).get()
+        with strict_str(), self.assertNumQueries(0):
+            self.assertEqual(str(review), f"Отзыв на '#{self.anna.id}' - 3/5")
+
+    def test_review_str_with_loaded_book(self):
+        review = Review.objects.select_related('book').filter(book=self.anna).get()
+        with strict_str(), self.assertNumQueries(0):
+            self.assertEqual(str(review), "Отзыв на 'Анна Каренина' - 3/5")
+
+    def test_strict_mode_raises_on_query(self):
+        class LazyReview(Review):
+            class Meta:
+                proxy = True
+
+            @query_free_str
+            def __str__(self):
+                return self.book.title
+
+        review = LazyReview.objects.filter(book=self.anna).get()
+        self.assertEqual(str(review), 'Анна Каренина')  # Вне строгого режима запрос разрешен
+        review = LazyReview.objects.filter(book=self.anna).get()
+        with strict_str(), self.assertRaises(StrQueryError):
+            str(review)
+
+    @override_settings(BOOKS_STRICT_STR=True)
+    def test_admin_changelist_query_count_is_constant(self):
+        self.client.force_login(User.objects.create_superuser('admin', '', 'password'))
+        url = reverse('admin:books_review_changelist')
+
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        Review.objects.bulk_create([
+            Review(book=book, rating=4, comment='')
+            for book in (self.anna, self.onegin, self.shining) * 20
+        ])
+        with self.assertNumQueries(len(context.captured_queries)):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        # Страница подтверждения удаления выводит количество отзывов, а не их список
+        response = self.client.get(reverse('admin:books_book_delete', args=[self.shining.id]))
+        self.assertContains(response, '<li>Отзывы: 22</li>', html=True)
+        self.assertNotContains(response, 'Отзыв на')
+
+    @override_settings(BOOKS_STRICT_STR=True)
+    def test_admin_shows_publisher_country_and_store_city(self):
+        self.client.force_login(User.objects.create_superuser('admin', '', 'password'))
+
+        response = self.client.get(reverse('admin:books_book_changelist'))
+        # Список и фильтр по издательству
+        self.assertContains(response, 'Эксмо (Россия)', count=3)
+        self.assertNotContains(response, '(#')
+
+        response = self.client.get(reverse('admin:books_book_change', args=[self.shining.id]))
+        self.assertContains(response, 'Penguin Random House (США)')
+        self.assertContains(response, 'Буквоед (г. Москва)')
+        self.assertNotContains(response, '(#')
+        self.assertNotContains(response, 'г. #')
+
+        response = self.client.get(reverse('admin:books_store_change', args=[self.labirint.id]))
+        self.assertContains(response, 'Лабиринт (г. Санкт-Петербург)')
+
+
+class BookReviewsFeedTests(CatalogTestCase):
+    def setUp(self):
+        reviews = Review.objects.bulk_create([
+            Review(book=self.onegin, rating=rating, comment=f'Отзыв {number}')
+            for number, rating in enumerate([5, 4, 5, 3, 5, 5, 2])
+        ])
+        # Одинаковое время создания проверяет упорядочивание по id внутри метки
+        now = timezone.now()
+        Review.objects.filter(id__in=[review.id for review in reviews[:4]]).update(
+            created_date=now - timedelta(days=1)
+        )
+        Review.objects.filter(id__in=[review.id for review in reviews[4:]]).update(created_date=now)
+        self.url = reverse('book_reviews', args=[self.onegin.id])
+
+    def fetch_all(self, **params):
+        ids, cursor = [], None
+        while True:
+            query = dict(params, **({'cursor': cursor} if cursor else {}))
+            data = self.client.get(self.url, query).json()
+            ids.extend(review['id'] for review in data['results'])
+            cursor = data['next_cursor']
+            if cursor is None:
+                return ids
+
+    def test_pages_cover_feed_in_order(self):
+        expected = list(
+            Review.objects.filter(book=self.onegin)
+            .order_by('-created_date', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(self.fetch_all(limit=2), expected)
+        self.assertEqual(self.fetch_all(limit=3, rating=5), list(
+            Review.objects.filter(book=self.onegin, rating=5)
+            .order_by('-created_date', '-id').values_list('id', flat=True)
+        ))
+
+    def test_page_query_count(self):
+        first = self.client.get(self.url, {'limit': 2}).json()
+        with self.assertNumQueries(2):
+            self.client.get(self.url, {'limit': 2, 'cursor': first['next_cursor']})
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(self.url, {'cursor': 'мусор'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'limit': 0}).status_code, 400)
+        missing = reverse('book_reviews', args=[10 ** 6])
+        self.assertEqual(self.client.get(missing).status_code, 404)
+
+
+class LoadTestHelpersTests(TestCase):
+    def test_seed_catalog(self):
+        books, reviews = loadtest.seed_catalog(30, reviews_per_book=2, authors=3, stores=4)
+
+        self.assertEqual((books, reviews), (30, 60))
+        self.assertEqual(Book.objects.count(), 30)
+        self.assertEqual(Review.objects.count(), 60)
+        self.assertFalse(Book.objects.filter(stores__isnull=True).exists())
+        book = Book.objects.first()
+        self.assertEqual(book_rating(book.id)['count'], 2)
+
+    def test_summarize(self):
+        result = loadtest.LoadResult(elapsed=2.0, failures=1)
+        for number in range(1, 101):
+            result.record(number / 1000, 500 if number == 100 else 200)
+
+        summary = loadtest.summarize(result, [3, 3, 5])
+        self.assertEqual(summary['requests'], 101)
+        self.assertAlmostEqual(summary['throughput'], 50.5)
+        self.assertAlmostEqual(summary['error_rate'], 2 / 101)
+        self.assertAlmostEqual(summary['latency_ms']['p50'], 50)
+        self.assertAlmostEqual(summary['latency_ms']['p99'], 99)
+        self.assertAlmostEqual(summary['queries_per_request'], 11 / 3)
+
+
+class ProfilingMiddlewareTests(CatalogTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_disabled_without_header_permission(self):
+        with override_settings(BOOKS_PROFILE_ALLOW_HEADER=False, BOOKS_PROFILE_DIR=self.directory.name):
+            response = self.client.get(reverse('browse_books'), HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(list(Path(self.directory.name).iterdir()), [])
+
+    def test_sampling_profile_by_header(self):
+        with override_settings(BOOKS_PROFILE_ALLOW_HEADER=True, BOOKS_PROFILE_DIR=self.directory.name):
+            response = self.client.get(reverse('start_page'), HTTP_X_PROFILE='sample')
+
+        summary = response.wsgi_request.profile_summary
+        self.assertEqual(response['X-Profile-Id'], summary['id'])
+        self.assertIn('template;dur=', response['Server-Timing'])
+        self.assertEqual(set(summary['phases_ms']), {'db', 'orm', 'template', 'other'})
+        self.assertGreater(summary['queries'], 0)
+        for line in Path(summary['files']['collapsed']).read_text(encoding='utf-8').splitlines():
+            stack, count = line.rsplit(' ', 1)
+            self.assertTrue(stack.startswith('books.profiling:ProfilingMiddleware.__call__'))
+            self.assertGreater(int(count), 0)
+
+    def test_cprofile_mode(self):
+        with override_settings(BOOKS_PROFILE_DIR=self.directory.name), force_profiling('cprofile'):
+            response = self.client.get(reverse('browse_books'))
+
+        summary = response.wsgi_request.profile_summary
+        self.assertEqual(summary['mode'], 'cprofile')
+        self.assertTrue(Path(summary['files']['prof']).exists())
+        self.assertTrue(Path(summary['files']['collapsed']).read_text(encoding='utf-8'))
+        self.assertGreater(summary['phases_ms']['db'], 0)
+
+    def test_concurrent_cprofile_request_is_not_profiled(self):
+        # Другой поток уже профилирует запрос cProfile
+        with _cprofile_lock, override_settings(BOOKS_PROFILE_DIR=self.directory.name), force_profiling('cprofile'):
+            response = self.client.get(reverse('browse_books'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(list(Path(self.directory.name).iterdir()), [])
+
+    def test_frame_label_without_qualname(self):
+        code = mock.Mock(spec=['co_name'], co_name='search')
+        self.assertEqual(frame_label(code, 'books.facets'), 'books.facets:search')
+
+
+class DateRangeTests(CatalogTestCase):
+    def test_published_filters(self):
+        self.assertEqual(
+            set(Book.objects.published_after(2015)), {self.onegin, self.shining}
+        )
+        self.assertEqual(
+            set(Book.objects.published_between(2008, 2015)), {self.anna, self.war_and_peace}
+        )
+        self.assertEqual(set(self.bukvoed.books.published_after(2020)), {self.shining})
+
+    def test_range_predicate_is_sargable(self):
+        sql = str(Book.objects.published_between(2010, 2012).query)
+        self.assertIn('"books_book"."published_date" >= 2010-01-01', sql)
+        self.assertIn('"books_book"."published_date" < 2013-01-01', sql)
+        self.assertNotIn('django_date_extract', sql)
+
+    @override_settings(TIME_ZONE='Asia/Vladivostok')
+    def test_aware_year_bounds_use_current_timezone(self):
+        review = Review.objects.create(book=self.onegin, rating=5, comment='')
+        # 31 декабря 2023 года 20:00 UTC - уже 2024 год во Владивостоке (UTC+10)
+        Review.objects.filter(pk=review.pk).update(
+            created_date=datetime(2023, 12, 31, 20, 0, tzinfo=dt_timezone.utc)
+        )
+        in_2024 = Review.objects.filter(year_range('created_date', 2024, 2024, aware=True))
+        self.assertEqual(list(in_2024), [review])
+
+
+class SemiJoinQueryTests(CatalogTestCase):
+    def test_books_by_city_without_duplicates(self):
+        books = queries.books_by_city('Москва')
+
+        # «Война и мир» продается в двух московских магазинах, но выводится один раз
+        self.assertEqual(
+            sorted(book.title for book in books),
+            ['Анна Каренина', 'Война и мир', 'Сияние'],
+        )
+        self.assertNotIn('DISTINCT', str(books.query))
+
+    def test_city_stores_prefetched_in_one_query(self):
+        with self.assertNumQueries(2):
+            stores = {
+                book.title: [store.name for store in book.city_stores]
+                for book in queries.books_by_city_with_stores('Москва')
+            }
+        self.assertEqual(stores['Война и мир'], ['Буквоед', 'Дом книги'])
+        self.assertEqual(stores['Сияние'], ['Буквоед'])
+
+    def test_stores_with_books(self):
+        stores = queries.stores_with_books(Book.objects.filter(author=self.king))
+        self.assertEqual(set(stores), {self.bukvoed, self.labirint})
+
+        counts = [(store.name, store.recent_books_count) for store in queries.stores_by_publication_date(2010)]
+        self.assertEqual(counts, [('Буквоед', 2), ('Лабиринт', 2), ('Дом книги', 1)])
+
+
+class BookDetailTests(CatalogTestCase):
+    def test_document_in_one_query(self):
+        url = reverse('book_detail', args=[self.shining.id])
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+
+        self.assertEqual(response['Content-Type'], 'application/json; charset=utf-8')
+        document = response.json()
+        self.assertEqual(document['title'], 'Сияние')
+        self.assertEqual(document['published_date'], '2021-11-05')
+        self.assertEqual(document['author'], {'id': self.king.id, 'name': 'Стивен Кинг'})
+        self.assertEqual(document['publisher']['country'], 'США')
+        self.assertEqual([store['name'] for store in document['stores']], ['Буквоед', 'Лабиринт'])
+        self.assertEqual(document['rating'], {'average': 5, 'count': 2})
+        self.assertEqual(
+            [review['id'] for review in document['reviews']],
+            list(self.shining.reviews.order_by('-created_date', '-id').values_list('id', flat=True)),
+        )
+
+    def test_book_without_publisher_stores_and_reviews(self):
+        document = self.client.get(reverse('book_detail', args=[self.onegin.id])).json()
+        self.assertIsNone(document['publisher'])
+        self.assertEqual(document['stores'], [])
+        self.assertEqual(document['reviews'], [])
+        self.assertEqual(document['rating'], {'average': None, 'count': 0})
+
+    def test_missing_book(self):
+        self.assertEqual(self.client.get(reverse('book_detail', args=[10 ** 6])).status_code, 404)
+
+
+class RecommendationTests(CatalogTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def recommended(self, book):
+        return [(row.recommended, round(row.score, 3)) for row in recommendations_for(book.id)]
+
+    def test_rebuild_ranks_by_shared_stores(self):
+        self.assertEqual(rebuild_recommendations(), 4)
+
+        # Общие магазины / sqrt(произведения количеств магазинов)
+        self.assertEqual(self.recommended(self.war_and_peace), [(self.shining, 0.816), (self.anna, 0.577)])
+        self.assertEqual(self.recommended(self.anna), [(self.shining, 0.707), (self.war_and_peace, 0.577)])
+        self.assertEqual(self.recommended(self.onegin), [])
+
+    def test_refresh_recomputes_only_affected_books(self):
+        rebuild_recommendations()
+        self.assertEqual(refresh_recommendations(), 0)
+
+        assign_stores({self.onegin: {self.labirint}})
+        # Онегин и книги Лабиринта; у «Анны Карениной» (только Буквоед) сходство не изменилось
+        self.assertEqual(refresh_recommendations(), 3)
+        self.assertEqual(self.recommended(self.onegin), [(self.shining, 0.707), (self.war_and_peace, 0.577)])
+        self.assertEqual(self.recommended(self.shining)[-1], (self.onegin, 0.707))
+
+    def test_refresh_without_cursor_rebuilds(self):
+        self.assertEqual(refresh_recommendations(), 4)
+
+    def test_store_changes_do_not_postpone_scheduled_refresh(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.onegin.stores.add(self.labirint)
+        task = Task.objects.get(name='books.refresh_recommendations', status=Task.STATUS_PENDING)
+
+        for store in (self.bukvoed, self.labirint):
+            with self.captureOnCommitCallbacks(execute=True):
+                assign_stores({self.onegin: {store}})
+        self.assertEqual(
+            Task.objects.get(name='books.refresh_recommendations', status=Task.STATUS_PENDING).run_after,
+            task.run_after,
+        )
+
+    def all_recommendations(self):
+        return [
+            (book_id, recommended_id, rank, round(score, 6))
+            for book_id, recommended_id, rank, score in BookRecommendation.objects.order_by(
+                'book_id', 'rank'
+            ).values_list('book_id', 'recommended_id', 'rank', 'score')
+        ]
+
+    def test_refresh_matches_rebuild(self):
+        # k=1: у книг, которым была рекомендована удаленная книга, должна появиться следующая
+        rebuild_recommendations(k=1)
+
+        self.shining.stores.clear()
+        assign_stores({self.onegin: {self.labirint, self.bukvoed}})
+        self.war_and_peace.delete()
+        refresh_recommendations(k=1)
+        refreshed = self.all_recommendations()
+
+        rebuild_recommendations(k=1)
+        self.assertEqual(refreshed, self.all_recommendations())
+        # Книга без магазинов осталась без рекомендаций
+        self.assertEqual(self.recommended(self.shining), [])
+        self.assertEqual(self.recommended(self.anna), [(self.onegin, 0.707)])
+
+    def test_refresh_removes_deleted_book(self):
+        rebuild_recommendations()
+        war_and_peace_id = self.war_and_peace.id
+        # Удаление без каскада в Python: строки рекомендаций удаляет только база данных
+        fast_delete(Book.objects.filter(pk=war_and_peace_id))
+
+        refresh_recommendations()
+
+        self.assertFalse(BookRecommendation.objects.filter(book_id=war_and_peace_id).exists())
+        self.assertFalse(BookRecommendation.objects.filter(recommended_id=war_and_peace_id).exists())
+        self.assertEqual(self.recommended(self.anna), [(self.shining, 0.707)])
+
+    def test_book_document_and_endpoint(self):
+        rebuild_recommendations()
+        document = self.client.get(reverse('book_detail', args=[self.anna.id])).json()
+        self.assertEqual([item['id'] for item in document['recommendations']], [self.shining.id, self.war_and_peace.id])
+
+        response = self.client.get(reverse('book_recommendations', args=[self.war_and_peace.id]))
+        self.assertEqual([item['title'] for item in response.json()['results']], ['Сияние', 'Анна Каренина'])
+        self.assertEqual(self.client.get(reverse('book_recommendations', args=[10 ** 6])).status_code, 404)
+
+
+class LocationTests(CatalogTestCase):
+
+    def test_filters_compare_ids(self):
+        books = queries.books_by_country('Россия')
+        sql = str(books.query)
+        self.assertIn('"books_publisher"."country_id" IN (SELECT', sql)
+        self.assertEqual(set(books), {self.war_and_peace, self.anna})
+
+        stores = Store.objects.filter(in_city([' Москва ', 'Казань']))
+        self.assertEqual(set(stores), {self.bukvoed, self.dom_knigi})
+        self.assertFalse(Publisher.objects.filter(in_country('Франция')).exists())
+
+    def test_cities_by_name_creates_missing(self):
+        cities = cities_by_name(['Москва', 'Казань ', 'Казань'])
+        self.assertEqual(cities['Москва'], self.moscow)
+        self.assertEqual(sorted(cities), ['Казань', 'Москва'])
+        self.assertEqual(City.objects.count(), 3)
+
+    def test_str_uses_loaded_lookup(self):
+        with strict_str():
+            self.assertEqual(str(Store.objects.select_related('city').get(pk=self.labirint.pk)),
+                             'Лабиринт (г. Санкт-Петербург)')
+            self.assertEqual(str(Store.objects.get(pk=self.labirint.pk)), f'Лабиринт (г. #{self.spb.id})')
+
+
+class AutocompleteTests(CatalogTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def labels(self, query, limit=10):
+        with autocomplete_index() as index:
+            return [item['label'] for item in index.search(query, limit)]
+
+    def current_index(self):
+        with autocomplete_index() as index:
+            return index
+
+    def test_normalize(self):
+        self.assertEqual(normalize('  Ёжик, в ТУМАНЕ! '), 'ежик в тумане')
+
+    def test_prefix_of_any_word_ranked_by_reviews(self):
+        # При равном количестве отзывов (2) - по алфавиту
+        self.assertEqual(self.labels('с'), ['Сияние', 'Стивен Кинг'])
+        self.assertEqual(self.labels('а'), ['Анна Каренина', 'Александр Пушкин'])
+        self.assertEqual(self.labels('ка'), ['Анна Каренина'])
+        self.assertEqual(self.labels('толс'), ['Лев Толстой'])
+        self.assertEqual(self.labels('мир'), ['Война и мир'])
+        self.assertEqual(self.labels('миры'), [])
+        self.assertEqual(self.labels('  '), [])
+
+    def test_updated_after_save_and_delete(self):
+        self.assertEqual(self.labels('еж'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            book = Book.objects.create(
+                title='Ёжик в тумане', author=self.pushkin, published_date=date(2001, 1, 1), description=''
+            )
+        self.assertEqual(self.labels('ЕЖИ'), ['Ёжик в тумане'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.delete()
+        self.assertEqual(self.labels('ёж'), [])
+
+    def test_incremental_updates_match_rebuild(self):
+        index = self.current_index()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(book=self.onegin, rating=5, comment='')
+            Review.objects.create(book=self.onegin, rating=4, comment='')
+            Review.objects.create(book=self.onegin, rating=4, comment='')
+            self.anna.title = 'Анна Аркадьевна'
+            self.anna.author = self.pushkin
+            self.anna.save()
+            self.king.name = 'Ричард Бахман'
+            self.king.save()
+            self.war_and_peace.delete()
+
+        self.assertIs(self.current_index(), index)
+        expected = AutocompleteIndex.build()
+        self.assertEqual(index.suggestions, expected.suggestions)
+        self.assertEqual(sorted(zip(index.keys, index.owners)), sorted(zip(expected.keys, expected.owners)))
+        self.assertEqual(index.short_prefixes, expected.short_prefixes)
+        # Книга с тремя новыми отзывами поднялась выше, Толстой остался без отзывов
+        self.assertEqual(self.labels('а'), ['Александр Пушкин', 'Анна Аркадьевна'])
+        self.assertEqual(self.labels('лев'), ['Лев Толстой'])
+        self.assertEqual(index.suggestions[('author', self.tolstoy.id)]['score'], 0)
+        self.assertEqual(self.labels('кинг'), [])
+
+    def test_stores_do_not_touch_index(self):
+        self.current_index()
+        version = cache.get(AUTOCOMPLETE_INDEX_VERSION_KEY)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bukvoed.name = 'Буквоед на Невском'
+            self.bukvoed.save()
+            self.moscow.name = 'Москва'
+            self.moscow.save()
+
+        self.assertEqual(cache.get(AUTOCOMPLETE_INDEX_VERSION_KEY), version)
+
+    def test_search_waits_for_catch_up_in_other_thread(self):
+        index = self.current_index()
+        anna = index.suggestions[('book', self.anna.id)]
+
+        def catch_up():
+            # Подсказка удаляется и вставляется заново с паузой между шагами
+            index.remove('book', self.anna.id)
+            time.sleep(0.001)
+            index.add(anna)
+
+        errors, results = [], set()
+
+        def search():
+            try:
+                for _ in range(100):
+                    with autocomplete_index() as current:
+                        for _ in range(20):
+                            results.add(tuple(item['label'] for item in current.search('анна')))
+                            time.sleep(0)
+            except Exception as error:
+                errors.append(error)
+
+        with mock.patch.object(AutocompleteIndex, 'catch_up', side_effect=catch_up), \
+                mock.patch('books.autocomplete.latest_cursor', return_value=0):
+            reader = threading.Thread(target=search)
+            reader.start()
+            for _ in range(100):
+                mark_autocomplete_changed()
+                with autocomplete_index():
+                    pass
+            reader.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(results, {('Анна Каренина',)})
+
+    def test_endpoint_without_queries(self):
+        self.current_index()
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('autocomplete'), {'q': 'Лев', 'limit': 5})
+        self.assertEqual(response.json()['results'], [
+            {'type': 'author', 'id': self.tolstoy.id, 'label': 'Лев Толстой', 'score': 3},
+        ])
+        self.assertEqual(self.client.get(reverse('autocomplete'), {'q': 'a', 'limit': 'x'}).status_code, 400)
+
+
+class FastDeleteTests(CatalogTestCase):
+
+    def test_database_cascade_without_collector(self):
+        BookRecommendation.objects.create(book=self.anna, recommended=self.war_and_peace, rank=1, score=0.5)
+        BookRecommendation.objects.create(book=self.shining, recommended=self.anna, rank=1, score=0.5)
+        calls = []
+
+        def receiver(sender, counts, **kwargs):
+            calls.append((sender, counts))
+
+        bulk_deleted.connect(receiver)
+        self.addCleanup(bulk_deleted.disconnect, receiver)
+
+        with CaptureQueriesContext(connection) as context:
+            counts = fast_delete(Author.objects.filter(pk=self.tolstoy.pk))
+        # Один DELETE, зависимые строки в Python не загружаются
+        # (только COUNT и суммы отзывов по дням для сводок каталога)
+        statements = [query['sql'].split()[0] for query in context.captured_queries]
+        self.assertEqual(statements.count('DELETE'), 1)
+        self.assertTrue(all(
+            query['sql'].startswith('SELECT COUNT(*)') or 'GROUP BY' in query['sql']
+            for query in context.captured_queries if query['sql'].startswith('SELECT')
+        ))
+
+        # Части счетчика и сводок выбираются случайно
+        self.assertGreater(counts.pop(BookRatingShard), 0)
+        self.assertGreater(counts.pop(ReviewRollup), 0)
+        expected = {Author: 1, Book: 2, Review: 3, Book.stores.through: 4, BookRecommendation: 2}
+        self.assertEqual(counts, expected)
+        self.assertEqual([sender for sender, _ in calls], [Author])
+        self.assertFalse(Book.objects.filter(author=self.tolstoy.pk).exists())
+        self.assertEqual(Review.objects.count(), 2)
+        self.assertEqual(Book.stores.through.objects.count(), 2)
+        self.assertFalse(BookRecommendation.objects.exists())
+        self.assertFalse(BookRatingShard.objects.filter(book__author=self.tolstoy.pk).exists())
+        self.assertTrue(Publisher.objects.filter(pk=self.eksmo.pk).exists())
+
+    def test_nothing_to_delete(self):
+        self.assertEqual(fast_delete(Publisher.objects.filter(name='Нет такого')), {})
+        with self.assertRaises(TypeError):
+            cascade_counts(Review.objects.all())
+
+    def test_admin_action_shows_counts_and_deletes(self):
+        self.client.force_login(User.objects.create_superuser('admin', '', 'password'))
+        url = reverse('admin:books_publisher_changelist')
+        data = {'action': 'delete_selected', '_selected_action': [self.eksmo.pk]}
+
+        response = self.client.post(url, data)
+        self.assertContains(response, '<li>Книги: 2</li>', html=True)
+        self.assertContains(response, '<li>Отзывы: 3</li>', html=True)
+        self.assertContains(response, 'Эксмо (Россия)')
+
+        response = self.client.post(url, {**data, 'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Book.objects.filter(publisher=self.eksmo.pk).exists())
+        self.assertEqual(Review.objects.count(), 2)
+
+    def test_admin_checks_permissions_of_registered_models_only(self):
+        user = User.objects.create_user('editor', '', 'password', is_staff=True)
+        user.user_permissions.add(Permission.objects.get(codename='delete_book'))
+        self.client.force_login(user)
+        # Счетчик оценок и сводки отзывов «Онегина» удаляются вместе с ним без отдельных прав
+        Review.objects.create(book=self.onegin, rating=4, comment='')
+        Review.objects.filter(book=self.onegin).delete()
+        self.assertTrue(BookRatingShard.objects.filter(book=self.onegin).exists())
+
+        url = reverse('admin:books_book_delete', args=[self.onegin.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['perms_lacking'], set())
+        response = self.client.post(url, {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Book.objects.filter(pk=self.onegin.pk).exists())
+
+        # Отзывы зарегистрированы в админке: без права на их удаление книгу с отзывами удалить нельзя
+        response = self.client.post(reverse('admin:books_book_delete', args=[self.anna.id]), {'post': 'yes'})
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(Book.objects.filter(pk=self.anna.pk).exists())
+
+
+@override_settings(BOOKS_RATING_SHARDS=4)
+class RatingCounterTests(CatalogTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_writes_spread_over_shards(self):
+        for rating in [1, 2, 3, 4, 5] * 8:
+            Review.objects.create(book=self.onegin, rating=rating, comment='')
+
+        shards = self.onegin.rating_shards.all()
+        self.assertLessEqual(len(shards), 4)
+        self.assertEqual(sum(shard.count for shard in shards), 40)
+        self.assertEqual(book_rating(self.onegin.id), {'count': 40, 'average': 3.0})
+        self.assertEqual(ratings_for([self.war_and_peace.id, self.anna.id]), {
+            self.war_and_peace.id: {'count': 2, 'average': 4.5},
+            self.anna.id: {'count': 1, 'average': 3.0},
+        })
+
+    def test_reads_are_cached(self):
+        book_rating(self.shining.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(book_rating(self.shining.id), {'count': 2, 'average': 5.0})
+
+    def test_update_and_delete_reviews(self):
+        review = self.war_and_peace.reviews.get(rating=4)
+        review.rating = 2
+        review.save()
+        self.assertEqual(book_rating(self.war_and_peace.id), {'count': 2, 'average': 3.5})
+
+        cache.clear()
+        review.delete()
+        self.assertEqual(book_rating(self.war_and_peace.id), {'count': 1, 'average': 5.0})
+
+        # Счетчик удаленной книги не создается заново сигналами ее отзывов
+        self.shining.delete()
+        self.assertFalse(BookRatingShard.objects.filter(book=self.shining.pk).exists())
+
+    def test_compact_and_rebuild(self):
+        for _ in range(20):
+            Review.objects.create(book=self.onegin, rating=4, comment='')
+        compact_rating_counters()
+        self.assertEqual(list(self.onegin.rating_shards.values_list('shard', 'count', 'total')), [(0, 20, 80)])
+
+        Review.objects.bulk_create([Review(book=self.onegin, rating=1, comment='')] * 5)
+        rebuild_rating_counters()
+        self.assertEqual(book_rating(self.onegin.id), {'count': 25, 'average': 3.4})
+        self.assertEqual(BookRatingShard.objects.count(), 4)
+
+
+class StaticHomepageTests(CatalogTestCase):
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        publishing = override_settings(BOOKS_HOMEPAGE_PUBLISH=True, BOOKS_HOMEPAGE_PUBLISH_DIR=self.directory)
+        publishing.enable()
+        self.addCleanup(publishing.disable)
+
+    def test_unpublished_page_is_rendered_dynamically(self):
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertContains(response, 'Война и мир')
+
+    def test_serves_compressed_file_without_queries(self):
+        files = publish_homepage()
+        self.assertEqual(files['identity'], self.directory / 'index.html')
+        self.assertTrue((self.directory / 'index.html.gz').exists())
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+            body = b''.join(response.streaming_content)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertIn('Война и мир', gzip.decompress(body).decode('utf-8'))
+
+        plain = self.client.get('/')
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertNotEqual(plain['ETag'], response['ETag'])
+
+        cached = self.client.get('/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_task_republishes_after_changes(self):
+        tasks.refresh_homepage_stats()
+        self.assertIn('Война и мир', (self.directory / 'index.html').read_text(encoding='utf-8'))
+
+        Book.objects.filter(pk=self.war_and_peace.pk).update(title='Мир и война')
+        tasks.refresh_homepage_stats()
+        page = (self.directory / 'index.html').read_text(encoding='utf-8')
+        self.assertIn('Мир и война', page)
+        self.assertIn('Мир и война', gzip.decompress((self.directory / 'index.html.gz').read_bytes()).decode('utf-8'))
+
+    def test_accepted_encodings(self):
+        self.assertEqual(accepted_encodings('gzip;q=0.5, br;q=0, identity'), {'gzip', 'identity'})
+        self.assertEqual(accepted_encodings(''), set())
+
+
+class PreparedQueryTests(CatalogTestCase):
+
+    def assertSameObjects(self, queryset, objects, *attributes):
+        expected = [[getattr(obj, name) for name in ('pk',) + attributes] for obj in queryset]
+        self.assertEqual(expected, [[getattr(obj, name) for name in ('pk',) + attributes] for obj in objects])
+
+    def test_matches_queryset_results(self):
+        self.assertSameObjects(
+            queries.books_by_country('Россия'), queries.prepared_books_by_country(' Россия '), 'title'
+        )
+        self.assertSameObjects(
+            queries.books_by_average_rating(4), queries.prepared_books_by_average_rating(4), 'avg_rating'
+        )
+        self.assertSameObjects(
+            queries.stores_by_publication_date(2010),
+            queries.prepared_stores_by_publication_date(2010),
+            'recent_books_count',
+        )
+        self.assertEqual(queries.prepared_books_by_city('Казань'), [])
+
+    def test_compiled_once(self):
+        builds = []
+
+        def build(title, since):
+            builds.append(title)
+            return Book.objects.filter(title=title, published_date__gte=since).select_related('author')
+
+        prepared = PreparedQuery(build, title=str, since=date)
+        prepared(title='Война и мир', since=date(2000, 1, 1))
+        self.assertEqual(len(builds), 2)
+
+        with self.assertNumQueries(1):
+            books = prepared(title='Война и мир', since=date(2000, 1, 1))
+            self.assertEqual(books[0].author.name, 'Лев Толстой')
+        self.assertEqual(prepared(title='Война и мир', since=date(2016, 1, 1)), [])
+        self.assertEqual(len(builds), 2)
+
+    def test_values_rows(self):
+        titles = PreparedQuery(
+            lambda author: Book.objects.filter(author_id=author).order_by('title').values_list('title', flat=True),
+            author=int,
+        )
+        self.assertEqual(titles(author=self.tolstoy.id), ['Анна Каренина', 'Война и мир'])
+
+        rows = PreparedQuery(
+            lambda rating: Review.objects.filter(rating__gte=rating).values('book__title').annotate(count=Count('id')),
+            row_class=lambda **row: (row['book__title'], row['count']),
+            rating=int,
+        )
+        self.assertIn(('Сияние', 2), rows(rating=5))
+
+    def test_same_sql_as_queryset(self):
+        compiled = queries._prepared_stores_by_publication_date.compile()
+        sql, params = queries.stores_by_publication_date(2010).query.get_compiler('default').as_sql()
+
+        self.assertEqual(compiled.sql, sql)
+        prepared_params = list(compiled.constants)
+        for position, _, adapter in compiled.slots:
+            prepared_params[position] = getattr(connection.ops, adapter)(date(2011, 1, 1))
+        self.assertEqual(prepared_params, list(params))
+
+    def test_model_rows_with_prefetch(self):
+        prepared = PreparedQuery(
+            lambda author: Book.objects.filter(author_id=author).annotate(
+                reviews_count=Count('reviews')
+            ).select_related('publisher').prefetch_related('stores').order_by('title'),
+            author=int,
+        )
+
+        books = prepared(author=self.tolstoy.id)
+
+        self.assertEqual([book.title for book in books], ['Анна Каренина', 'Война и мир'])
+        with self.assertNumQueries(0):
+            self.assertEqual([book.reviews_count for book in books], [1, 2])
+            self.assertEqual(books[0].publisher.name, 'Эксмо')
+            self.assertEqual([store.name for store in books[0].stores.all()], ['Буквоед'])
+        self.assertFalse(books[0]._state.adding)
+
+    def test_rejects_parameter_dependent_sql(self):
+        with self.assertRaises(ValueError):
+            PreparedQuery(lambda size: Book.objects.all()[:size], size=int).compile()
+        with self.assertRaises(ValueError):
+            PreparedQuery(lambda title: Book.objects.filter(title__icontains=title), title=str).compile()
+        with self.assertRaises(TypeError):
+            queries._prepared_books_by_country(city='Москва')
+
+
+class FieldPlanTests(CatalogTestCase):
+
+    def test_parse_paths(self):
+        self.assertEqual(
+            parse_paths(['title', 'author.name', 'publisher__country', 'author.bio']),
+            {'title': {}, 'author': {'name': {}, 'bio': {}}, 'publisher': {'country': {}}},
+        )
+
+    def test_loads_only_requested_fields(self):
+        books = plan_queryset(Book.objects.filter(publisher__isnull=False).order_by('title'), [
+            'title', 'author.name', 'publisher.country', 'stores.name', 'stores.city.name', 'reviews.rating',
+        ])
+        with self.assertNumQueries(3):
+            books = list(books)
+        with self.assertNumQueries(0):
+            rows = [
+                (book.title, book.author.name, str(book.publisher.country),
+                 sorted(f'{store.name}/{store.city.name}' for store in book.stores.all()),
+                 sorted(review.rating for review in book.reviews.all()))
+                for book in books
+            ]
+        self.assertIn(('Война и мир', 'Лев Толстой', 'Россия', ['Буквоед/Москва', 'Дом книги/Москва', 'Лабиринт/Санкт-Петербург'], [4, 5]), rows)
+        self.assertEqual(books[0].get_deferred_fields(), {'description', 'published_date'})
+        self.assertEqual(books[0].author.get_deferred_fields(), {'bio'})
+
+    def test_related_querysets_and_reverse_relations(self):
+        authors = plan_queryset(Author.objects.filter(pk=self.tolstoy.pk), ['name', 'books.title'], related={
+            'books': Book.objects.order_by('-title'),
+        })
+        with self.assertNumQueries(2):
+            self.assertEqual([book.title for book in authors[0].books.all()], ['Война и мир', 'Анна Каренина'])
+
+        store = plan_queryset(Store.objects.filter(pk=self.bukvoed.pk), ['books.title'])[0]
+        with self.assertNumQueries(0):
+            self.assertEqual(len(store.books.all()), store.books.count())
+
+    def test_invalid_paths(self):
+        with self.assertRaises(ValueError):
+            plan_queryset(Book, ['isbn'])
+        with self.assertRaises(ValueError):
+            plan_queryset(Book, ['title.length'])
+
+
+@override_settings(BOOKS_RATING_SHARDS=4)
+class ReviewRollupTests(CatalogTestCase):
+
+    def setUp(self):
+        for rating, day in [(5, date(2024, 1, 15)), (3, date(2024, 1, 31)), (4, date(2024, 2, 10)), (1, date(2024, 3, 1))]:
+            review = Review.objects.create(book=self.onegin, rating=rating, comment='')
+            review.created_date = datetime.combine(day, datetime.min.time(), tzinfo=dt_timezone.utc)
+            review.save()
+
+    def rollups(self):
+        """Суммы по частям: {(период, начало, книга): (количество, сумма оценок)}."""
+        return {
+            (row['period'], row['period_start'], row['book_id']): (row['count'], row['rating_sum'])
+            for row in ReviewRollup.objects.values('period', 'period_start', 'book_id').annotate(
+                count=Sum('count'), rating_sum=Sum('rating_sum')
+            ).order_by()
+            if row['count']
+        }
+
+    def test_totals_and_trends(self):
+        with self.assertNumQueries(1):
+            totals = review_totals(date(2024, 1, 1), date(2024, 3, 31), self.onegin.id)
+        self.assertEqual(totals, {'count': 4, 'average': 3.25, 'histogram': {1: 1, 2: 0, 3: 1, 4: 1, 5: 1}})
+        self.assertEqual(review_totals(date(2024, 1, 16), date(2024, 3, 31))['count'], 3)
+
+        months = review_trend(date(2024, 1, 1), date(2024, 4, 30), 'month', self.onegin.id)
+        self.assertEqual([(point['period_start'], point['count']) for point in months], [
+            (date(2024, 1, 1), 2), (date(2024, 2, 1), 1), (date(2024, 3, 1), 1), (date(2024, 4, 1), 0),
+        ])
+        weeks = review_trend(date(2024, 1, 30), date(2024, 2, 11), 'week')
+        self.assertEqual([(point['period_start'], point['count'], point['average']) for point in weeks], [
+            (date(2024, 1, 29), 1, 3.0), (date(2024, 2, 5), 1, 4.0),
+        ])
+        self.assertEqual(len(review_trend(date(2024, 1, 1), date(2024, 1, 31), 'day')), 31)
+
+    def test_full_months_are_read_from_month_rows(self):
+        ReviewRollup.objects.filter(period=ReviewRollup.DAY, period_start__month=2).delete()
+        self.assertEqual(review_totals(date(2024, 1, 20), date(2024, 3, 1), self.onegin.id)['count'], 3)
+        self.assertEqual(review_totals(date(2024, 2, 2), date(2024, 3, 1), self.onegin.id)['count'], 1)
+
+    def test_updates_and_deletes_match_rebuild(self):
+        review = self.onegin.reviews.get(rating=4)
+        review.rating = 2
+        review.created_date += timedelta(days=30)
+        review.save()
+        self.onegin.reviews.get(rating=1).delete()
+        shining_id = self.shining.id
+        Review.objects.create(book=self.shining, rating=4, comment='')
+        self.shining.delete()
+        fast_delete(Author.objects.filter(pk=self.tolstoy.pk))
+
+        incremental = self.rollups()
+        self.assertEqual(incremental[('month', date(2024, 3, 1), self.onegin.id)], (1, 2))
+        self.assertFalse(any(book_id == shining_id for _, _, book_id in incremental))
+
+        rebuild_review_rollups()
+        self.assertEqual(self.rollups(), incremental)
+        self.assertEqual(ReviewRollup.objects.filter(shard__gt=0).count(), 0)
+
+    def test_trend_endpoint(self):
+        url = reverse('review_trends')
+        response = self.client.get(url, {'start': '2024-01-01', 'end': '2024-03-31', 'bucket': 'month', 'book': self.onegin.id})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['total']['count'], 4)
+        self.assertEqual(data['results'][0], {
+            'period_start': '2024-01-01', 'count': 2, 'average': 4.0,
+            'histogram': {'1': 0, '2': 0, '3': 1, '4': 0, '5': 1},
+        })
+        self.assertEqual(self.client.get(url, {'bucket': 'year'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'start': '2024-02-01', 'end': '2024-01-01'}).status_code, 400)
@@ -3,4 +3,10 @@ from . import views
 
 urlpatterns = [
     path('', views.start_page, name='start_page'),
+    path('books/', views.browse_books, name='browse_books'),
+    path('autocomplete/', views.autocomplete, name='autocomplete'),
+    path('books/<int:book_id>/', views.book_detail, name='book_detail'),
+    path('books/<int:book_id>/recommendations/', views.book_recommendations, name='book_recommendations'),
+    path('books/<int:book_id>/reviews/', views.book_reviews, name='book_reviews'),
+    path('reviews/trend/', views.review_trends, name='review_trends'),
 ]
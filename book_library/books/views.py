@@ -1,46 +1,286 @@
-from django.shortcuts import render
-from django.db.models import Count, Avg
-from .models import Book, Author, Publisher, Store, Review
+from datetime import date, timedelta
+
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404, render
+from django.utils import timezone
+from .autocomplete import DEFAULT_LIMIT, MAX_LIMIT, autocomplete_index
+from .book_documents import fetch_book_document
+from .facets import DIMENSIONS, facet_index
+from .field_plans import plan_queryset
+from .pagination import InvalidCursor, book_reviews_page
+from .prepared import PreparedQuery
+from .recommendations import recommendations_for
+from .review_rollups import BUCKETS, review_day, review_totals, review_trend
+from .models import Book, BookRecommendation
+from .concurrency import run_in_parallel
+from .dashboard import get_cached_snapshot, dashboard_snapshot, cache_snapshot
+
+
+# Сколько рекомендаций показывается в карточке книги на главной странице
+HOMEPAGE_RECOMMENDATIONS = 3
+
+# Поля книги, которые выводит шаблон главной страницы (см. field_plans.py)
+HOMEPAGE_BOOK_FIELDS = [
+    'title', 'published_date', 'author.name', 'publisher.name', 'publisher.country',
+    'stores.name', 'reviews.id', 'recommendations.recommended.title',
+]
+
+# Книги главной страницы: SQL компилируется один раз (см. prepared.py)
+homepage_books = PreparedQuery(
+    lambda: plan_queryset(Book, HOMEPAGE_BOOK_FIELDS, related={
+        'recommendations': BookRecommendation.objects.filter(rank__lte=HOMEPAGE_RECOMMENDATIONS),
+    })
+)
 
 
 def start_page(request):
     """
     Главная страница с демонстрацией наших данных и запросов.
+    
+    В режиме публикации (BOOKS_HOMEPAGE_PUBLISH) страница отдается
+    из заранее отрисованного файла (см. static_homepage.py), а сюда
+    запрос доходит, только пока файл еще не создан.
+    """
+    return render(request, 'index.html', homepage_context())
+
+
+def homepage_context():
     """
-    # Получаем статистику
-    stats = {
-        'books_count': Book.objects.count(),
-        'authors_count': Author.objects.count(),
-        'publishers_count': Publisher.objects.count(),
-        'stores_count': Store.objects.count(),
-        'reviews_count': Review.objects.count(),
+    Контекст шаблона главной страницы.
+    
+    Статистика и рейтинги берутся из снимка dashboard_snapshot()
+    (два запроса, обычно из кэша). Независимые запросы страницы
+    выполняются параллельно: время ответа близко к самому медленному запросу.
+    """
+    # Снимок статистики берется из кэша (пересчитывается фоновой задачей)
+    snapshot = get_cached_snapshot()
+    
+    jobs = {
+        # Книги с оптимизированным запросом
+        'books': homepage_books,
     }
     
-    # Получаем книги с оптимизированным запросом
-    books = Book.objects.select_related('author', 'publisher').prefetch_related('stores', 'reviews').all()
-    
-    # Топ-3 книги по рейтингу
-    top_books = Book.objects.annotate(
-        avg_rating=Avg('reviews__rating'),
-        reviews_count=Count('reviews')
-    ).filter(reviews_count__gt=0).order_by('-avg_rating')[:3]
-    
-    # Самые продуктивные авторы
-    top_authors = Author.objects.annotate(
-        books_count=Count('books')
-    ).order_by('-books_count')[:3]
-    
-    # Магазины с наибольшим ассортиментом
-    top_stores = Store.objects.annotate(
-        books_count=Count('books')
-    ).order_by('-books_count')[:3]
-    
-    context = {
-        'stats': stats,
-        'books': books,
-        'top_books': top_books,
-        'top_authors': top_authors,
-        'top_stores': top_stores,
+    # При промахе кэша считаем снимок вместе с остальными запросами
+    if snapshot is None:
+        jobs['snapshot'] = dashboard_snapshot
+    
+    results = run_in_parallel(jobs)
+    
+    if snapshot is None:
+        snapshot = cache_snapshot(results['snapshot'])
+    
+    return {
+        'stats': snapshot['stats'],
+        'books': results['books'],
+        'top_books': snapshot['top_books'],
+        'top_authors': snapshot['top_authors'],
+        'top_stores': snapshot['top_stores'],
     }
+
+
+
+# Измерения фасетов с целочисленными значениями
+INTEGER_DIMENSIONS = ('rating', 'year', 'author')
+
+BROWSE_BOOK_FIELDS = ['title', 'published_date', 'author.name', 'publisher.name', 'publisher.country.name']
+
+BROWSE_PAGE_SIZE = 20
+BROWSE_MAX_PAGE_SIZE = 100
+
+
+def browse_books(request):
+    """
+    Поиск книг с фасетами (JSON).
+    
+    Параметры (каждый можно повторять, значения объединяются по ИЛИ):
+    country, city, rating (целая часть средней оценки, 0 - без отзывов),
+    year, author (id автора); limit и offset для постраничного вывода.
+    
+    Подходящие книги и количество книг для каждого значения фасетов
+    берутся из индекса в памяти (см. facets.py), из базы загружается
+    только текущая страница книг.
+    """
+    selected = {}
+    try:
+        for dimension in DIMENSIONS:
+            values = request.GET.getlist(dimension)
+            if dimension in INTEGER_DIMENSIONS:
+                values = [int(value) for value in values]
+            selected[dimension] = values
+        limit = min(int(request.GET.get('limit', BROWSE_PAGE_SIZE)), BROWSE_MAX_PAGE_SIZE)
+        offset = int(request.GET.get('offset', 0))
+    except ValueError:
+        return JsonResponse({'error': 'Некорректное значение параметра'}, status=400)
+    if limit < 0 or offset < 0:
+        return JsonResponse({'error': 'Некорректное значение параметра'}, status=400)
+    
+    with facet_index() as index:
+        book_ids, counts = index.search(selected)
+        facets = {
+            dimension: [
+                {'value': value, 'label': index.label(dimension, value), 'count': count}
+                for value, count in sorted(values.items(), key=lambda item: (-item[1], str(item[0])))
+            ]
+            for dimension, values in counts.items()
+        }
+    
+    page_ids = book_ids[offset:offset + limit]
+    books = plan_queryset(Book.objects.filter(id__in=page_ids), BROWSE_BOOK_FIELDS).order_by('id')
+    
+    results = [
+        {
+            'id': book.id,
+            'title': book.title,
+            'author': book.author.name,
+            'publisher': book.publisher.name if book.publisher else None,
+            'country': book.publisher.country.name if book.publisher else None,
+            'published_date': book.published_date.isoformat(),
+        }
+        for book in books
+    ]
+    
+    return JsonResponse({
+        'total': len(book_ids),
+        'limit': limit,
+        'offset': offset,
+        'results': results,
+        'facets': facets,
+    }, json_dumps_params={'ensure_ascii': False})
+
+
+
+REVIEWS_PAGE_SIZE = 20
+REVIEWS_MAX_PAGE_SIZE = 100
+
+
+def book_reviews(request, book_id):
+    """
+    Отзывы книги от новых к старым (JSON) с постраничным выводом по ключу.
+    
+    Параметры: cursor (значение next_cursor предыдущей страницы),
+    limit, rating (только отзывы с этой оценкой).
+    """
+    get_object_or_404(Book.objects.only('id'), pk=book_id)
+    try:
+        limit = min(int(request.GET.get('limit', REVIEWS_PAGE_SIZE)), REVIEWS_MAX_PAGE_SIZE)
+        rating = request.GET.get('rating')
+        rating = int(rating) if rating else None
+        if limit < 1:
+            raise ValueError(limit)
+        reviews, next_cursor = book_reviews_page(
+            book_id, request.GET.get('cursor'), limit, rating
+        )
+    except (ValueError, InvalidCursor):
+        return JsonResponse({'error': 'Некорректное значение параметра'}, status=400)
     
-    return render(request, 'index.html', context)
\ No newline at end of file
+    results = [
+        {
+            'id': review.id,
+            'rating': review.rating,
+            'comment': review.comment,
+            'created_date': review.created_date.isoformat(),
+        }
+        for review in reviews
+    ]
+    
+    return JsonResponse({
+        'results': results,
+        'next_cursor': next_cursor,
+    }, json_dumps_params={'ensure_ascii': False})
+
+
+
+def book_detail(request, book_id):
+    """
+    Карточка книги (JSON): автор, издательство, магазины, сводка оценок
+    и последние отзывы.
+    
+    Документ собирается базой данных одним запросом (см. book_documents.py)
+    и передается в ответ как есть, без создания объектов моделей.
+    """
+    document = fetch_book_document(book_id)
+    if document is None:
+        raise Http404('Книга не найдена')
+    return HttpResponse(document, content_type='application/json; charset=utf-8')
+
+
+
+RECOMMENDATION_FIELDS = ['score', 'recommended.title', 'recommended.author.name']
+
+
+def book_recommendations(request, book_id):
+    """
+    Книги, которые продаются в тех же магазинах (JSON),
+    из таблицы рекомендаций (см. recommendations.py).
+    """
+    get_object_or_404(Book.objects.only('id'), pk=book_id)
+    results = [
+        {
+            'id': recommendation.recommended_id,
+            'title': recommendation.recommended.title,
+            'author': recommendation.recommended.author.name,
+            'score': round(recommendation.score, 4),
+        }
+        for recommendation in plan_queryset(recommendations_for(book_id), RECOMMENDATION_FIELDS)
+    ]
+    return JsonResponse({'results': results}, json_dumps_params={'ensure_ascii': False})
+
+
+TREND_DAYS = 30
+TREND_MAX_DAYS = 366 * 10
+
+
+def review_trends(request):
+    """
+    Динамика отзывов (JSON): количество, средняя оценка и гистограмма оценок
+    по дням, неделям или месяцам.
+    
+    Параметры: start и end (ГГГГ-ММ-ДД, по умолчанию - последние 30 дней),
+    bucket (day, week или month), book (id книги, без него - весь каталог).
+    Ответ строится по сводкам отзывов (см. review_rollups.py), а не по отзывам.
+    """
+    try:
+        end = request.GET.get('end')
+        end = date.fromisoformat(end) if end else review_day(timezone.now())
+        start = request.GET.get('start')
+        start = date.fromisoformat(start) if start else end - timedelta(days=TREND_DAYS - 1)
+        bucket = request.GET.get('bucket', 'day')
+        book_id = request.GET.get('book')
+        book_id = int(book_id) if book_id else None
+        if bucket not in BUCKETS or start > end or (end - start).days >= TREND_MAX_DAYS:
+            raise ValueError(bucket)
+    except ValueError:
+        return JsonResponse({'error': 'Некорректное значение параметра'}, status=400)
+    
+    def serialize(summary):
+        return {**summary, 'histogram': {str(rating): count for rating, count in summary['histogram'].items()}}
+    
+    return JsonResponse({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'bucket': bucket,
+        'book': book_id,
+        'total': serialize(review_totals(start, end, book_id)),
+        'results': [
+            {**serialize(point), 'period_start': point['period_start'].isoformat()}
+            for point in review_trend(start, end, bucket, book_id)
+        ],
+    }, json_dumps_params={'ensure_ascii': False})
+
+
+def autocomplete(request):
+    """
+    Подсказки по началу слова названия книги или имени автора (JSON).
+    
+    Параметры: q - введенный текст, limit - количество подсказок.
+    Ответ строится по индексу в памяти (см. autocomplete.py) без запросов
+    к базе данных, поэтому его можно вызывать на каждое нажатие клавиши.
+    """
+    try:
+        limit = min(int(request.GET.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+    except ValueError:
+        return JsonResponse({'error': 'Некорректное значение параметра'}, status=400)
+    query = request.GET.get('q', '')
+    with autocomplete_index() as index:
+        results = index.search(query, limit)
+    return JsonResponse({'query': query, 'results': results}, json_dumps_params={'ensure_ascii': False})
@@ -7,9 +7,11 @@
 python manage.py shell -c "from demo import run_full_demo; run_full_demo()"
 """
 
-from books.models import Author, Book, Publisher, Store, Review
+from books.models import Author, Book, City, Country, Publisher, Store, Review
 from books.queries import run_all_queries
 from books.optimized_queries import run_optimization_comparison
+from books.dashboard import fetch_stats
+from books.field_plans import plan_queryset
 
 
 def print_header(title, emoji="🔥"):
@@ -22,12 +24,14 @@ def show_database_statistics():
     """Показывает общую статистику базы данных."""
     print_header("СТАТИСТИКА БАЗЫ ДАННЫХ", "📊")
     
+    # Все пять COUNT выполняются одним запросом
+    counts = fetch_stats()
     stats = {
-        "Авторов": Author.objects.count(),
-        "Издательств": Publisher.objects.count(), 
-        "Магазинов": Store.objects.count(),
-        "Книг": Book.objects.count(),
-        "Отзывов": Review.objects.count()
+        "Авторов": counts['authors_count'],
+        "Издательств": counts['publishers_count'],
+        "Магазинов": counts['stores_count'],
+        "Книг": counts['books_count'],
+        "Отзывов": counts['reviews_count'],
     }
     
     for category, count in stats.items():
@@ -38,8 +42,11 @@ def show_model_relationships():
     """Демонстрирует связи между моделями на примерах."""
     print_header("ДЕМОНСТРАЦИЯ СВЯЗЕЙ МЕЖДУ МОДЕЛЯМИ", "🔗")
     
-    # Пример книги со всеми связями
-    book = Book.objects.select_related('author', 'publisher').prefetch_related('stores', 'reviews').first()
+    # Пример книги со всеми связями: план загрузки строится по выводимым полям
+    book = plan_queryset(Book, [
+        'title', 'author.name', 'publisher.name', 'publisher.country',
+        'stores.name', 'stores.city', 'reviews.rating',
+    ]).first()
     
     if book:
         print(f"📖 Книга: '{book.title}'")
@@ -96,23 +103,24 @@ def show_countries_and_cities():
     print_header("ГЕОГРАФИЧЕСКОЕ РАСПРЕДЕЛЕНИЕ", "🌍")
     
     # Страны издательств
+    # Группировка по целочисленному ключу справочника, а не по строке
     from django.db.models import Count
-    countries = Publisher.objects.values('country').annotate(
-        count=Count('id')
-    ).order_by('-count')
+    countries = Country.objects.annotate(
+        count=Count('publishers')
+    ).filter(count__gt=0).order_by('-count')
     
     print("🏢 Издательства по странам:")
-    for country_data in countries:
-        print(f"   • {country_data['country']}: {country_data['count']} издательств")
+    for country in countries:
+        print(f"   • {country.name}: {country.count} издательств")
     
     # Города магазинов
-    cities = Store.objects.values('city').annotate(
-        count=Count('id')
-    ).order_by('-count')
+    cities = City.objects.annotate(
+        count=Count('stores')
+    ).filter(count__gt=0).order_by('-count')
     
     print("\n🏪 Магазины по городам:")
-    for city_data in cities:
-        print(f"   • {city_data['city']}: {city_data['count']} магазинов")
+    for city in cities:
+        print(f"   • {city.name}: {city.count} магазинов")
 
 
 def test_admin_functionality():